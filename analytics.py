@@ -0,0 +1,146 @@
+"""alerts.db の集計表に対する問い合わせ
+
+save_dividend / save_lowcheck / save_portfolio が同じトランザクションで更新する集計表
+（store.py の _v6）を読む。履歴を走査しないので、どの問い合わせも主キー・索引の引き当てだけで済む。
+
+- code_rollup: (スクリーン, 銘柄) ごとの初出日・最終日・現在の連続期間数（dividend は週、lowcheck は日）
+- portfolio_totals: (日付, セッション) ごとの合計時価
+
+Usage:
+    python analytics.py code 7203                # 銘柄のスクリーンごとの初出・最終・連続
+    python analytics.py streaks dividend --top 20 # 直近の実行に載った銘柄を連続の長い順に
+    python analytics.py new lowcheck             # 直近の実行の新規・継続
+    python analytics.py portfolio --session 終値 --days 30
+    python analytics.py rebuild                  # アーカイブ込みの全履歴から集計表を作り直す
+"""
+
+import argparse
+import logging
+from datetime import date, datetime, timezone, timedelta
+
+import store
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+UNITS = {"week": "w", "day": "d"}
+
+
+def seen(screen: str, row: dict | None, today: str) -> str:
+    """レポートの注記: 初登場は NEW、間が空いての再登場は back、連続中は 3w / 12d（今回を含む期間数）。"""
+    if row is None:
+        return ""
+    if row["first_day"] == today:
+        return "NEW"
+    if row["streak"] == 1:
+        return "back"
+    return f"{row['streak']}{UNITS[store.ROLLUP_PERIODS[screen]]}"
+
+
+def annotate(screen: str, codes: list[str]) -> dict[str, str]:
+    """codes それぞれの注記 {code: seen()}。当日分を保存した後に呼ぶ。"""
+    today = datetime.now(JST).date().isoformat()
+    rows = store.load_streaks(screen, codes)
+    return {code: seen(screen, rows.get(code), today) for code in codes}
+
+
+def code(c: str) -> list[dict]:
+    """銘柄のスクリーンごとの集計。"""
+    out = []
+    for screen in store.ROLLUP_PERIODS:
+        row = store.load_streaks(screen, [c]).get(c)
+        if row:
+            out.append({"screen": screen, **row})
+    return out
+
+
+def latest_period(screen: str) -> str | None:
+    return store.get().select("SELECT MAX(period) FROM screen_periods WHERE screen = ?", (screen,))[0][0]
+
+
+def current(screen: str, top: int | None = None) -> list[dict]:
+    """直近の実行期間に載った銘柄を、連続期間数の長い順（同じならコード順）に返す。"""
+    p = latest_period(screen)
+    cols = ["code", "first_day", "streak_start", "streak", "periods"]
+    rows = store.get().select(
+        f"SELECT {', '.join(cols)} FROM code_rollup WHERE screen = ? AND last_period = ? "
+        f"ORDER BY streak DESC, code LIMIT ?",
+        (screen, p, top or -1),
+    )
+    return [dict(zip(cols, r)) for r in rows]
+
+
+def portfolio_series(session: str | None = None, days: int = 30) -> list[tuple]:
+    """(day, session, total, n_codes) を日付順に。days は今日から遡る日数。"""
+    start = (datetime.now(JST).date() - timedelta(days=days)).isoformat()
+    sql = "SELECT day, session, total, n_codes FROM portfolio_totals WHERE day >= ?"
+    params: tuple = (start,)
+    if session:
+        sql += " AND session = ?"
+        params += (session,)
+    return store.get().select(sql + " ORDER BY day, ts", params)
+
+
+def rebuild():
+    """アーカイブと alerts.db の全履歴から集計表を作り直す（アーカイブを入れ替えた後など）。"""
+    import archive
+
+    days: dict[str, dict[str, list[str]]] = {}
+    for screen in store.ROLLUP_PERIODS:
+        df = archive.query(screen)
+        days[screen] = {day: g["code"].tolist() for day, g in df.groupby("day")}
+    df = archive.query("portfolio")
+    totals = [
+        (day, session, g["ts"].max(), float(g["value"].sum()), len(g))
+        for (day, session), g in df.groupby(["day", "session"])
+    ]
+    store.get().rebuild_rollups(days, totals)
+    logger.info(
+        "集計表を再構築: " + ", ".join(f"{s} {len(d)}日" for s, d in days.items()) + f", portfolio {len(totals)}件"
+    )
+
+
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="alerts.db の集計表に対する問い合わせ")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("code", help="銘柄のスクリーンごとの初出・最終・連続")
+    p.add_argument("code")
+    p = sub.add_parser("streaks", help="直近の実行に載った銘柄を連続の長い順に")
+    p.add_argument("screen", choices=list(store.ROLLUP_PERIODS))
+    p.add_argument("--top", type=int, default=20)
+    p = sub.add_parser("new", help="直近の実行の新規・継続")
+    p.add_argument("screen", choices=list(store.ROLLUP_PERIODS))
+    p = sub.add_parser("portfolio", help="セッションごとの合計時価の推移")
+    p.add_argument("--session")
+    p.add_argument("--days", type=int, default=30)
+    sub.add_parser("rebuild", help="全履歴から集計表を作り直す")
+    args = parser.parse_args(argv)
+
+    if args.command == "code":
+        for r in code(args.code):
+            print(f"{r['screen']:<9} first {r['first_day']}  last {r['last_day']}  "
+                  f"streak {r['streak']} (since {r['streak_start']})  periods {r['periods']}")
+    elif args.command == "streaks":
+        unit = UNITS[store.ROLLUP_PERIODS[args.screen]]
+        print(f"{args.screen}  {latest_period(args.screen)}")
+        for r in current(args.screen, args.top):
+            print(f"  {r['code']}  {r['streak']:>4}{unit}  since {r['streak_start']}  first {r['first_day']}")
+    elif args.command == "new":
+        rows = current(args.screen)
+        today = latest_period(args.screen)
+        new = [r["code"] for r in rows if r["periods"] == 1]
+        back = [r["code"] for r in rows if r["streak"] == 1 and r["periods"] > 1]
+        cont = [r["code"] for r in rows if r["streak"] > 1]
+        print(f"{args.screen}  {today}: {len(rows)}銘柄（新規 {len(new)} / 再登場 {len(back)} / 継続 {len(cont)}）")
+        print(f"  新規: {' '.join(new) or '-'}")
+        print(f"  再登場: {' '.join(back) or '-'}")
+    elif args.command == "portfolio":
+        for day, session, total, n in portfolio_series(args.session, args.days):
+            print(f"{day} {date.fromisoformat(day):%a} {session:<8} {total:>15,.0f}  ({n}銘柄)")
+    else:
+        rebuild()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""alerts.db の履歴の列指向アーカイブ
+
+締まった月（既定では当月と前月より前）の portfolio / lowcheck / dividend の行を alerts.db から
+ARCHIVE_DIR/<table>/<YYYY-MM>.npz に移す。列ごとに NumPy 配列で持ち、コード・銘柄名・業種・
+セッションは辞書（月ごとの一意な文字列）への番号、ts はエポック マイクロ秒、day は日付型にして
+まとめて圧縮する。移した後は VACUUM して alerts.db を縮める。
+
+query() はアーカイブと alerts.db の両方から読み、1つの DataFrame にして返す。
+アーカイブは毎回の Artifact（alerts-db）には含めず、圧縮を行う alert.yml だけが
+alerts-archive として復元・保存する。
+
+Usage:
+    python archive.py                                  # 締まった月を圧縮
+    python archive.py --stats                          # パーティションと alerts.db の大きさ
+    python archive.py --query dividend --code 7203     # アーカイブ込みで行を CSV 出力
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+from datetime import date, datetime, timezone, timedelta
+
+import numpy as np
+import pandas as pd
+
+import store
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "archive")
+KEEP_MONTHS = int(os.environ.get("ARCHIVE_KEEP_MONTHS", "2"))  # alerts.db に残す月数（当月を含む）
+
+# テーブル -> (一意キー, [(列, 型)])。型は dict（辞書番号）/ ts / day / float / int
+TABLES = {
+    "portfolio": (
+        ["day", "session", "account", "code"],
+        [("ts", "ts"), ("day", "day"), ("session", "dict"), ("account", "dict"), ("code", "dict"),
+         ("shares", "int"), ("price", "float"), ("value", "float"), ("change_pct", "float"),
+         ("prev_close", "float"), ("cost", "float")],
+    ),
+    "lowcheck": (
+        ["day", "code"],
+        [("ts", "ts"), ("day", "day"), ("code", "dict"), ("name", "dict"), ("price", "float"),
+         ("low_26w", "float"), ("pct_26w", "float"), ("low_52w", "float"), ("pct_52w", "float")],
+    ),
+    "dividend": (
+        ["day", "code"],
+        [("ts", "ts"), ("day", "day"), ("code", "dict"), ("name", "dict"), ("sector", "dict"),
+         ("price", "float"), ("dividend_yield", "float"), ("annual_dividend", "float")],
+    ),
+}
+
+
+def _path(table: str, month: str) -> str:
+    return os.path.join(ARCHIVE_DIR, table, f"{month}.npz")
+
+
+def _months(table: str) -> list[str]:
+    return sorted(os.path.splitext(os.path.basename(p))[0] for p in glob.glob(_path(table, "*")))
+
+
+def _encode(df: pd.DataFrame, columns: list[tuple[str, str]]) -> dict[str, np.ndarray]:
+    arrays = {}
+    for col, kind in columns:
+        if kind == "dict":
+            values, codes = np.unique(df[col].to_numpy(dtype=str), return_inverse=True)
+            arrays[col] = codes.astype(np.int32)
+            arrays[f"{col}.dict"] = values
+        elif kind == "ts":
+            ts = pd.to_datetime(df[col].map(datetime.fromisoformat), utc=True)
+            arrays[col] = ts.to_numpy(dtype="datetime64[us]").astype(np.int64)
+        elif kind == "day":
+            arrays[col] = pd.to_datetime(df[col]).to_numpy(dtype="datetime64[D]")
+        elif kind == "int":
+            arrays[col] = df[col].to_numpy(dtype=np.int64)
+        else:
+            arrays[col] = df[col].to_numpy(dtype=np.float64)
+    return arrays
+
+
+def _decode(arrays, columns: list[tuple[str, str]]) -> pd.DataFrame:
+    cols = {}
+    for col, kind in columns:
+        if col not in arrays:
+            # 後から足した列（portfolio の account / cost）は古いパーティションに無い
+            cols[col] = "" if kind == "dict" else np.nan
+        elif kind == "dict":
+            cols[col] = arrays[f"{col}.dict"][arrays[col]]
+        elif kind == "ts":
+            ts = pd.to_datetime(arrays[col], unit="us", utc=True).tz_convert(JST)
+            cols[col] = [t.isoformat() for t in ts.to_pydatetime()]
+        elif kind == "day":
+            cols[col] = np.datetime_as_string(arrays[col], unit="D")
+        else:
+            cols[col] = arrays[col]
+    return pd.DataFrame(cols)
+
+
+def read_partition(table: str, month: str) -> pd.DataFrame:
+    """アーカイブの1か月分（無ければ空の DataFrame）。"""
+    columns = TABLES[table][1]
+    try:
+        with np.load(_path(table, month), allow_pickle=False) as arrays:
+            return _decode(arrays, columns)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=[c for c, _ in columns])
+
+
+def write_partition(table: str, month: str, df: pd.DataFrame):
+    path = _path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **_encode(df, TABLES[table][1]))
+    os.replace(tmp, path)
+
+
+def _live(table: str, where: str = "", params: tuple = ()) -> pd.DataFrame:
+    cols = [c for c, _ in TABLES[table][1]]
+    rows = store.get().select(f"SELECT {', '.join(cols)} FROM {table} {where}", params)
+    return pd.DataFrame(rows, columns=cols)
+
+
+def _merge(table: str, frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """frames を連結し、一意キーが重なった行は後の frame を残す。"""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=[c for c, _ in TABLES[table][1]])
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates(TABLES[table][0], keep="last").sort_values(["day", "code"], ignore_index=True)
+
+
+def cutoff(today: date, keep_months: int = KEEP_MONTHS) -> str:
+    """alerts.db に残す最初の月（YYYY-MM）。これより前の月を圧縮する。"""
+    m = today.year * 12 + today.month - 1 - (keep_months - 1)
+    return f"{m // 12:04d}-{m % 12 + 1:02d}"
+
+
+def compact(keep_months: int = KEEP_MONTHS) -> dict[str, int]:
+    """締まった月の行をアーカイブに移し、alerts.db から消して VACUUM する。
+
+    同じ月のパーティションが既にあれば合わせて書き直す（キーが重なる行は alerts.db 側を残す）。
+    ファイルを書いてから行を消すので、途中で止まっても行は失われない。
+
+    Returns:
+        {table: 移した行数}
+    """
+    first_live = cutoff(datetime.now(JST).date(), keep_months)
+    moved = {}
+    for table in TABLES:
+        moved[table] = 0
+        months = [r[0] for r in store.get().select(
+            f"SELECT DISTINCT substr(day, 1, 7) FROM {table} WHERE substr(day, 1, 7) < ? ORDER BY 1",
+            (first_live,),
+        )]
+        for month in months:
+            live = _live(table, "WHERE substr(day, 1, 7) = ?", (month,))
+            write_partition(table, month, _merge(table, [read_partition(table, month), live]))
+            with store.get().transaction() as conn:
+                conn.execute(f"DELETE FROM {table} WHERE substr(day, 1, 7) = ?", (month,))
+            moved[table] += len(live)
+            logger.info(f"{table} {month}: {len(live)}行をアーカイブ -> {_path(table, month)}")
+    if any(moved.values()):
+        store.get().vacuum()
+    return moved
+
+
+def query(table: str, start: str | None = None, end: str | None = None,
+          codes: list[str] | None = None) -> pd.DataFrame:
+    """アーカイブと alerts.db をまとめて読む。
+
+    Args:
+        table: portfolio / lowcheck / dividend
+        start, end: day の範囲（YYYY-MM-DD、両端を含む。省略時は制限なし）
+        codes: 銘柄コード（"7203" 形式）で絞る
+
+    Returns:
+        pd.DataFrame: TABLES の列を day・code 順に並べたもの
+    """
+    if table not in TABLES:
+        raise ValueError(f"未知のテーブル {table!r}（使えるのは {', '.join(TABLES)}）")
+    frames = []
+    for month in _months(table):
+        if (start and month < start[:7]) or (end and month > end[:7]):
+            continue
+        frames.append(read_partition(table, month))
+
+    where, params = [], []
+    if start:
+        where.append("day >= ?")
+        params.append(start)
+    if end:
+        where.append("day <= ?")
+        params.append(end)
+    if codes:
+        where.append(f"code IN ({', '.join('?' * len(codes))})")
+        params.extend(codes)
+    frames.append(_live(table, "WHERE " + " AND ".join(where) if where else "", tuple(params)))
+
+    df = _merge(table, frames)
+    if start:
+        df = df[df["day"] >= start]
+    if end:
+        df = df[df["day"] <= end]
+    if codes:
+        df = df[df["code"].isin(codes)]
+    return df.reset_index(drop=True)
+
+
+def stats() -> str:
+    lines = [f"alerts.db: {os.path.getsize(store.DB_PATH) / 1024:,.0f} KB"]
+    for table in TABLES:
+        months = _months(table)
+        size = sum(os.path.getsize(_path(table, m)) for m in months)
+        live = store.get().select(f"SELECT COUNT(*) FROM {table}")[0][0]
+        span = f"{months[0]}〜{months[-1]}" if months else "-"
+        lines.append(f"{table:<10} live {live:>8,}行  archive {len(months):>3}か月 {span:<17} {size / 1024:>8,.0f} KB")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="alerts.db の履歴の圧縮とアーカイブ込みの読み出し")
+    parser.add_argument("--keep-months", type=int, default=KEEP_MONTHS, help="alerts.db に残す月数（当月を含む）")
+    parser.add_argument("--stats", action="store_true", help="パーティションと alerts.db の大きさを表示する")
+    parser.add_argument("--query", choices=list(TABLES), help="このテーブルをアーカイブ込みで CSV 出力する")
+    parser.add_argument("--code", nargs="+", help="--query の銘柄コード")
+    parser.add_argument("--start", help="--query の開始日（YYYY-MM-DD）")
+    parser.add_argument("--end", help="--query の終了日（YYYY-MM-DD）")
+    args = parser.parse_args(argv)
+
+    if args.query:
+        query(args.query, args.start, args.end, args.code).to_csv(sys.stdout, index=False)
+        return
+    if not args.stats:
+        moved = compact(args.keep_months)
+        logger.info("圧縮完了: " + ", ".join(f"{t} {n}行" for t, n in moved.items()))
+    print(stats())
+
+
+if __name__ == "__main__":
+    main()
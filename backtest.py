@@ -0,0 +1,156 @@
+"""配当・安値スクリーニングの過去日リプレイ
+
+期間内の全営業日について、その日に main.py / lowcheck.py を実行していたら
+何がヒットしていたかを求める。複数年の日足を1回だけ取得し、日付方向のループなしに
+（窓付きの累積和と範囲最小値で）全日付をまとめて評価する。
+
+各日の判定は本番と同じ:
+- 配当: その日までの1年間の配当合計 / 最終終値 >= 閾値
+- 安値: その日までの1年間で、直近 N 本（PERIODS）の終値の最小値から NEAR_LOW_PCT% 未満（終値10本以上）
+
+--threshold / --near-low-pct に複数の値を渡すと、同じ取得・計算で全ての値を評価する。
+ヒットは CSV に書き出し（--db で alerts.db の backtest テーブルにも保存）、値ごとの件数を表示する。
+銘柄は現在の上場銘柄なので、上場廃止銘柄は含まれない。
+
+Usage:
+    python backtest.py --start 2023-01-01 --threshold 0.04 0.045 0.05 --near-low-pct 0.5 1 2
+"""
+
+import argparse
+import csv
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pandas as pd
+
+import compute
+import fetcher
+import history
+import lowcheck
+import metrics
+import main as dividend
+import provider
+import store
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+YEAR = pd.DateOffset(years=1)
+MIN_CLOSES = 10
+
+
+def _download(batch: list[str], start: str) -> pd.DataFrame:
+    frames = history.split_frames(provider.get().download(batch, start=start), batch)
+    data = pd.concat(frames, axis=1, sort=True) if frames else pd.DataFrame()
+    data.attrs["requested"] = len(batch)
+    data.attrs["missing"] = len(batch) - len(frames)
+    return data
+
+
+def replay(data: pd.DataFrame, batch: list[str], start: pd.Timestamp, end: pd.Timestamp,
+           thresholds: list[float], near_pcts: list[float]):
+    """1バッチ分の日足から、start〜end の各営業日のヒットを返す。
+
+    Yields:
+        (day, screen, param, ticker, price, value): value は配当なら利回り、安値なら 52w 乖離(%)
+    """
+    if data.empty:
+        return
+    dates = data.index
+    close = compute.matrix(data, "Close", batch)
+    divs = np.nan_to_num(compute.matrix(data, "Dividends", batch))
+
+    # その日までの1年間: (d - 1年, d]
+    lo = compute.window_start(dates, YEAR)
+    valid = ~np.isnan(close)
+    n_close = compute.window_sum(valid.astype(np.int64), lo)
+    annual = compute.window_sum(divs, lo)
+    price = pd.DataFrame(close).ffill().to_numpy(copy=True)
+    price[n_close == 0] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dividend_yield = annual / price
+
+    # 直近 N 本と1年間の窓はどちらも d で終わるので、短い方（開始が遅い方）で最小値を取る
+    pct = {}
+    for label, n in lowcheck.PERIODS:
+        low = compute.range_min(close, np.maximum(lo[:, None], compute.last_n_start(close, n)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct[label] = np.where(low > 0, (price - low) / low * 100, 999.0)
+
+    rows = np.flatnonzero((dates >= start) & (dates <= end))
+    days = dates[rows].strftime("%Y-%m-%d")
+    symbols = np.array(batch)
+    with np.errstate(invalid="ignore"):
+        ok = (price > 0) & (annual > 0)
+        for thr in thresholds:
+            hit = ok & (dividend_yield >= thr)
+            for r, c in zip(*np.nonzero(hit[rows])):
+                yield days[r], "dividend", thr, symbols[c], price[rows[r], c], dividend_yield[rows[r], c]
+
+        enough = n_close >= MIN_CLOSES
+        for near in near_pcts:
+            hit = enough & np.logical_or.reduce([p < near for p in pct.values()])
+            for r, c in zip(*np.nonzero(hit[rows])):
+                yield days[r], "lowcheck", near, symbols[c], price[rows[r], c], pct["52w"][rows[r], c]
+
+
+@metrics.recorded("backtest")
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    today = datetime.now(JST).date()
+    parser = argparse.ArgumentParser(description="配当・安値スクリーニングの過去日リプレイ")
+    parser.add_argument("--start", default=(today - timedelta(days=365)).isoformat(), help="開始日（既定は1年前）")
+    parser.add_argument("--end", default=today.isoformat(), help="終了日（既定は今日）")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[dividend.THRESHOLD],
+                        help="配当利回りの閾値（複数可）")
+    parser.add_argument("--near-low-pct", type=float, nargs="+", default=[lowcheck.NEAR_LOW_PCT],
+                        help="安値からの乖離(%%)の閾値（複数可）")
+    parser.add_argument("--out", default="backtest.csv", help="ヒットの出力先 CSV")
+    parser.add_argument("--db", action="store_true", help="alerts.db の backtest テーブルにも保存する")
+    args = parser.parse_args(argv)
+
+    begin = time.time()
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+    # 開始日の時点で1年分の窓が埋まるよう、1年前から取る
+    fetch_from = (start - YEAR).date().isoformat()
+    run = datetime.now(JST).isoformat(timespec="seconds")
+
+    symbols = provider.get().universe().tickers
+    logger.info(f"リプレイ: {len(symbols)}銘柄, {args.start}〜{args.end}（日足は {fetch_from} から）")
+
+    counts = Counter()
+    days = set()
+    with open(args.out, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["day", "screen", "param", "code", "price", "value"])
+        for batch, data in fetcher.iter_batches(symbols, fetch=lambda b: _download(b, fetch_from)):
+            if data is None:
+                continue
+            days.update(data.index[(data.index >= start) & (data.index <= end)].strftime("%Y-%m-%d"))
+            with metrics.span("compute"):
+                rows = [
+                    (day, screen, param, sym.replace(".T", ""), float(p), float(v))
+                    for day, screen, param, sym, p, v in replay(data, batch, start, end, args.threshold, args.near_low_pct)
+                ]
+            del data
+            writer.writerows(rows)
+            counts.update((screen, param) for _, screen, param, *_ in rows)
+            if args.db:
+                store.save_backtest(run, rows)
+
+    n_days = max(len(days), 1)
+    logger.info(f"リプレイ完了: {len(days)}営業日 ({time.time() - begin:.1f}秒) -> {args.out}")
+    print(f"{'screen':<10} {'param':>8} {'hits':>9} {'per day':>9}")
+    for thr in args.threshold:
+        n = counts[("dividend", thr)]
+        print(f"{'dividend':<10} {thr:>8.3f} {n:>9} {n / n_days:>9.1f}")
+    for near in args.near_low_pct:
+        n = counts[("lowcheck", near)]
+        print(f"{'lowcheck':<10} {near:>8.2f} {n:>9} {n / n_days:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""main.py / lowcheck.py のエンドツーエンドベンチマーク（合成データ）
+
+各パイプラインを合成データの取得元で別プロセスとして実行し、
+スループット・ステージ別所要時間・ピークメモリを計測する。
+キャッシュ無し（cold）と、同じ作業ディレクトリでの2回目（warm）を測る。
+結果は bench_results.jsonl に追記し、同じ条件の前回結果と比較する。
+
+Usage:
+    python bench.py                       # 4000銘柄 x 250日
+    python bench.py --tickers 1000 --latency 0.2 --fail-rate 0.05
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+RESULTS_FILE = "bench_results.jsonl"
+PIPELINES = ["main", "lowcheck"]
+STAGES = ["universe", "fetch", "compute", "fallback", "checkpoint", "output"]
+
+
+def _instrument(stages: dict):
+    """各ステージの関数を計測付きに差し替える（子プロセス内でのみ使う）。"""
+    import history
+    import lowcheck
+    import main
+    import provider
+    import scan_dividends
+    import store
+
+    lock = threading.Lock()
+
+    def timed(fn, stage):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with lock:
+                    stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    p = provider.get()
+    p.universe = timed(p.universe, "universe")
+    history.download = timed(history.download, "fetch")
+    scan_dividends.select_yields = timed(scan_dividends.select_yields, "compute")
+    lowcheck.select_near = timed(lowcheck.select_near, "compute")
+    scan_dividends.fallback = timed(scan_dividends.fallback, "fallback")
+    store.save_checkpoint = timed(store.save_checkpoint, "checkpoint")
+    main.write_outputs = timed(main.write_outputs, "output")
+    lowcheck.write_outputs = timed(lowcheck.write_outputs, "output")
+    store.save_dividend = timed(store.save_dividend, "output")
+    store.save_lowcheck = timed(store.save_lowcheck, "output")
+
+
+def run_child(pipeline: str):
+    stages: dict[str, float] = {}
+    _instrument(stages)
+
+    import main
+    import lowcheck
+    import provider
+
+    start = time.perf_counter()
+    if pipeline == "main":
+        main.main([])
+    else:
+        lowcheck.main([])
+    wall = time.perf_counter() - start
+
+    n = provider.get().n_tickers
+    print("BENCH " + json.dumps({
+        "wall": wall,
+        "tickers": n,
+        "throughput": n / wall if wall > 0 else 0,
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages": stages,
+    }))
+
+
+def run_one(pipeline: str, workdir: str, env: dict, verbose: bool) -> dict:
+    proc = subprocess.run(
+        [sys.executable, os.path.join(REPO, "bench.py"), "--child", pipeline],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.PIPE,
+        text=True,
+    )
+    for line in proc.stdout.splitlines():
+        if line.startswith("BENCH "):
+            return json.loads(line[len("BENCH "):])
+    raise RuntimeError(f"{pipeline} 失敗 (exit {proc.returncode}):\n{proc.stderr}")
+
+
+def _previous(config: dict) -> dict | None:
+    try:
+        with open(RESULTS_FILE, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    same = [r for r in records if r["config"] == config]
+    return same[-1] if same else None
+
+
+def _print_results(results: dict, prev: dict | None):
+    print(f"{'run':<16} {'wall':>8} {'tick/s':>8} {'peakMB':>8}  " + " ".join(f"{s:>10}" for s in STAGES))
+    for key, r in results.items():
+        stages = " ".join(f"{r['stages'].get(s, 0):>10.2f}" for s in STAGES)
+        line = f"{key:<16} {r['wall']:>8.2f} {r['throughput']:>8.0f} {r['peak_mb']:>8.0f}  {stages}"
+        if prev and key in prev["results"]:
+            before = prev["results"][key]["wall"]
+            line += f"  ({(r['wall'] - before) / before * 100:+.1f}% vs {prev['ts']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データでのエンドツーエンドベンチマーク")
+    parser.add_argument("--child", choices=PIPELINES, help=argparse.SUPPRESS)
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=PIPELINES)
+    parser.add_argument("--tickers", type=int, default=4000)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--div-per-year", type=int, default=2)
+    parser.add_argument("--missing-rate", type=float, default=0.01)
+    parser.add_argument("--dead-rate", type=float, default=0.005)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="呼び出しあたりの遅延（秒）")
+    parser.add_argument("--fetch-rate", type=float, default=None,
+                        help="fetcher の初期開始レート（既定は FETCH_RATE のまま）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="子プロセスのログを表示")
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    config = {
+        "tickers": args.tickers, "days": args.days, "div_per_year": args.div_per_year,
+        "missing_rate": args.missing_rate, "dead_rate": args.dead_rate,
+        "fail_rate": args.fail_rate, "latency": args.latency, "fetch_rate": args.fetch_rate,
+        "seed": args.seed,
+    }
+    env = dict(
+        os.environ,
+        PYTHONPATH=REPO,
+        MARKET_DATA_PROVIDER="synthetic",
+        SYNTH_TICKERS=str(args.tickers),
+        SYNTH_DAYS=str(args.days),
+        SYNTH_DIV_PER_YEAR=str(args.div_per_year),
+        SYNTH_MISSING_RATE=str(args.missing_rate),
+        SYNTH_DEAD_RATE=str(args.dead_rate),
+        SYNTH_FAIL_RATE=str(args.fail_rate),
+        SYNTH_LATENCY=str(args.latency),
+        SYNTH_SEED=str(args.seed),
+    )
+    if args.fetch_rate is not None:
+        env["FETCH_RATE"] = str(args.fetch_rate)
+
+    results = {}
+    for pipeline in args.pipelines:
+        workdir = tempfile.mkdtemp(prefix=f"bench-{pipeline}-")
+        try:
+            for cache in ("cold", "warm"):
+                key = f"{pipeline}/{cache}"
+                logging.info(f"{key} 実行中...")
+                results[key] = run_one(pipeline, workdir, env, args.verbose)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    prev = _previous(config)
+    _print_results(results, prev)
+
+    with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"ts": datetime.now().isoformat(timespec="seconds"), "config": config,
+                            "results": results}) + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    main()
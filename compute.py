@@ -0,0 +1,105 @@
+"""日付×銘柄の行列で配当利回り・期間安値をまとめて計算する
+
+history.download の結果（列が (ticker, field) の MultiIndex）を NumPy 行列に並べ、
+銘柄ごとの Python ループなしで一括計算する。バッチ単位でも、キャッシュ済みの
+全銘柄をまとめたフレームでも同じように使える。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def matrix(data: pd.DataFrame, field: str, symbols: list[str]) -> np.ndarray:
+    """field 列を日付×銘柄の float 行列にする。data に無い銘柄の列は全て NaN。"""
+    if data.empty:
+        return np.full((0, len(symbols)), np.nan)
+    return data.xs(field, axis=1, level=1).reindex(columns=symbols).to_numpy(dtype=float)
+
+
+def last_valid(m: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """各列の最後の有効値と有効値の個数を返す（有効値が無い列は NaN）。"""
+    valid = ~np.isnan(m)
+    counts = valid.sum(axis=0)
+    if m.shape[0] == 0:
+        return np.full(m.shape[1], np.nan), counts
+    idx = m.shape[0] - 1 - np.argmax(valid[::-1], axis=0)
+    values = m[idx, np.arange(m.shape[1])]
+    values[counts == 0] = np.nan
+    return values, counts
+
+
+def trailing_min(m: np.ndarray, n: int) -> np.ndarray:
+    """各列の直近 n 個の有効値の最小値（Series.dropna().iloc[-n:].min() と同じ）。"""
+    if m.shape[0] == 0:
+        return np.full(m.shape[1], np.nan)
+    valid = ~np.isnan(m)
+    from_end = np.cumsum(valid[::-1], axis=0)[::-1]
+    window = np.where(valid & (from_end <= n), m, np.nan)
+    return np.fmin.reduce(window, axis=0)
+
+
+def pack(m: np.ndarray, valid: np.ndarray, n: int, fill) -> np.ndarray:
+    """各列の valid な値を順序を保って下に詰め、最後の n 行（n × 列数）を返す。足りない所は fill。
+
+    銘柄ごとに長さの違う系列（終値・配当イベント）を、右詰めの固定長の行列にそろえるのに使う。
+    """
+    t, k = m.shape
+    if t < n:
+        m = np.vstack([np.full((n - t, k), fill, dtype=m.dtype), m])
+        valid = np.vstack([np.zeros((n - t, k), dtype=bool), valid])
+    order = np.argsort(valid, axis=0, kind="stable")[m.shape[0] - n:]  # 無効な行が先、有効な行は元の順
+    return np.where(np.take_along_axis(valid, order, axis=0), np.take_along_axis(m, order, axis=0), fill)
+
+
+def window_start(dates: pd.DatetimeIndex, offset: pd.DateOffset) -> np.ndarray:
+    """各日付 d について、(d - offset, d] に入る最初の行番号。"""
+    return np.searchsorted(dates.values, (dates - offset).values, side="right")
+
+
+def window_sum(m: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    """各行 i について m[lo[i]:i + 1] の列ごとの合計（累積和の差）。"""
+    cs = np.vstack([np.zeros((1, m.shape[1]), dtype=m.dtype), np.cumsum(m, axis=0)])
+    return cs[1:] - cs[lo]
+
+
+def last_n_start(m: np.ndarray, n: int) -> np.ndarray:
+    """各 (行 i, 列 j) について、行 i までの直近 n 個の有効値のうち最初のものの行番号。
+
+    有効値が n 個に満たない場合は 0。
+    """
+    valid = ~np.isnan(m)
+    counts = np.cumsum(valid, axis=0)
+    cols, rows = np.nonzero(valid.T)  # 列ごとに行番号順
+    offsets = np.concatenate([[0], np.cumsum(valid.sum(axis=0))[:-1]])
+    k = counts - n
+    start = np.zeros(m.shape, dtype=np.int64)
+    has = k > 0
+    start[has] = rows[(offsets[None, :] + k)[has]]
+    return start
+
+
+def range_min(m: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    """各 (行 i, 列 j) について m[lo[i, j]:i + 1, j] の最小値（NaN は無視、全て NaN なら NaN）。
+
+    lo は行ごと (T,) でも要素ごと (T, n) でもよい。スパーステーブルで日付方向のループなしに求める。
+    """
+    t = m.shape[0]
+    if t == 0:
+        return np.full(m.shape, np.nan)
+    lo = np.broadcast_to(lo.reshape(t, -1), m.shape)
+    end = np.arange(t)[:, None]
+    length = np.maximum(end - lo + 1, 1)
+    level = np.floor(np.log2(length)).astype(np.int64)
+
+    out = np.full(m.shape, np.nan)
+    col = np.broadcast_to(np.arange(m.shape[1]), m.shape)
+    table = m
+    for k in range(int(level.max()) + 1):
+        if k > 0:
+            h = 1 << (k - 1)
+            table = np.fmin(table[:-h], table[h:])  # 行 r は m[r:r + 2^k] の最小値
+        sel = level == k
+        a = table[lo[sel], col[sel]]
+        b = table[np.broadcast_to(end - (1 << k) + 1, m.shape)[sel], col[sel]]
+        out[sel] = np.fmin(a, b)
+    return out
@@ -0,0 +1,235 @@
+"""常駐スケジューラ
+
+portfolio.main / lowcheck.main / main.main を1つの常駐プロセスから実行する。
+import 済みのモジュール・市場データ取得元（銘柄リストはその日のうちは使い回す）・
+alerts.db の接続をジョブ間で共有するので、2本目以降のジョブは起動・import・
+銘柄リスト取得を待たずに始まる。
+
+- スケジュール: SCHEDULE の時刻（JST）に、東証の営業日だけ実行する（trading_calendar.py）。
+  配当アラートは週の最初の営業日（月曜が祝日なら火曜）に実行する
+- トリガー: SOCKET_PATH の Unix ソケットで「ジョブ名 [引数]」の1行を受け取り、
+  終わるまで待って結果を1行返す
+
+ジョブは1本ずつ順に実行する（スケジュールとトリガーが重なったら後のものは待つ）。
+レポートは従来どおりカレントディレクトリに書き出す（メール送信は行わない）。
+
+Usage:
+    python daemon.py                          # 常駐
+    python daemon.py --send portfolio 寄り付き  # 常駐中のプロセスでジョブを実行
+    python daemon.py --send status            # 待ち行列と次回のスケジュール
+    python daemon.py --next 10                # 今後のスケジュールを表示
+"""
+
+import argparse
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+
+import trading_calendar
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = os.environ.get("DAEMON_SOCKET", "daemon.sock")
+POLL_SEC = 30  # スケジュール待ちの最大スリープ（時計の変更・停止要求に追従する間隔）
+LATE_SEC = 600  # これより遅れたスケジュール（スリープ復帰など）は実行せずに見送る
+
+# (時刻, ジョブ名, 引数, 実行日の条件)
+SCHEDULE = [
+    ("09:10", "portfolio", "寄り付き", trading_calendar.is_trading_day),
+    ("12:40", "portfolio", "後場寄り", trading_calendar.is_trading_day),
+    ("13:40", "dividend", None, trading_calendar.is_first_of_week),
+    ("14:30", "lowcheck", None, trading_calendar.is_trading_day),
+    ("15:40", "portfolio", "終値", trading_calendar.is_trading_day),
+]
+
+JOBS = ("portfolio", "lowcheck", "dividend")
+
+
+def run_job(name: str, arg: str | None = None):
+    """ジョブを現在のプロセスで実行する。"""
+    if name == "portfolio":
+        import portfolio
+        portfolio.main(arg or "手動実行")
+    elif name == "lowcheck":
+        import lowcheck
+        lowcheck.main([])
+    elif name == "dividend":
+        import main
+        main.main([])
+    else:
+        raise ValueError(f"未知のジョブ {name!r}（使えるのは {', '.join(JOBS)}）")
+
+
+def upcoming(now: datetime, n: int = 1) -> list[tuple[datetime, str, str | None]]:
+    """now より後のスケジュールを n 件、(実行時刻, ジョブ名, 引数) で返す。"""
+    out = []
+    day = now.date()
+    while len(out) < n:
+        for hhmm, name, arg, when in SCHEDULE:
+            h, m = (int(x) for x in hhmm.split(":"))
+            at = datetime(day.year, day.month, day.day, h, m, tzinfo=JST)
+            if at > now and when(day):
+                out.append((at, name, arg))
+        day += timedelta(days=1)
+    return sorted(out)[:n]
+
+
+class Scheduler:
+    """ジョブの待ち行列と、それを1本ずつ実行するワーカー・スケジューラ。"""
+
+    def __init__(self, now=None, sleep=None):
+        """now / sleep は現在時刻と待ちの差し替え用（既定は JST の現在時刻と stop.wait）。"""
+        self.jobs: queue.Queue = queue.Queue()
+        self.stop = threading.Event()
+        self.running: str | None = None
+        self.now = now or (lambda: datetime.now(JST))
+        self.sleep = sleep or self.stop.wait
+
+    def submit(self, name: str, arg: str | None = None) -> dict:
+        """ジョブを待ち行列に入れる。返す dict は完了時に done が set され、ok / error / seconds が入る。"""
+        if name not in JOBS:
+            raise ValueError(f"未知のジョブ {name!r}（使えるのは {', '.join(JOBS)}）")
+        job = {"name": name, "arg": arg, "done": threading.Event()}
+        self.jobs.put(job)
+        return job
+
+    def warm(self):
+        """重い import・銘柄リスト・DB 接続を先に用意しておく。"""
+        start = time.perf_counter()
+        import lowcheck
+        import main
+        import portfolio
+        import provider
+        import store
+        store.get()
+        if trading_calendar.is_trading_day(datetime.now(JST).date()):
+            provider.get().universe()
+        logger.info(f"ウォームアップ完了 ({time.perf_counter() - start:.1f}秒)")
+
+    def work(self):
+        while not self.stop.is_set():
+            try:
+                job = self.jobs.get(timeout=1)
+            except queue.Empty:
+                continue
+            label = " ".join(x for x in (job["name"], job["arg"]) if x)
+            self.running = label
+            logger.info(f"ジョブ開始: {label}")
+            start = time.perf_counter()
+            try:
+                run_job(job["name"], job["arg"])
+                job["ok"] = True
+            except (Exception, SystemExit) as e:
+                logger.exception(f"ジョブ失敗: {label}")
+                job["ok"], job["error"] = False, f"{type(e).__name__}: {e}"
+            job["seconds"] = time.perf_counter() - start
+            self.running = None
+            logger.info(f"ジョブ終了: {label} ({job['seconds']:.1f}秒)")
+            job["done"].set()
+
+    def schedule(self):
+        # 次の予定は時刻を過ぎるまで持ち続ける（待ちから戻った時点で upcoming(now) を引き直すと、
+        # ちょうど時刻になった予定は now より後ではないので飛ばされる）
+        at, name, arg = upcoming(self.now())[0]
+        while not self.stop.is_set():
+            wait = (at - self.now()).total_seconds()
+            if wait > 0:
+                self.sleep(min(wait, POLL_SEC))
+                continue
+            label = " ".join(x for x in (at.strftime("%Y-%m-%d %H:%M"), name, arg) if x)
+            if -wait > LATE_SEC:
+                logger.warning(f"予定の時刻を過ぎているため見送り: {label}")
+            else:
+                self.submit(name, arg)
+            at, name, arg = upcoming(at)[0]
+
+    def status(self) -> str:
+        at, name, arg = upcoming(self.now())[0]
+        nxt = " ".join(x for x in (at.strftime("%Y-%m-%d %H:%M"), name, arg) if x)
+        return f"running={self.running or '-'} queued={self.jobs.qsize()} next={nxt}"
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        words = self.rfile.readline().decode("utf-8").split()
+        scheduler: Scheduler = self.server.scheduler
+        if not words:
+            reply = "error 空のコマンド"
+        elif words[0] == "status":
+            reply = f"ok {scheduler.status()}"
+        else:
+            try:
+                job = scheduler.submit(words[0], " ".join(words[1:]) or None)
+                job["done"].wait()
+                reply = f"ok {job['seconds']:.1f}s" if job["ok"] else f"error {job['error']}"
+            except ValueError as e:
+                reply = f"error {e}"
+        self.wfile.write((reply + "\n").encode("utf-8"))
+
+
+def serve(path: str = SOCKET_PATH):
+    """常駐して、スケジュールとソケットからのトリガーでジョブを実行する。"""
+    scheduler = Scheduler()
+    scheduler.warm()
+    if os.path.exists(path):
+        os.remove(path)
+    server = socketserver.ThreadingUnixStreamServer(path, _Handler)
+    server.scheduler = scheduler
+    server.daemon_threads = True
+
+    threads = [threading.Thread(target=f, daemon=True) for f in (scheduler.work, scheduler.schedule)]
+    for t in threads:
+        t.start()
+    at, name, arg = upcoming(datetime.now(JST))[0]
+    logger.info(f"常駐開始: {path} で待ち受け, 次回 {at:%Y-%m-%d %H:%M} {name} {arg or ''}")
+    # SIGTERM でも Ctrl-C と同じく止める
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("停止します（実行中のジョブは終わるまで待つ）")
+    finally:
+        scheduler.stop.set()
+        server.server_close()
+        os.remove(path)
+        for t in threads:
+            t.join()
+
+
+def send(words: list[str], path: str = SOCKET_PATH) -> str:
+    """常駐プロセスにコマンドを送り、返答の1行を返す（ジョブは終わるまで待つ）。"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((" ".join(words) + "\n").encode("utf-8"))
+        return s.makefile(encoding="utf-8").readline().strip()
+
+
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="常駐スケジューラ")
+    parser.add_argument("--send", nargs="+", metavar="JOB", help="常駐中のプロセスにジョブ（または status）を送る")
+    parser.add_argument("--next", type=int, metavar="N", help="今後のスケジュールを N 件表示する")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="トリガー用の Unix ソケット")
+    args = parser.parse_args(argv)
+
+    if args.next:
+        for at, name, arg in upcoming(datetime.now(JST), args.next):
+            print(f"{at:%Y-%m-%d %a %H:%M}  {name} {arg or ''}")
+        return
+    if args.send:
+        reply = send(args.send, args.socket)
+        print(reply)
+        sys.exit(0 if reply.startswith("ok") else 1)
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""alerts.db の実行ごとの差分（書き出し・適用・リベース）
+
+GitHub Actions の各ジョブは alerts.db 全体を上げ直す代わりに、その実行が書き換えた行だけを
+gzip した JSON（差分）にして Artifact に上げる。
+- DELTA_CAPTURE=1 で動いたジョブは、書き換えた (テーブル, 置き換えの単位) を change_log に記録する（store.py）
+- export: change_log の単位ごとの現在の行を差分ファイルに書く
+- merge: 差分を作成順に適用する。単位ごとに行を置き換え、適用済みの差分（delta_applied）は飛ばすので何度流してもよい
+- rebase: merge して VACUUM し、その DB を新しい基準にする（適用済みの差分ファイルの名前を出力する）
+
+置き換えの単位は store.DELTA_GROUPS（dividend / lowcheck は (日, コード)、portfolio は (日, セッション) など）。
+同時に動いたワークフローもそれぞれが書き換えた単位だけを運ぶので、互いの行を上書きしない。
+
+Usage:
+    DELTA_CAPTURE=1 python main.py
+    python delta.py export deltas/alerts-delta-alert-123.json.gz --source alert-123
+    python delta.py merge deltas/          # ディレクトリ内の *.json.gz を作成順に適用
+    python delta.py rebase deltas/         # 適用して VACUUM し、適用済みのファイル名を出力
+    python delta.py status
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import store
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+SUFFIX = ".json.gz"
+
+
+def read(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        delta = json.load(f)
+    if delta.get("version") != VERSION:
+        raise ValueError(f"{path}: 未対応の差分の版 {delta.get('version')!r}")
+    return delta
+
+
+def write(path: str, delta: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(delta, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def export(path: str, source: str = "local") -> dict | None:
+    """書き換えた単位を path に書き出す。書き換えが無ければ何も書かず None。"""
+    tables = store.export_changes()
+    if not tables:
+        logger.info("差分なし")
+        return None
+    delta = {
+        "version": VERSION,
+        "id": uuid.uuid4().hex,
+        "created": datetime.now(JST).isoformat(),
+        "source": source,
+        "tables": tables,
+    }
+    write(path, delta)
+    store.mark_exported(delta)
+    logger.info(
+        f"差分を書き出し: {path} ({os.path.getsize(path) / 1024:,.1f} KB) "
+        + ", ".join(f"{t} {len(d['rows'])}行/{len(d['groups'])}単位" for t, d in tables.items())
+    )
+    return delta
+
+
+def files(paths: list[str]) -> list[str]:
+    """paths（ファイルまたはディレクトリ）の差分ファイル。"""
+    out = []
+    for p in paths:
+        if os.path.isdir(p):
+            out += sorted(glob.glob(os.path.join(p, "**", f"*{SUFFIX}"), recursive=True))
+        else:
+            out.append(p)
+    return out
+
+
+def merge(paths: list[str]) -> list[str]:
+    """差分を作成順に適用する。読めない差分は飛ばす（次回も適用を試みる）。
+
+    Returns:
+        適用した、または適用済みだった差分ファイル
+    """
+    deltas = []
+    for path in files(paths):
+        try:
+            deltas.append((path, read(path)))
+        except (OSError, ValueError) as e:
+            logger.warning(f"{path}: 差分を読めないため飛ばします（{e}）")
+    deltas.sort(key=lambda pd: (pd[1]["created"], pd[1]["id"]))
+    merged, applied = [], 0
+    for path, delta in deltas:
+        applied += store.apply_delta(delta)
+        merged.append(path)
+    logger.info(f"差分を適用: {applied}件（適用済み {len(merged) - applied}件）")
+    return merged
+
+
+def rebase(paths: list[str]) -> list[str]:
+    """merge して VACUUM する。この DB を新しい基準にすれば、返した差分ファイルは要らない。"""
+    merged = merge(paths)
+    store.get().vacuum()
+    logger.info(f"リベース: {store.DB_PATH} ({os.path.getsize(store.DB_PATH) / 1024:,.0f} KB)")
+    return merged
+
+
+def status() -> str:
+    s = store.get()
+    lines = [f"{store.DB_PATH}: {os.path.getsize(store.DB_PATH) / 1024:,.0f} KB"]
+    for table, n in s.select("SELECT tbl, COUNT(*) FROM change_log GROUP BY tbl ORDER BY tbl"):
+        lines.append(f"  未書き出し {table:<16} {n:>7,}単位")
+    n, last = s.select("SELECT COUNT(*), MAX(created) FROM delta_applied")[0]
+    lines.append(f"  適用済みの差分 {n}件（最新 {last or '-'}）")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="alerts.db の実行ごとの差分")
+    parser.add_argument("--db", default=store.DB_PATH, help="対象の DB（既定 alerts.db）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="この DB で書き換えた行を差分ファイルに書き出す")
+    p.add_argument("path")
+    p.add_argument("--source", default="local", help="差分の出どころ（ワークフロー名・run id など）")
+    p = sub.add_parser("merge", help="差分を作成順に適用する（適用済みは飛ばす）")
+    p.add_argument("paths", nargs="+", metavar="PATH")
+    p = sub.add_parser("rebase", help="差分を適用して VACUUM し、適用済みのファイル名を出力する")
+    p.add_argument("paths", nargs="+", metavar="PATH")
+    sub.add_parser("status", help="未書き出しの単位と適用済みの差分")
+    args = parser.parse_args(argv)
+
+    store.DB_PATH = args.db
+    if args.command == "export":
+        export(args.path, args.source)
+    elif args.command == "merge":
+        merge(args.paths)
+    elif args.command == "rebase":
+        for path in rebase(args.paths):
+            print(path)
+    else:
+        print(status())
+
+
+if __name__ == "__main__":
+    main()
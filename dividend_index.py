@@ -0,0 +1,177 @@
+"""配当イベントの索引（権利落ち日と金額、最終確認日）
+
+銘柄ごとに直近の配当イベントと最後に確認した日を cache/dividends/index.npz に保存する。
+配当が変わるのは新しい権利落ちがあったときだけなので、毎回の利回りスキャンでは
+
+- 次の権利落ちが近い（前年の権利落ち日の1年後 ± WINDOW_DAYS に入った）銘柄
+- 最終確認から MAX_AGE_DAYS 日を超えた銘柄・索引に無い銘柄
+
+だけ history から日足を取り直して索引を更新し、それ以外は直近数日の終値だけを取る。
+12か月より古い配当は索引の日付で落とすので、履歴を取り直さなくても期限切れが正確に反映される。
+索引は銘柄×イベントの行列で持ち、取り直す銘柄の判定も配当合計も銘柄ごとのループなしで求める。
+"""
+
+import logging
+import os
+import zipfile
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pandas as pd
+
+import compute
+import history
+import provider
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+INDEX_PATH = os.environ.get("DIVIDEND_INDEX_PATH", "cache/dividends/index.npz")
+WINDOW_DAYS = 21  # 前年の権利落ち日からの前後のずれの許容幅
+MAX_AGE_DAYS = 35  # この日数を超えて確認していない銘柄は取り直す（無配→有配の検知用）
+PRICE_DAYS = 5  # 終値だけを取る期間（営業日）。日足を取り直しても最後の足がこれより古い銘柄は取れなかったものとする
+PRICE_PERIOD = f"{PRICE_DAYS}d"
+MAX_EVENTS = 12  # 1銘柄あたりに覚える直近の権利落ちの数（月次配当まで）
+NAT = np.datetime64("NaT", "D")
+
+
+class EventIndex:
+    """配当イベントの索引。tickers[i] の行が verified[i]（最終確認日、未確認は NaT）と
+    ex[i] / amount[i]（権利落ち日と金額、古い順に右詰めで空きは NaT / 0）。
+
+    update は別スレッドのバッチから呼ばれるが、バッチ同士は銘柄（行）が重ならないので書き込みは衝突しない。
+    """
+
+    __slots__ = ("tickers", "verified", "ex", "amount", "_ids")
+
+    def __init__(self, tickers: list[str]):
+        n = len(tickers)
+        self.tickers = list(tickers)
+        self.verified = np.full(n, NAT)
+        self.ex = np.full((n, MAX_EVENTS), NAT)
+        self.amount = np.zeros((n, MAX_EVENTS))
+        self._ids = {t: i for i, t in enumerate(self.tickers)}
+
+    def ids(self, symbols: list[str]) -> np.ndarray:
+        return np.fromiter((self._ids[s] for s in symbols), dtype=np.intp, count=len(symbols))
+
+
+def load_index(tickers: list[str], path: str = INDEX_PATH) -> EventIndex:
+    """tickers の行にそろえた索引を返す（保存されていない銘柄は未確認）。"""
+    index = EventIndex(tickers)
+    try:
+        with np.load(path) as f:
+            saved = {k: f[k] for k in ("tickers", "verified", "ex", "amount")}
+    except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+        return index
+    pos = {t: i for i, t in enumerate(saved["tickers"].tolist())}
+    src = np.array([pos.get(t, -1) for t in index.tickers], dtype=np.intp)
+    have = src >= 0
+    k = min(MAX_EVENTS, saved["ex"].shape[1])
+    index.verified[have] = saved["verified"][src[have]]
+    index.ex[have, MAX_EVENTS - k:] = saved["ex"][src[have], saved["ex"].shape[1] - k:]
+    index.amount[have, MAX_EVENTS - k:] = saved["amount"][src[have], saved["ex"].shape[1] - k:]
+    return index
+
+
+def save_index(index: EventIndex, path: str = INDEX_PATH):
+    """確認済みの銘柄の行を保存する。"""
+    keep = ~np.isnat(index.verified)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(
+            f,
+            tickers=np.array(index.tickers, dtype=str)[keep],
+            verified=index.verified[keep],
+            ex=index.ex[keep],
+            amount=index.amount[keep],
+        )
+    os.replace(tmp, path)
+
+
+def due(verified: np.ndarray, ex: np.ndarray, today: np.datetime64) -> np.ndarray:
+    """日足を取り直して配当を確認すべきか（銘柄ごとの bool 配列。未確認の銘柄は True）。
+
+    verified は銘柄ごとの最終確認日、ex は銘柄×イベントの権利落ち日（EventIndex と同じ形）。
+    """
+    stale = ~(today - verified <= np.timedelta64(MAX_AGE_DAYS, "D"))  # NaT との比較は False
+    window = np.timedelta64(WINDOW_DAYS, "D")
+    expected = ex + np.timedelta64(365, "D")
+    # 権利落ちの見込み期間に入っていて、期間が終わってからはまだ確認していない
+    near = (expected - window <= today) & (verified[:, None] < expected + window)
+    return stale | near.any(axis=1)
+
+
+def _days(data: pd.DataFrame, shape: tuple) -> np.ndarray:
+    return np.broadcast_to(data.index.values.astype("datetime64[D]")[:, None], shape)
+
+
+def _last_close(data: pd.DataFrame, symbols: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """銘柄ごとの最後の終値・終値の本数・最後の終値の日付（無ければ NaN / 0 / NaT）。"""
+    close = compute.matrix(data, "Close", symbols)
+    price, counts = compute.last_valid(close)
+    last = compute.pack(_days(data, close.shape), ~np.isnan(close), 1, NAT)[0]
+    return price, counts, last
+
+
+def _events(data: pd.DataFrame, symbols: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """銘柄ごとの直近 MAX_EVENTS 回の権利落ち日と金額（銘柄 × MAX_EVENTS、古い順に右詰め）。"""
+    divs = compute.matrix(data, "Dividends", symbols)
+    paid = divs > 0
+    ex = compute.pack(_days(data, divs.shape), paid, MAX_EVENTS, NAT)
+    return ex.T, compute.pack(divs, paid, MAX_EVENTS, 0.0).T
+
+
+def update(batch: list[str], index: EventIndex) -> pd.DataFrame:
+    """batch の索引を必要な分だけ更新し、銘柄ごとの表（index は batch、列は price / annual_dividend /
+    dividend_yield / n_close）を返す。
+
+    終値だけを取った銘柄の n_close は直近 PRICE_PERIOD 内の本数。日足を取り直しても最後の足が
+    PRICE_DAYS 営業日より古い銘柄は確認済みにせず、n_close を 0（取れなかった）にする。
+    """
+    today = np.datetime64(datetime.now(JST).date(), "D")
+    cutoff = np.datetime64((pd.Timestamp(today) - pd.DateOffset(years=1)).date(), "D")
+    rows = index.ids(batch)
+    refresh = due(index.verified[rows], index.ex[rows], today)
+    price = np.full(len(batch), np.nan)
+    counts = np.zeros(len(batch), dtype=np.int64)
+    requested = missing = 0
+
+    cheap = np.flatnonzero(~refresh)
+    if len(cheap):
+        symbols = [batch[i] for i in cheap]
+        data = history.combine(history.split_frames(provider.get().download(symbols, period=PRICE_PERIOD), symbols))
+        p, c, _ = _last_close(data, symbols)
+        requested += len(symbols)
+        missing += int((c == 0).sum())
+        price[cheap], counts[cheap] = p, c
+        refresh[cheap[c == 0]] = True
+
+    todo = np.flatnonzero(refresh)
+    if len(todo):
+        symbols = [batch[i] for i in todo]
+        data = history.download(symbols)
+        requested += data.attrs.get("requested", 0)
+        missing += data.attrs.get("missing", 0)
+        p, c, last = _last_close(data, symbols)
+        ok = c > 0
+        ok[ok] = ~history.stale(last[ok], today, PRICE_DAYS)
+        price[todo], counts[todo] = np.where(ok, p, np.nan), np.where(ok, c, 0)
+        ex, amount = _events(data, symbols)
+        del data
+        r = rows[todo[ok]]
+        index.verified[r] = today
+        index.ex[r], index.amount[r] = ex[ok], amount[ok]
+    logger.info(f"  配当索引: 終値のみ {len(batch) - len(todo)}銘柄, 日足から更新 {len(todo)}銘柄")
+
+    annual = np.where(index.ex[rows] > cutoff, index.amount[rows], 0.0).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dividend_yield = annual / price
+    table = pd.DataFrame(
+        {"price": price, "annual_dividend": annual, "dividend_yield": dividend_yield, "n_close": counts},
+        index=batch,
+    )
+    table.attrs["requested"] = requested
+    table.attrs["missing"] = missing
+    return table
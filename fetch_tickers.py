@@ -1,14 +1,24 @@
-"""JPX上場銘柄リスト取得"""
+"""JPX上場銘柄リスト取得
+
+パース済みの銘柄リストを列ごと（universe.Universe の形式）で cache/jpx/tickers.json に保存し、
+TTL 内ならそのまま使う。
+TTL を過ぎたら ETag / Last-Modified で条件付き GET し、304 なら保存済みを使い続ける。
+"""
 
 import io
+import json
 import logging
+import os
+import time
 
-import pandas as pd
-import requests
+import metrics
+from universe import Universe
 
 logger = logging.getLogger(__name__)
 
 JPX_URL = "https://www.jpx.co.jp/markets/statistics-equities/misc/tvdivq0000001vg2-att/data_j.xls"
+CACHE_PATH = os.environ.get("JPX_CACHE_PATH", "cache/jpx/tickers.json")
+TTL = float(os.environ.get("JPX_TTL_HOURS", "24")) * 3600
 
 # プライム/スタンダード/グロース市場の内国株式のみ対象
 TARGET_MARKETS = {
@@ -18,39 +28,96 @@ TARGET_MARKETS = {
 }
 
 
-def fetch_tse_tickers() -> list[dict]:
-    """JPX公開Excelから東証上場銘柄リストを取得する。
+def _load_snapshot() -> dict | None:
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-    Returns:
-        list[dict]: 各銘柄の情報 {"ticker": "7203.T", "name": "トヨタ自動車", "sector": "輸送用機器"}
-    """
-    logger.info("JPX銘柄リストをダウンロード中...")
-    resp = requests.get(JPX_URL, timeout=60, headers={"User-Agent": "Mozilla/5.0"})
-    resp.raise_for_status()
 
-    df = pd.read_excel(io.BytesIO(resp.content), header=0)
+def _save_snapshot(snapshot: dict):
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    tmp = CACHE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp, CACHE_PATH)
+
+
+def parse_listing(content: bytes) -> Universe:
+    """data_j.xls の中身を銘柄リストに変換する（列単位で処理）。"""
+    import pandas as pd
+
+    df = pd.read_excel(io.BytesIO(content), header=0)
     logger.info(f"JPXリスト取得完了: {len(df)}行")
 
     # 市場フィルタ
-    mask = df["市場・商品区分"].isin(TARGET_MARKETS)
-    filtered = df[mask].copy()
+    filtered = df[df["市場・商品区分"].isin(TARGET_MARKETS)]
     logger.info(f"内国株式フィルタ後: {len(filtered)}銘柄")
 
-    results = []
-    for _, row in filtered.iterrows():
-        code = str(row["コード"]).strip()
-        results.append({
-            "ticker": f"{code}.T",
-            "name": str(row.get("銘柄名", "")),
-            "sector": str(row.get("33業種区分", "")),
-        })
+    n = len(filtered)
+    tickers = (filtered["コード"].astype(str).str.strip() + ".T").tolist()
+    names = filtered["銘柄名"].astype(str).tolist() if "銘柄名" in filtered else [""] * n
+    sectors = filtered["33業種区分"].astype(str).tolist() if "33業種区分" in filtered else [""] * n
+
+    return Universe(tickers, names, sectors)
+
+
+@metrics.timed("universe")
+def fetch_tse_tickers() -> Universe:
+    """JPX公開Excelから東証上場銘柄リストを取得する。
+
+    Returns:
+        Universe: tickers ["7203.T", ...] / names ["トヨタ自動車", ...] / 業種（sector(i) で "輸送用機器"）
+    """
+    snapshot = _load_snapshot()
+    if snapshot and time.time() - snapshot["checked_at"] < TTL:
+        tickers = Universe.from_columns(snapshot["tickers"])
+        logger.info(f"JPX銘柄リスト: キャッシュ使用 ({len(tickers)}銘柄)")
+        return tickers
+
+    import requests
+
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if snapshot:
+        if snapshot.get("etag"):
+            headers["If-None-Match"] = snapshot["etag"]
+        if snapshot.get("last_modified"):
+            headers["If-Modified-Since"] = snapshot["last_modified"]
+
+    logger.info("JPX銘柄リストをダウンロード中...")
+    metrics.count("universe.download")
+    try:
+        resp = requests.get(JPX_URL, timeout=60, headers=headers)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        if not snapshot:
+            raise
+        logger.warning(f"JPX銘柄リスト取得失敗、保存済みリストを使用: {e}")
+        return Universe.from_columns(snapshot["tickers"])
+
+    if resp.status_code == 304:
+        tickers = Universe.from_columns(snapshot["tickers"])
+        logger.info(f"JPX銘柄リスト: 更新なし ({len(tickers)}銘柄)")
+        snapshot["checked_at"] = time.time()
+        snapshot["tickers"] = tickers.to_columns()
+        _save_snapshot(snapshot)
+        return tickers
 
-    return results
+    tickers = parse_listing(resp.content)
+    _save_snapshot({
+        "checked_at": time.time(),
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "tickers": tickers.to_columns(),
+    })
+    return tickers
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
     tickers = fetch_tse_tickers()
     print(f"取得銘柄数: {len(tickers)}")
-    for t in tickers[:10]:
-        print(f"  {t['ticker']} {t['name']} ({t['sector']})")
+    for i in range(min(10, len(tickers))):
+        print(f"  {tickers.tickers[i]} {tickers.names[i]} ({tickers.sector(i)})")
+    print(f"業種: {len(tickers.sectors)}種類")
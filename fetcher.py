@@ -0,0 +1,247 @@
+"""非同期バッチダウンローダー（適応レート制御付き）
+
+固定スリープで1バッチずつ直列に取得する代わりに、複数バッチを並列に投げる。
+- トークンバケットでリクエスト開始レートを制限
+- レイテンシ・エラー率・スロットリングを見て並列数とバッチサイズを AIMD で調整
+- スロットリングが続いたらサーキットブレーカーで一定時間止めて指数バックオフ
+"""
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import history
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.environ.get("FETCH_BATCH_SIZE", "100"))
+MIN_BATCH = 20
+MAX_BATCH = 200
+MAX_IN_FLIGHT = int(os.environ.get("FETCH_MAX_IN_FLIGHT", "4"))
+RATE = float(os.environ.get("FETCH_RATE", "1.0"))  # バッチ開始/秒の上限（初期値）
+MIN_RATE = 0.05
+MAX_RATE = 4.0
+TARGET_LATENCY = 30.0  # 1バッチの目標所要時間（秒）
+MAX_RETRIES = 2
+
+BREAKER_THRESHOLD = 3  # 連続スロットリング回数
+BREAKER_COOLDOWN = 15.0
+BREAKER_MAX_COOLDOWN = 300.0
+
+# この銘柄数以上を要求して1件も返ってこなければスロットリングとみなす
+THROTTLE_MIN_REQUESTED = 5
+THROTTLE_MARKERS = ("Too Many Requests", "Rate limit", "RateLimit", "429")
+
+
+class TokenBucket:
+    """開始レート制限。イベントループ1本から使う前提なのでロックは持たない。"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """スレッドから共有する開始間隔の制限（rate 回/秒）。"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next)
+            self.next = at + self.interval
+        if at > now:
+            metrics.count("ratelimit.sleep", at - now)
+            time.sleep(at - now)
+
+
+class CircuitBreaker:
+    """スロットリングが連続したら cooldown 秒すべての開始を止める。開くたびに cooldown を倍にする。"""
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN,
+                 max_cooldown: float = BREAKER_MAX_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.failures = 0
+        self.open_until = 0.0
+
+    async def wait(self):
+        delay = self.open_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, throttled: bool):
+        if not throttled:
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            return
+        self.failures += 1
+        if self.failures >= self.threshold:
+            logger.warning(f"  スロットリング検知: {self.cooldown:.0f}秒停止")
+            self.open_until = time.monotonic() + self.cooldown
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.failures = 0
+
+
+class AdaptiveController:
+    """観測結果から並列数・バッチサイズ・開始レートを調整する（加算増・乗算減）。"""
+
+    def __init__(self, bucket: TokenBucket, max_in_flight: int = MAX_IN_FLIGHT, batch_size: int = BATCH_SIZE):
+        self.bucket = bucket
+        self.max_in_flight = max_in_flight
+        self.concurrency = 1
+        self.batch_size = batch_size
+
+    def record(self, latency: float, throttled: bool, error: bool):
+        if throttled:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.batch_size = max(MIN_BATCH, self.batch_size // 2)
+            self.bucket.rate = max(MIN_RATE, self.bucket.rate / 2)
+        elif error:
+            self.concurrency = max(1, self.concurrency - 1)
+        else:
+            if latency > TARGET_LATENCY:
+                self.batch_size = max(MIN_BATCH, int(self.batch_size * 0.8))
+            else:
+                self.batch_size = min(MAX_BATCH, self.batch_size + 10)
+            self.concurrency = min(self.max_in_flight, self.concurrency + 1)
+            self.bucket.rate = min(MAX_RATE, self.bucket.rate + 0.1)
+
+
+def _is_throttled(data, error: Exception | None) -> bool:
+    if error is not None:
+        return any(m in repr(error) for m in THROTTLE_MARKERS)
+    requested = data.attrs.get("requested", 0)
+    return requested >= THROTTLE_MIN_REQUESTED and data.attrs.get("missing", 0) == requested
+
+
+async def _fetch_one(batch, fetch, bucket: TokenBucket, breaker: CircuitBreaker):
+    waited = time.monotonic()
+    await breaker.wait()
+    await bucket.acquire()
+    start = time.monotonic()
+    metrics.count("fetch.sleep", start - waited)
+    data = error = None
+    try:
+        data = await asyncio.to_thread(fetch, batch)
+    except Exception as e:
+        logger.warning(f"  バッチダウンロード失敗: {e}")
+        error = e
+    return batch, data, time.monotonic() - start, _is_throttled(data, error)
+
+
+async def _run(symbols: list[str], fetch, out: queue.Queue, stop: threading.Event):
+    bucket = TokenBucket(RATE, capacity=MAX_IN_FLIGHT)
+    breaker = CircuitBreaker()
+    ctl = AdaptiveController(bucket)
+    pending = deque(symbols)
+    attempts: dict[str, int] = {}
+    tasks = set()
+    done_syms = 0
+
+    while (pending or tasks) and not stop.is_set():
+        while pending and len(tasks) < ctl.concurrency:
+            batch = [pending.popleft() for _ in range(min(ctl.batch_size, len(pending)))]
+            tasks.add(asyncio.create_task(_fetch_one(batch, fetch, bucket, breaker)))
+
+        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            batch, data, latency, throttled = task.result()
+            failed = data is None
+            ctl.record(latency, throttled, failed)
+            breaker.record(throttled)
+            metrics.observe("fetch.batch", latency)
+            metrics.count("fetch.failures", failed)
+            metrics.count("fetch.throttled", throttled)
+
+            attempt = max(attempts.get(sym, 0) for sym in batch)
+            if (throttled or failed) and attempt < MAX_RETRIES:
+                metrics.count("fetch.retries")
+                for sym in batch:
+                    attempts[sym] = attempt + 1
+                pending.extendleft(reversed(batch))
+                continue
+
+            if stop.is_set():
+                break
+            done_syms += len(batch)
+            metrics.count("fetch.rows", len(batch))
+            logger.info(
+                f"  バッチ完了 {done_syms}/{len(symbols)} ({len(batch)}銘柄, {latency:.1f}秒) "
+                f"並列{ctl.concurrency} サイズ{ctl.batch_size} {bucket.rate:.2f}/秒"
+            )
+            # 消費側が追いつかないときは取得を止める（メモリを溜め込まない）
+            await asyncio.to_thread(out.put, (batch, data))
+            del data
+
+    for task in tasks:
+        task.cancel()
+
+
+_DONE = object()
+
+
+def iter_batches(symbols: list[str], fetch=None):
+    """symbols をバッチに分けて並列取得し、完了順に返す。
+
+    取得済みで未消費のバッチは MAX_IN_FLIGHT 個まで。途中で読むのをやめると取得も止まる。
+
+    Yields:
+        (batch, data): data は fetch(batch)（既定は history.download）の結果。
+            リトライしても失敗した場合は None。
+    """
+    fetch = fetch or history.download
+    out: queue.Queue = queue.Queue(maxsize=MAX_IN_FLIGHT)
+    stop = threading.Event()
+
+    def runner():
+        try:
+            asyncio.run(_run(symbols, fetch, out, stop))
+        except BaseException as e:
+            if not stop.is_set():
+                out.put(e)
+        finally:
+            if not stop.is_set():
+                out.put(_DONE)
+
+    threading.Thread(target=runner, name="fetcher", daemon=True).start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+            del item
+    finally:
+        # 途中で読むのをやめた場合は取得を止め、待っている put を外して溜まったフレームを捨てる
+        stop.set()
+        while True:
+            try:
+                out.get_nowait()
+            except queue.Empty:
+                break
@@ -0,0 +1,201 @@
+"""銘柄別の日足履歴キャッシュ（OHLCV + 配当）
+
+scan_dividends / lowcheck が共有するローカル履歴ストア。
+銘柄ごとに最終取得日を記録し、2回目以降は不足分だけを取得元（provider）から取ってマージする。
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, timezone, timedelta
+
+import pandas as pd
+
+import provider
+import trading_calendar
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+CACHE_DIR = os.environ.get("HISTORY_CACHE_DIR", "cache/history")
+INDEX_FILE = "index.json"
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume", "Dividends", "Stock Splits"]
+KEEP_DAYS = 400  # 52週 + 余裕
+STALE_TRADING_DAYS = 3  # 最後の足の後にこの営業日数以上の足が無い銘柄は取れなかったものとする（売買停止・上場廃止）
+
+_index_lock = threading.Lock()
+
+
+def _path(sym: str) -> str:
+    return os.path.join(CACHE_DIR, f"{sym}.pkl")
+
+
+def _read_index() -> dict:
+    try:
+        with open(os.path.join(CACHE_DIR, INDEX_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_index(index: dict):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = os.path.join(CACHE_DIR, f"{INDEX_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, sort_keys=True)
+    os.replace(tmp, os.path.join(CACHE_DIR, INDEX_FILE))
+
+
+def load(sym: str) -> pd.DataFrame | None:
+    """キャッシュ済みの日足を返す。未取得なら None。"""
+    try:
+        return pd.read_pickle(_path(sym))
+    except (FileNotFoundError, EOFError):
+        return None
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.reindex(columns=COLUMNS)
+    df[["Dividends", "Stock Splits"]] = df[["Dividends", "Stock Splits"]].fillna(0.0)
+    # 終値が無い日でも配当・分割のある行は残す（直近12か月の配当合計から落とさない）
+    events = (df["Dividends"] != 0) | (df["Stock Splits"] != 0)
+    df = df[df["Close"].notna() | events]
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    df.index = df.index.normalize()
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def split_frames(data: pd.DataFrame, batch: list[str]) -> dict[str, pd.DataFrame]:
+    """yf.download の結果を銘柄別に分解する（1銘柄時のフラット列にも対応）"""
+    out = {}
+    if data is None or data.empty:
+        return out
+    if isinstance(data.columns, pd.MultiIndex):
+        present = set(data.columns.get_level_values(0))
+        for sym in batch:
+            if sym in present:
+                df = _normalize(data[sym].copy())
+                if len(df):
+                    out[sym] = df
+    elif len(batch) == 1:
+        df = _normalize(data.copy())
+        if len(df):
+            out[batch[0]] = df
+    return out
+
+
+def combine(frames: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """銘柄別の日足を、列が (ticker, field) の MultiIndex の1つのフレームにまとめる（日付は和集合）。"""
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, axis=1, sort=True)
+
+
+def stale(last: date, today: date, days: int = STALE_TRADING_DAYS) -> bool:
+    """最後の足が last の銘柄に、today までに days 営業日以上の足が無いか（当日の足は数えない）。
+
+    last は date か datetime64[D] の配列（配列なら銘柄ごとの bool 配列を返す）。
+    """
+    return trading_calendar.trading_days_between(last, today) >= days
+
+
+def _download(batch: list[str], **kwargs) -> dict[str, pd.DataFrame]:
+    return split_frames(provider.get().download(batch, **kwargs), batch)
+
+
+def _merge(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    # 重複日は新しい方を採用（場中に取得した未確定の足を上書きするため）
+    merged = pd.concat([old[~old.index.isin(new.index)], new]).sort_index()
+    cutoff = merged.index[-1] - pd.Timedelta(days=KEEP_DAYS)
+    return merged[merged.index >= cutoff]
+
+
+def download(batch: list[str]) -> pd.DataFrame:
+    """batch の直近1年分の日足を返す。
+
+    キャッシュがある銘柄は最終取得日以降のみ取得してマージし、
+    無い銘柄・株式分割を検知した銘柄は1年分を取り直す。
+    最後の足が古い銘柄（stale）は差分で取らずに1年分を取り直し、それでも新しい足が無ければ取れなかったものとする。
+
+    Returns:
+        pd.DataFrame: 列が (ticker, field) の MultiIndex。取得できなかった銘柄は含まない。
+            attrs["requested"] / attrs["missing"] にネットワーク取得を試みた銘柄数と
+            何も返ってこなかった銘柄数を入れる（レート制御の判定用）。
+    """
+    index = _read_index()
+    today = datetime.now(JST).date()
+    frames: dict[str, pd.DataFrame] = {}
+    updated = set()
+    requested = missing = 0
+
+    warm, cold = {}, []
+    for sym in batch:
+        last = index.get(sym)
+        cached = load(sym) if last else None
+        # 最後の足が古い銘柄は差分取得に入れない（バッチ全体の取得開始日を遡らせないため）
+        if cached is None or stale(date.fromisoformat(last), today):
+            cold.append(sym)
+        else:
+            warm[sym] = cached
+
+    refetch = []
+    if warm:
+        # 最終取得日を含めて取り直す（前回が場中だった場合の足を確定値で上書き）
+        start = min(index[sym] for sym in warm)
+        new = _download(list(warm), start=start)
+        requested += len(warm)
+        missing += len(warm) - len(new)
+        for sym, old in warm.items():
+            if sym not in new:
+                # 最後の足は新しいので、まだ次の足が出ていないだけとみなしてキャッシュを使う
+                frames[sym] = old
+                continue
+            delta = new[sym][new[sym].index >= old.index[-1]]
+            if (delta["Stock Splits"] > 0).any():
+                # 分割があると過去の株価が遡って調整されるので全量取り直し
+                logger.info(f"  {sym}: 株式分割を検知、履歴を再取得")
+                refetch.append(sym)
+                continue
+            frames[sym] = _merge(old, delta)
+            updated.add(sym)
+    cold += refetch
+
+    n_stale = 0
+    if cold:
+        full = _download(cold, period="1y")
+        requested += len(cold)
+        for sym, df in full.items():
+            if stale(df.index[-1].date(), today):
+                n_stale += 1
+                continue
+            frames[sym] = df
+            updated.add(sym)
+        missing += len(cold) - len(full) + n_stale
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for sym in updated:
+        frames[sym].to_pickle(_path(sym))
+    if updated:
+        # 並列実行中の他バッチ・他シャードの更新を消さないよう、読み直してからマージする
+        with _index_lock, open(os.path.join(CACHE_DIR, INDEX_FILE + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            index = _read_index()
+            for sym in updated:
+                index[sym] = frames[sym].index[-1].date().isoformat()
+            _write_index(index)
+
+    logger.info(
+        f"  履歴: キャッシュ {len(warm) - len(refetch)}銘柄, 全量取得 {len(cold)}銘柄"
+        + (f"（うち足が古く取得失敗扱い {n_stale}銘柄）" if n_stale else "")
+    )
+
+    cutoff = pd.Timestamp(today) - pd.DateOffset(years=1)
+    data = combine({sym: df[df.index > cutoff] for sym, df in frames.items()})
+    data.attrs["requested"] = requested
+    data.attrs["missing"] = missing
+    return data
+
@@ -1,13 +1,24 @@
 """26週・52週安値スクリーニング（東証全銘柄）"""
 
+import argparse
 import logging
 import time
+from collections.abc import Iterator
 from datetime import datetime, timezone, timedelta
 
-import yfinance as yf
+import numpy as np
+import pandas as pd
 
-from fetch_tickers import fetch_tse_tickers
-from textutil import fit
+import analytics
+import fetcher
+import metrics
+import provider
+import report
+import retry_queue
+import rolling_lows
+import shard
+import store
+from universe import Results, Universe
 
 JST = timezone(timedelta(hours=9))
 logger = logging.getLogger(__name__)
@@ -17,131 +28,126 @@ PERIODS = [
     ("52w", 365),
 ]
 
-BATCH_SIZE = 100
-SLEEP_BETWEEN = 2.0
 NEAR_LOW_PCT = 1.0  # 安値から1%以内でアラート
 
-
-def scan_lows(tickers: list[dict]) -> list[dict]:
-    """全銘柄の安値近接チェック。安値1%以内の銘柄のみ返す。"""
-    ticker_map = {t["ticker"]: t for t in tickers}
-    symbols = [t["ticker"] for t in tickers]
-    results = []
-
-    for i in range(0, len(symbols), BATCH_SIZE):
-        batch = symbols[i : i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(symbols) + BATCH_SIZE - 1) // BATCH_SIZE
-        logger.info(f"  batch {batch_num}/{total_batches} ({len(batch)})")
-
-        try:
-            data = yf.download(
-                batch, period="1y", auto_adjust=False,
-                group_by="ticker", threads=True, progress=False,
-            )
-
-            for sym in batch:
-                try:
-                    if len(batch) == 1:
-                        close = data["Close"].dropna()
-                    else:
-                        close = data[(sym, "Close")].dropna()
-
-                    if len(close) < 10:
-                        continue
-
-                    current = float(close.iloc[-1])
-                    lows = {}
-                    near_any = False
-                    for label, days in PERIODS:
-                        window = close.iloc[-days:] if len(close) >= days else close
-                        low = float(window.min())
-                        pct = (current - low) / low * 100 if low > 0 else 999
-                        lows[label] = {"low": low, "pct": pct}
-                        if pct < NEAR_LOW_PCT:
-                            near_any = True
-
-                    if near_any:
-                        info = ticker_map.get(sym, {})
-                        results.append({
-                            "code": sym.replace(".T", ""),
-                            "name": info.get("name", ""),
-                            "price": current,
-                            "lows": lows,
-                        })
-                except (KeyError, IndexError):
-                    pass
-
-        except Exception as e:
-            logger.warning(f"  batch failed: {e}")
-
-        if i + BATCH_SIZE < len(symbols):
-            time.sleep(SLEEP_BETWEEN)
-
-    # 52w安値に近い順でソート
-    results.sort(key=lambda x: x["lows"]["52w"]["pct"])
-    return results
+# Results の列（rolling_lows.update の表・lowcheck テーブルと同じ名前）
+COLUMNS = ["price"] + [f"{kind}_{label}" for label, _ in PERIODS for kind in ("low", "pct")]
+
+
+def select_near(df: pd.DataFrame, tickers: Universe) -> Results:
+    """rolling_lows.update の表から安値1%以内の銘柄を取り出す。"""
+    df = df[df["n_close"] >= 10]
+    near = np.logical_or.reduce([df[f"pct_{label}"] < NEAR_LOW_PCT for label, _ in PERIODS])
+    return Results.from_frame(tickers, df[near], COLUMNS)
+
+
+def checkpoint_rows(batch: list[str], near: Results) -> dict:
+    """select_near の結果を store.save_checkpoint 用に {ticker: 結果 or None} にする。"""
+    rows = dict.fromkeys(batch)
+    rows.update({r["ticker"]: {c: r[c] for c in COLUMNS} for r in near})
+    return rows
+
+
+def by_low(row):
+    """52w 安値に近い順（同率はコード順）の並び替えキー。シャード統合後も同じ順になるようにする。"""
+    return row["pct_52w"], row["code"]
+
+
+def scan_stream(tickers: Universe, scan: str = "lowcheck",
+                state_path: str = rolling_lows.STATE_PATH) -> Iterator[Results]:
+    """全銘柄の安値近接チェック。安値1%以内の銘柄をバッチが完了するたびに返す。
+
+    期間安値は rolling_lows の状態を前回以降の足だけで更新して求める。
+    完了したバッチの結果は alerts.db に記録し、同じ日に再実行すると記録済みの銘柄を最初に返してから
+    未完了の銘柄を取りに行く。scan は途中結果の記録名、state_path は安値状態の保存先
+    （シャード実行ではシャードごとに分ける）。
+    取れなかった銘柄は retry_queue に記録し、再試行の日が来るまでスキャンしない。
+    """
+    symbols, retrying = retry_queue.plan("lowcheck", tickers.tickers)
+
+    done, failed = store.load_checkpoint(scan)
+    failures = dict.fromkeys(failed, "no_data")  # 途中結果には失敗の理由が残らない
+    remaining = [sym for sym in symbols if sym not in done and sym not in failures]
+    del failed
+    if done or failures:
+        logger.info(f"途中結果から再開: {len(symbols) - len(remaining)}銘柄済み")
+        rows = Results.from_records(tickers, done, COLUMNS)
+        del done
+        if rows:
+            yield rows
+
+    state = rolling_lows.load_state(tickers.tickers, max(days for _, days in PERIODS), state_path)
+    for batch, table in fetcher.iter_batches(remaining, fetch=lambda b: rolling_lows.update(b, state, PERIODS)):
+        if table is None:
+            failures.update(dict.fromkeys(batch, "fetch_error"))
+            store.save_checkpoint(scan, 1, {}, batch)
+            continue
+        present = set(table.index[table["n_close"] > 0])
+        f = [sym for sym in batch if sym not in present]
+        failures.update(dict.fromkeys(f, "no_data"))
+        with metrics.span("compute"):
+            near = select_near(table, tickers)
+        del table
+        store.save_checkpoint(scan, 1, checkpoint_rows([sym for sym in batch if sym in present], near), f)
+        if near:
+            yield near
+    rolling_lows.save_state(state, state_path)
+    retry_queue.update("lowcheck", retrying, failures)
+    store.clear_checkpoint(scan)
+
+
+def scan_lows(tickers: Universe) -> Results:
+    """全銘柄の安値近接チェック。安値1%以内の銘柄を 52w 安値に近い順で返す。"""
+    return Results.concat(tickers, list(scan_stream(tickers)), COLUMNS).sorted(by_low)
 
 
 NW = 16
 
 
-def build_text(stocks: list[dict], scan_info: dict) -> str:
-    now = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
+def _low_text(s, label: str) -> str:
+    """期間安値。安値から NEAR_LOW_PCT 以内なら先頭を * にする。"""
+    val = f"{s[f'low_{label}']:>7,.0f}"
+    return "*" + val[1:] if s[f"pct_{label}"] < NEAR_LOW_PCT else val
 
-    sep = f"+------+{'-'*(NW+2)}+---------+---------+---------+"
-    hdr = f"| code | {fit('name', NW)} |   price |  26w lo |  52w lo |"
-
-    lines = []
-    lines.append(f"  Low Price Screener  {now}")
-    lines.append(f"  within {NEAR_LOW_PCT:.0f}% of period low: {len(stocks)} stocks")
-    lines.append("")
-    lines.append(sep)
-    lines.append(hdr)
-    lines.append(sep)
-    for s in stocks:
-        name = fit(s["name"], NW)
-        price = f"{s['price']:>7,.0f}"
-        cols = []
-        for label, _ in PERIODS:
-            low = s["lows"][label]["low"]
-            pct = s["lows"][label]["pct"]
-            val = f"{low:>7,.0f}"
-            if pct < NEAR_LOW_PCT:
-                val = "*" + val[1:]
-            cols.append(val)
-        c26 = cols[0]
-        c52 = cols[1]
-        lines.append(f"| {s['code']} | {name} | {price} | {c26} | {c52} |")
-    lines.append(sep)
-    lines.append("  * = within 1% of period low")
-    lines.append("")
-    lines.append(f"  scanned: {scan_info['total']}  duration: {scan_info['duration']}")
-    lines.append("")
-
-    return "\n".join(lines)
-
-
-def main():
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
-    start = time.time()
 
-    tickers = fetch_tse_tickers()
-    logger.info(f"対象: {len(tickers)}銘柄")
+REPORT_COLUMNS = [
+    report.col("code", "code", 4, lambda s: s["code"], align="<"),
+    report.col("name", "name", NW, lambda s: s["name"], align="<", fit=True),
+    report.col("price", "price", 7, lambda s: s["price"], ",.0f"),
+    *(
+        report.col(f"low_{label}", f"{label} lo", 7, lambda s, label=label: s[f"low_{label}"],
+                   text=lambda s, label=label: _low_text(s, label))
+        for label, _ in PERIODS
+    ),
+    report.col("seen", "seen", 4, lambda s: s.get("seen", "")),
+]
 
-    stocks = scan_lows(tickers)
 
-    duration = time.time() - start
-    m, s = int(duration // 60), int(duration % 60)
-    duration_str = f"{m}m{s}s"
+def write_outputs(stocks, scan_info: dict):
+    """lowcheck.html / 件名 / フラグを書き出す。当日分を DB に保存した後に呼ぶ（新規・継続の注記に使う）。
 
-    logger.info(f"安値近接: {len(stocks)}銘柄 ({duration_str})")
+    stocks は Results（--merge では途中結果から戻した dict のリスト）。
 
-    scan_info = {"total": len(tickers), "duration": duration_str}
-    text = build_text(stocks, scan_info)
+    REPORT_FORMATS で lowcheck_table.html / lowcheck.csv / lowcheck.json も同じ走査で書く。
+    """
+    seen = analytics.annotate("lowcheck", [s["code"] for s in stocks])
+    stocks = [{**s, "seen": seen[s["code"]]} for s in stocks]
 
-    with open("lowcheck.html", "w", encoding="utf-8") as f:
-        f.write(f'<pre style="font-size:11px">{text}</pre>')
+    now = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
+    new = sum(s["seen"] == "NEW" for s in stocks)
+    head = [
+        f"  Low Price Screener  {now}",
+        f"  within {NEAR_LOW_PCT:.0f}% of period low: {len(stocks)} stocks ({new} new)",
+        "",
+    ]
+    foot = [
+        "  * = within 1% of period low",
+        "  seen: NEW = first time, back = returned, 3d = 3 trading days in a row",
+        "",
+        f"  scanned: {scan_info['total']}  duration: {scan_info['duration']}",
+        "",
+    ]
+    report.write("lowcheck", REPORT_COLUMNS, stocks, head, foot, style=' style="font-size:11px"')
 
     today = datetime.now(JST).strftime("%Y-%m-%d")
     mark = "!!" if stocks else ""
@@ -151,9 +157,67 @@ def main():
     with open("lowcheck_flag.txt", "w") as f:
         f.write("1" if stocks else "")
 
-    if stocks:
-        from store import save_lowcheck
-        save_lowcheck(stocks)
+
+def _duration(seconds: float) -> str:
+    return f"{int(seconds // 60)}m{int(seconds % 60)}s"
+
+
+@metrics.recorded("lowcheck")
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="26週・52週安値スクリーニング")
+    parser.add_argument("--shard", type=shard.parse, metavar="i/N",
+                        help="銘柄を N 分割した i 番目だけをスキャンし、途中結果を書き出す")
+    parser.add_argument("--merge", type=int, metavar="N", help="N 個の途中結果を統合してレポートと DB を書く")
+    parser.add_argument("--workers", type=int, metavar="N", help="N プロセスに分けてスキャンし、統合まで行う")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        shard.run_local(__file__, args.workers)
+        args.merge = args.workers
+    if args.merge:
+        stocks, info = shard.read_partials("lowcheck", args.merge)
+        stocks.sort(key=by_low)
+        store.save_lowcheck(stocks)
+        store.mark_period("lowcheck")
+        scan_info = {"total": info["total"], "duration": _duration(info["duration"])}
+        logger.info(f"{args.merge}シャードを統合: 安値近接 {len(stocks)}銘柄")
+        write_outputs(stocks, scan_info)
+        shard.clear_partials("lowcheck", args.merge)
+        return
+
+    start = time.time()
+
+    tickers = provider.get().universe()
+    scan, state_path = "lowcheck", rolling_lows.STATE_PATH
+    if args.shard:
+        tickers = shard.select(tickers, *args.shard)
+        scan = shard.name(scan, *args.shard)
+        metrics.rename(scan)
+        state_path = shard.path(state_path, *args.shard)
+    logger.info(f"対象: {len(tickers)}銘柄")
+
+    # 安値近接の銘柄はバッチが終わるたびに DB に書き、レポート用に手元にも溜める
+    # （シャード実行では DB への保存は統合時にまとめて行う）
+    parts = []
+    for rows in scan_stream(tickers, scan=scan, state_path=state_path):
+        if not args.shard:
+            store.save_lowcheck(rows)
+        parts.append(rows)
+    stocks = Results.concat(tickers, parts, COLUMNS).sorted(by_low)
+    if not args.shard:
+        store.mark_period("lowcheck")
+
+    duration = time.time() - start
+    duration_str = _duration(duration)
+
+    logger.info(f"安値近接: {len(stocks)}銘柄 ({duration_str})")
+
+    if args.shard:
+        shard.write_partial("lowcheck", *args.shard, stocks.to_records(), len(tickers), duration)
+        return
+    scan_info = {"total": len(tickers), "duration": duration_str}
+    write_outputs(stocks, scan_info)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,19 @@
 """高配当銘柄アラート - メインエントリーポイント"""
 
+import argparse
 import logging
 import time
 from datetime import datetime, timezone, timedelta
 
-from fetch_tickers import fetch_tse_tickers
-from scan_dividends import scan_all
-from textutil import fit
+import analytics
+import dividend_index
+import metrics
+import provider
+import report
+import shard
+import store
+from scan_dividends import COLUMNS, by_yield, scan_stream
+from universe import Results
 
 JST = timezone(timedelta(hours=9))
 THRESHOLD = 0.05  # 5.0%
@@ -20,69 +27,117 @@ logger = logging.getLogger(__name__)
 NW = 18  # name column width
 
 
-def build_text(stocks: list[dict], scan_info: dict) -> str:
-    today = datetime.now(JST).strftime("%Y-%m-%d")
-
-    sep = f"+------+{'-'*(NW+2)}+-------+---------+--------+"
-    hdr = f"| code | {fit('name', NW)} | yield |   price |    div |"
-
-    lines = []
-    lines.append(f"  Dividend Alert  {today}")
-    lines.append(f"  yield >= 5.0%: {len(stocks)} stocks")
-    lines.append("")
-    lines.append(sep)
-    lines.append(hdr)
-    lines.append(sep)
-    for s in stocks:
-        code = s["ticker"].replace(".T", "")
-        name = fit(s["name"], NW)
-        y_pct = f"{s['dividend_yield'] * 100:5.2f}%"
-        price = f"{s['price']:>7,.0f}"
-        div = f"{s['annual_dividend']:>6,.1f}"
-        lines.append(f"| {code} | {name} | {y_pct} | {price} | {div} |")
-    lines.append(sep)
-    lines.append("")
-    lines.append(f"  scanned: {scan_info['total']}  duration: {scan_info['duration']}")
-    lines.append(f"  * trailing 12m actual / may include special dividends")
-    lines.append("")
-
-    return "\n".join(lines)
-
-
-def main():
-    start = time.time()
+def _code(s) -> str:
+    return s["ticker"].replace(".T", "")
 
-    tickers = fetch_tse_tickers()
-    logger.info(f"対象銘柄数: {len(tickers)}")
 
-    qualified = scan_all(tickers, threshold=THRESHOLD)
+REPORT_COLUMNS = [
+    report.col("code", "code", 4, _code, align="<"),
+    report.col("name", "name", NW, lambda s: s["name"], align="<", fit=True),
+    report.col("dividend_yield", "yield", 6, lambda s: s["dividend_yield"],
+               text=lambda s: f"{s['dividend_yield'] * 100:.2f}%"),
+    report.col("price", "price", 7, lambda s: s["price"], ",.0f"),
+    report.col("annual_dividend", "div", 6, lambda s: s["annual_dividend"], ",.1f"),
+    report.col("seen", "seen", 4, lambda s: s.get("seen", "")),
+]
 
-    duration = time.time() - start
-    minutes = int(duration // 60)
-    seconds = int(duration % 60)
-    duration_str = f"{minutes}分{seconds}秒"
 
-    logger.info(f"スキャン完了: {len(qualified)}銘柄が閾値以上 (所要時間: {duration_str})")
+def write_outputs(qualified, scan_info: dict):
+    """result.html / subject.txt を書き出す。当日分を DB に保存した後に呼ぶ（新規・継続の注記に使う）。
 
-    if qualified:
-        scan_info = {"total": len(tickers), "duration": duration_str}
-        text = build_text(qualified, scan_info)
-        with open("result.html", "w", encoding="utf-8") as f:
-            f.write(f"<pre>{text}</pre>")
+    qualified は Results（--merge では途中結果から戻した dict のリスト）。
 
+    REPORT_FORMATS で result_table.html / result.csv / result.json も同じ走査で書く。
+    """
+    if qualified:
+        seen = analytics.annotate("dividend", [_code(s) for s in qualified])
+        qualified = [{**s, "seen": seen[_code(s)]} for s in qualified]
         today = datetime.now(JST).strftime("%Y-%m-%d")
+        new = sum(s["seen"] == "NEW" for s in qualified)
+        head = [
+            f"  Dividend Alert  {today}",
+            f"  yield >= 5.0%: {len(qualified)} stocks ({new} new)",
+            "",
+        ]
+        foot = [
+            "",
+            f"  scanned: {scan_info['total']}  duration: {scan_info['duration']}",
+            "  * trailing 12m actual / may include special dividends",
+            "  seen: NEW = first time, back = returned, 3w = 3 weeks in a row",
+            "",
+        ]
+        report.write("result", REPORT_COLUMNS, qualified, head, foot)
+
         with open("subject.txt", "w", encoding="utf-8") as f:
             f.write(f"[配当アラート] {len(qualified)}件 ({today})")
 
         logger.info(f"result.html 出力完了 ({len(qualified)}銘柄)")
-
-        from store import save_dividend
-        save_dividend(qualified)
     else:
         logger.info("閾値以上の銘柄なし")
         with open("result.html", "w", encoding="utf-8") as f:
             f.write("")
 
 
+def _duration(seconds: float) -> str:
+    return f"{int(seconds // 60)}分{int(seconds % 60)}秒"
+
+
+@metrics.recorded("dividend")
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="高配当銘柄アラート")
+    parser.add_argument("--shard", type=shard.parse, metavar="i/N",
+                        help="銘柄を N 分割した i 番目だけをスキャンし、途中結果を書き出す")
+    parser.add_argument("--merge", type=int, metavar="N", help="N 個の途中結果を統合してレポートと DB を書く")
+    parser.add_argument("--workers", type=int, metavar="N", help="N プロセスに分けてスキャンし、統合まで行う")
+    args = parser.parse_args(argv)
+
+    if args.workers:
+        shard.run_local(__file__, args.workers)
+        args.merge = args.workers
+    if args.merge:
+        qualified, info = shard.read_partials("dividend", args.merge)
+        qualified.sort(key=by_yield)
+        store.save_dividend(qualified)
+        store.mark_period("dividend")
+        scan_info = {"total": info["total"], "duration": _duration(info["duration"])}
+        logger.info(f"{args.merge}シャードを統合: {len(qualified)}銘柄が閾値以上")
+        write_outputs(qualified, scan_info)
+        shard.clear_partials("dividend", args.merge)
+        return
+
+    start = time.time()
+
+    tickers = provider.get().universe()
+    scan, index_path = "dividend", dividend_index.INDEX_PATH
+    if args.shard:
+        tickers = shard.select(tickers, *args.shard)
+        scan = shard.name(scan, *args.shard)
+        metrics.rename(scan)
+        index_path = shard.path(index_path, *args.shard)
+    logger.info(f"対象銘柄数: {len(tickers)}")
+
+    # 閾値以上の銘柄はバッチが終わるたびに DB に書き、レポート用に手元にも溜める
+    # （シャード実行では DB への保存は統合時にまとめて行う）
+    parts = []
+    for rows in scan_stream(tickers, threshold=THRESHOLD, scan=scan, index_path=index_path):
+        if not args.shard:
+            store.save_dividend(rows)
+        parts.append(rows)
+    qualified = Results.concat(tickers, parts, COLUMNS).sorted(by_yield)
+    if not args.shard:
+        store.mark_period("dividend")
+
+    duration = time.time() - start
+    duration_str = _duration(duration)
+
+    logger.info(f"スキャン完了: {len(qualified)}銘柄が閾値以上 (所要時間: {duration_str})")
+
+    if args.shard:
+        shard.write_partial("dividend", *args.shard, qualified.to_records(), len(tickers), duration)
+        return
+    scan_info = {"total": len(tickers), "duration": duration_str}
+    write_outputs(qualified, scan_info)
+
+
 if __name__ == "__main__":
     main()
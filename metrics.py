@@ -0,0 +1,205 @@
+"""実行ごとの計測（所要時間・件数）と run_metrics テーブル
+
+処理の要所で span（所要時間）と count（件数・秒数の合計）を記録し、
+ジョブの終わりに alerts.db の run_metrics テーブルへまとめて書き出す。
+記録はプロセス内の1か所に溜めるだけなので、recorded() の外では何もしない。
+
+    @metrics.recorded("lowcheck")
+    def main(...):
+        with metrics.span("compute"):
+            ...
+        metrics.count("fetch.rows", len(batch))
+
+CLI で直近の実行の内訳（パーセンタイル）と、過去の実行との比較を表示する:
+
+    python metrics.py                     # ジョブごとの直近の実行
+    python metrics.py lowcheck --runs 20  # 直近の実行を前の19回の中央値と比較
+    python metrics.py lowcheck --name fetch.batch  # 指標の実行ごとの推移
+"""
+
+import argparse
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
+
+JST = timezone(timedelta(hours=9))
+
+_lock = threading.Lock()
+_run: dict | None = None  # {"run": 開始時刻, "job": ジョブ名, "rows": [(name, kind, value)]}
+
+
+def _add(name: str, kind: str, value: float):
+    with _lock:
+        if _run is not None:
+            _run["rows"].append((name, kind, value))
+
+
+def observe(name: str, seconds: float):
+    """所要時間を1件記録する（バッチのレイテンシなど、span で囲めないもの）。"""
+    _add(name, "time", seconds)
+
+
+def count(name: str, n: float = 1):
+    """件数（または待ち時間などの合計値）を加える。同じ名前は保存時に合算する。"""
+    _add(name, "count", n)
+
+
+@contextmanager
+def span(name: str):
+    """囲んだ処理の所要時間を記録する。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    """関数の所要時間を毎回記録するデコレーター。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def rename(job: str):
+    """記録中の実行のジョブ名を変える（シャード実行など、引数を見て決まる場合）。"""
+    with _lock:
+        if _run is not None:
+            _run["job"] = job
+
+
+def recorded(job: str):
+    """関数1回の呼び出しを1回の実行として記録し、終了時に run_metrics に保存するデコレーター。
+
+    run.wall（経過秒）と run.cpu（CPU 秒）も記録する。例外で終わった場合は run.failed を数える。
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            global _run
+            with _lock:
+                _run = {"run": datetime.now(JST).isoformat(timespec="milliseconds"), "job": job, "rows": []}
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                return fn(*args, **kwargs)
+            except BaseException:
+                count("run.failed")
+                raise
+            finally:
+                observe("run.wall", time.perf_counter() - wall)
+                count("run.cpu", time.process_time() - cpu)
+                with _lock:
+                    run, _run = _run, None
+                _save(run)
+        return wrapper
+    return decorator
+
+
+def _save(run: dict):
+    import store
+
+    totals: dict[str, float] = {}
+    rows = []
+    for name, kind, value in run["rows"]:
+        if kind == "count":
+            totals[name] = totals.get(name, 0) + value
+        else:
+            rows.append((name, kind, value))
+    rows += [(name, "count", value) for name, value in totals.items()]
+    store.save_metrics(run["run"], run["job"], rows)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """最近傍順位法のパーセンタイル（q は 0〜100）。"""
+    s = sorted(values)
+    return s[max(0, math.ceil(q / 100 * len(s)) - 1)]
+
+
+def _summary(rows: list[tuple]) -> dict[str, dict]:
+    """1回分の (name, kind, value) を名前ごとにまとめる。"""
+    out: dict[str, dict] = {}
+    for name, kind, value in rows:
+        out.setdefault(name, {"kind": kind, "values": []})["values"].append(value)
+    for s in out.values():
+        v = s["values"]
+        s["n"], s["total"] = len(v), sum(v)
+        if s["kind"] == "time":
+            s["p50"], s["p95"], s["max"] = percentile(v, 50), percentile(v, 95), max(v)
+    return out
+
+
+def _change(value: float, history: list[float]) -> str:
+    if not history:
+        return ""
+    base = percentile(history, 50)
+    if base == 0:
+        return ""
+    return f"{(value / base - 1) * 100:+.0f}%"
+
+
+def report(job: str, runs: int) -> str:
+    """直近の実行の内訳と、それ以前の実行（runs 回まで）の中央値との比較。"""
+    import store
+
+    by_run = store.load_metrics(job, runs)
+    if not by_run:
+        return f"{job}: 記録なし"
+    order = sorted(by_run)
+    latest = _summary(by_run[order[-1]])
+    past = [_summary(by_run[r]) for r in order[:-1]]
+
+    lines = [f"{job}  {order[-1]}  （比較: 前の {len(past)} 回の合計の中央値）", ""]
+    lines.append(f"{'name':<28} {'n':>5} {'total':>10} {'p50':>9} {'p95':>9} {'max':>9} {'vs med':>7}")
+    for name in sorted(latest):
+        s = latest[name]
+        chg = _change(s["total"], [p[name]["total"] for p in past if name in p])
+        if s["kind"] == "time":
+            lines.append(f"{name:<28} {s['n']:>5} {s['total']:>10.2f} {s['p50']:>9.3f} {s['p95']:>9.3f} "
+                         f"{s['max']:>9.3f} {chg:>7}")
+        else:
+            lines.append(f"{name:<28} {'':>5} {s['total']:>10,.2f} {'':>9} {'':>9} {'':>9} {chg:>7}")
+    return "\n".join(lines)
+
+
+def trend(job: str, name: str, runs: int) -> str:
+    """name の実行ごとの推移（time は件数・合計・p50・p95、count は合計）。"""
+    import store
+
+    by_run = store.load_metrics(job, runs)
+    lines = [f"{job}  {name}", ""]
+    lines.append(f"{'run':<30} {'n':>5} {'total':>10} {'p50':>9} {'p95':>9}")
+    for run in sorted(by_run):
+        s = _summary(by_run[run]).get(name)
+        if s is None:
+            continue
+        if s["kind"] == "time":
+            lines.append(f"{run:<30} {s['n']:>5} {s['total']:>10.2f} {s['p50']:>9.3f} {s['p95']:>9.3f}")
+        else:
+            lines.append(f"{run:<30} {'':>5} {s['total']:>10,.2f}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="run_metrics の表示")
+    parser.add_argument("job", nargs="?", help="ジョブ名（省略時は全ジョブの直近の実行）")
+    parser.add_argument("--runs", type=int, default=10, help="比較する実行の回数")
+    parser.add_argument("--name", help="この指標の実行ごとの推移を表示する")
+    args = parser.parse_args(argv)
+
+    import store
+
+    jobs = [args.job] if args.job else store.metric_jobs()
+    for job in jobs:
+        print(trend(job, args.name, args.runs) if args.name else report(job, args.runs))
+        print()
+
+
+if __name__ == "__main__":
+    main()
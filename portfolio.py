@@ -1,15 +1,41 @@
-"""保有銘柄の時価モニタリング"""
+"""保有銘柄の時価モニタリング
 
+保有は HOLDINGS_PATH の CSV（1行1ロット: 口座・コード・株数・取得単価）から読む。ファイルが無ければ PORTFOLIO。
+実行時間の大半は起動と import になるので、pandas / yfinance は import せず、provider.quotes() で
+最新値と前日終値をまとめて取る。銘柄が多いときは BATCH_SIZE 銘柄ずつ、開始を RATE 回/秒までに抑えて問い合わせる。
+前日終値は当日の portfolio 行に記録し、同じ日の2回目以降は DB の値を使って直近1日分だけを取る。
+ただし当日の足ができる前に取った前日終値（2日前の終値）は記録しない。
+時価・前日比・含み損益・口座ごとの合計は NumPy の配列でまとめて求め、1トランザクションで保存する。
+"""
+
+import time
+
+_T0 = time.perf_counter()
+
+import csv
 import logging
+import os
 import sys
 from datetime import datetime, timezone, timedelta
 
-JST = timezone(timedelta(hours=9))
+import numpy as np
+
+import metrics
+import provider
+import report
+import store
 
-import yfinance as yf
+IMPORT_SEC = time.perf_counter() - _T0
+
+JST = timezone(timedelta(hours=9))
 
 logger = logging.getLogger(__name__)
 
+HOLDINGS_PATH = os.environ.get("HOLDINGS_PATH", "holdings.csv")
+BATCH_SIZE = int(os.environ.get("FETCH_BATCH_SIZE", "100"))
+RATE = float(os.environ.get("PORTFOLIO_RATE", "2.0"))  # バッチ開始/秒の上限（時価の問い合わせは日足より軽い）
+
+# HOLDINGS_PATH が無いときの保有（口座・取得単価なし）
 PORTFOLIO = [
     {"code": "2674", "shares": 15000},
     {"code": "8291", "shares": 50000},
@@ -18,76 +44,199 @@ PORTFOLIO = [
 ]
 
 
-def fetch_prices() -> list[dict]:
-    tickers = [f"{h['code']}.T" for h in PORTFOLIO]
-    data = yf.download(tickers, period="5d", progress=False)
-
-    results = []
-    for h in PORTFOLIO:
-        sym = f"{h['code']}.T"
+def load_holdings(path: str = HOLDINGS_PATH) -> list[dict]:
+    """保有ロット [{"account", "code", "shares", "cost"}] を返す。
+
+    CSV の列は account, code, shares, cost（1株あたりの取得単価）。account / cost は空でもよく、
+    同じ口座・銘柄の行は別ロットとして合算する。他の列（取得日など）は読まない。
+    """
+    try:
+        f = open(path, encoding="utf-8", newline="")
+    except FileNotFoundError:
+        return [{"account": "", "code": h["code"], "shares": h["shares"], "cost": None} for h in PORTFOLIO]
+    lots = []
+    with f:
+        for n, r in enumerate(csv.DictReader(f), start=2):
+            try:
+                cost = (r.get("cost") or "").strip()
+                lots.append({
+                    "account": (r.get("account") or "").strip(),
+                    "code": r["code"].strip().removesuffix(".T"),
+                    "shares": int(r["shares"]),
+                    "cost": float(cost) if cost else None,
+                })
+            except (KeyError, AttributeError, TypeError, ValueError) as e:
+                raise ValueError(f"{path}:{n}: 保有の行を読めません（{e!r}）") from None
+    return lots
+
+
+def positions(lots: list[dict]) -> dict:
+    """ロットを (口座, 銘柄) ごとの保有にまとめる（最初に現れた順）。
+
+    Returns:
+        {"account": [...], "code": [...], "shares": int64 配列, "cost": 取得額の配列}:
+        取得単価の無いロットを含む保有の cost は NaN
+    """
+    keys = list(dict.fromkeys((lot["account"], lot["code"]) for lot in lots))
+    index = {k: i for i, k in enumerate(keys)}
+    at = np.fromiter((index[(lot["account"], lot["code"])] for lot in lots), dtype=np.intp, count=len(lots))
+    shares = np.array([lot["shares"] for lot in lots], dtype=np.float64)
+    cost = np.array([np.nan if lot["cost"] is None else lot["cost"] for lot in lots], dtype=np.float64)
+    return {
+        "account": [k[0] for k in keys],
+        "code": [k[1] for k in keys],
+        "shares": np.bincount(at, shares, len(keys)).astype(np.int64),
+        "cost": np.bincount(at, shares * cost, len(keys)),
+    }
+
+
+def fetch_quotes(tickers: list[str], prev: bool) -> dict[str, dict]:
+    """BATCH_SIZE 銘柄ずつ、開始の間隔を 1 / RATE 秒以上空けて provider.quotes() に問い合わせる。
+
+    失敗したバッチの銘柄は結果に含まない。
+    """
+    quotes: dict[str, dict] = {}
+    next_start = time.monotonic()
+    for i in range(0, len(tickers), BATCH_SIZE):
+        wait = next_start - time.monotonic()
+        if wait > 0:
+            metrics.count("ratelimit.sleep", wait)
+            time.sleep(wait)
+        next_start = time.monotonic() + 1 / RATE
+        batch = tickers[i:i + BATCH_SIZE]
+        start = time.perf_counter()
         try:
-            if len(PORTFOLIO) == 1:
-                closes = data["Close"].dropna()
-            else:
-                closes = data[("Close", sym)].dropna()
-            price = float(closes.iloc[-1])
-            prev = float(closes.iloc[-2]) if len(closes) >= 2 else price
-            change_pct = (price - prev) / prev * 100 if prev > 0 else 0
-            results.append({
-                "code": h["code"],
-                "shares": h["shares"],
-                "price": price,
-                "value": price * h["shares"],
-                "change_pct": change_pct,
-            })
-        except (KeyError, IndexError) as e:
-            logger.warning(f"{sym} 取得失敗: {e}")
-            results.append({"code": h["code"], "shares": h["shares"], "price": 0, "value": 0, "change_pct": 0})
-
-    return results
-
-
-def build_text(stocks: list[dict], session: str) -> str:
-    now = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
-    total = sum(s["value"] for s in stocks)
+            quotes.update(provider.get().quotes(batch, prev=prev))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # 応答の形が想定と違う場合（KeyError / TypeError）もそのバッチだけを失敗にする
+            logger.warning(f"時価取得失敗（{len(batch)}銘柄）: {e!r}")
+        metrics.observe("fetch.batch", time.perf_counter() - start)
+        metrics.count("fetch.rows", len(batch))
+    metrics.count("fetch.failures", len(tickers) - len(quotes))
+    return quotes
+
+
+def valuate(pos: dict, quotes: dict[str, dict], cached: dict[str, float]) -> list[dict]:
+    """保有ごとの時価・前日比・前日比の金額・含み損益。
+
+    取れなかった銘柄は価格・時価・前日比を 0、含み損益を None にする。
+    行の prev_close（DB に記録して同じ日の2回目以降に使う前日終値）は、cached の値か当日の足から求めた値だけ。
+    """
+    today = datetime.now(JST).date().isoformat()
+    codes = list(dict.fromkeys(pos["code"]))
+    index = {c: i for i, c in enumerate(codes)}
+    q = [quotes.get(f"{c}.T") for c in codes]
+    ok = np.array([r is not None for r in q], dtype=bool)
+    price = np.array([r["price"] if r else 0.0 for r in q], dtype=np.float64)
+    prev_close = np.array(
+        [(cached.get(c) or r["prev"] or np.nan) if r else np.nan for c, r in zip(codes, q)], dtype=np.float64
+    )
+    confirmed = np.array([c in cached or (r is not None and r.get("day") == today) for c, r in zip(codes, q)])
+    record = np.where(confirmed, prev_close, np.nan)
+    prev = np.where(prev_close > 0, prev_close, price)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(ok & (prev > 0), (price - prev) / prev * 100, 0.0)
+
+    at = np.fromiter((index[c] for c in pos["code"]), dtype=np.intp, count=len(pos["code"]))
+    shares = pos["shares"]
+    value = price[at] * shares
+    day_change = np.where(ok[at], (price[at] - prev[at]) * shares, 0.0)
+    pnl = np.where(ok[at], value - pos["cost"], np.nan)
+
+    def opt(a: np.ndarray) -> list:
+        return [None if v != v else v for v in a.tolist()]
+
+    return [
+        {"account": a, "code": c, "shares": s, "price": p, "value": v, "change_pct": ch,
+         "day_change": d, "cost": cost, "pnl": pl, "prev_close": pc}
+        for a, c, s, p, v, ch, d, cost, pl, pc in zip(
+            pos["account"], pos["code"], shares.tolist(), price[at].tolist(), value.tolist(),
+            change_pct[at].tolist(), day_change.tolist(), opt(pos["cost"]), opt(pnl), opt(record[at]),
+        )
+    ]
+
+
+def account_totals(stocks: list[dict]) -> list[dict]:
+    """口座ごとの時価・前日比の金額・含み損益（取得単価のある保有だけの合計）。"""
+    accounts = list(dict.fromkeys(s["account"] for s in stocks))
+    index = {a: i for i, a in enumerate(accounts)}
+    at = np.fromiter((index[s["account"]] for s in stocks), dtype=np.intp, count=len(stocks))
+    n = len(accounts)
+    value = np.bincount(at, np.fromiter((s["value"] for s in stocks), np.float64, len(stocks)), n)
+    change = np.bincount(at, np.fromiter((s["day_change"] for s in stocks), np.float64, len(stocks)), n)
+    pnl = np.fromiter((np.nan if s["pnl"] is None else s["pnl"] for s in stocks), np.float64, len(stocks))
+    known = np.bincount(at, ~np.isnan(pnl), n)
+    pnl = np.bincount(at, np.nan_to_num(pnl), n)
+    return [
+        {"account": a, "value": v, "day_change": d, "pnl": p if k else None}
+        for a, v, d, p, k in zip(accounts, value.tolist(), change.tolist(), pnl.tolist(), known.tolist())
+    ]
+
+
+@metrics.timed("portfolio.fetch")
+def fetch_prices(lots: list[dict] | None = None) -> list[dict]:
+    pos = positions(load_holdings() if lots is None else lots)
+    codes = list(dict.fromkeys(pos["code"]))
+    cached = store.load_prev_closes()
+    need_prev = any(c not in cached for c in codes)
+    quotes = fetch_quotes([f"{c}.T" for c in codes], prev=need_prev)
+    missing = [c for c in codes if f"{c}.T" not in quotes]
+    if missing:
+        more = f" ほか{len(missing) - 20}銘柄" if len(missing) > 20 else ""
+        logger.warning(f"取得失敗: {', '.join(missing[:20])}{more}")
+    return valuate(pos, quotes, cached)
+
+
+REPORT_COLUMNS = [
+    report.col("code", "code", 4, lambda s: s["code"], align="<"),
+    report.col("shares", "shares", 7, lambda s: s["shares"], ","),
+    report.col("change_pct", "前日比", 6, lambda s: s["change_pct"], text=lambda s: f"{s['change_pct']:+.1f}%"),
+    report.col("value", "value", 11, lambda s: s["value"], ",.0f"),
+]
+ACCOUNT_COLUMN = report.col("account", "口座", 8, lambda s: s["account"], align="<", fit=True)
+PNL_COLUMN = report.col("pnl", "含み損益", 11, lambda s: s["pnl"], "+,.0f")
+
 
-    lines = []
-    lines.append(f"  {session}  {now}")
-    lines.append("")
-    lines.append("+------+---------+--------+-------------+")
-    lines.append("| code |  shares | 前日比 |       value |")
-    lines.append("+------+---------+--------+-------------+")
-    for s in stocks:
-        code = s["code"]
-        shares = f"{s['shares']:>7,}"
-        chg = f"{s['change_pct']:+.1f}%"
-        chg = f"{chg:>6}"
-        value = f"{s['value']:>11,.0f}"
-        lines.append(f"| {code} | {shares} | {chg} | {value} |")
-    lines.append("+------+---------+--------+-------------+")
-    lines.append(f"  TOTAL                     {total:>11,.0f}")
-    lines.append("")
-
-    return "\n".join(lines)
+def report_columns(stocks: list[dict]) -> list[dict]:
+    """口座が複数なら口座の列、取得単価があれば含み損益の列を足す。"""
+    columns = list(REPORT_COLUMNS)
+    if len({s["account"] for s in stocks}) > 1:
+        columns.insert(0, ACCOUNT_COLUMN)
+    if any(s["pnl"] is not None for s in stocks):
+        columns.append(PNL_COLUMN)
+    return columns
 
 
+@metrics.recorded("portfolio")
 def main(session: str):
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    metrics.observe("portfolio.import", IMPORT_SEC)
+    start = time.perf_counter()
     stocks = fetch_prices()
-    text = build_text(stocks, session)
-
-    with open("portfolio.html", "w", encoding="utf-8") as f:
-        f.write(f"<pre>{text}</pre>")
+    fetch_sec = time.perf_counter() - start
+    now = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
+    total = sum(s["value"] for s in stocks)
+    head = [f"  {session}  {now}", ""]
+    foot = []
+    accounts = account_totals(stocks)
+    if len(accounts) > 1:
+        for a in accounts:
+            pnl = "" if a["pnl"] is None else f"  損益 {a['pnl']:+,.0f}"
+            foot.append(f"  {report.fit(a['account'] or '-', 24)}  {a['value']:>11,.0f}  前日比 {a['day_change']:+,.0f}{pnl}")
+    foot += [f"  TOTAL                     {total:>11,.0f}", ""]
+    report.write("portfolio", report_columns(stocks), stocks, head, foot)
 
     today = datetime.now(JST).strftime("%Y-%m-%d")
     with open("portfolio_subject.txt", "w", encoding="utf-8") as f:
         f.write(f"[時価] {session} ({today})")
 
-    total = sum(s["value"] for s in stocks)
-    logger.info(f"{session}: 合計時価 {total:,.0f}円")
+    logger.info(f"{session}: 合計時価 {total:,.0f}円（{len(stocks)}保有, {len(accounts)}口座）")
 
-    from store import save_portfolio
-    save_portfolio(stocks, session)
+    store.save_portfolio(stocks, session)
+    logger.info(
+        f"import {IMPORT_SEC * 1000:.0f}ms, 取得 {fetch_sec * 1000:.0f}ms, "
+        f"CPU {time.process_time() * 1000:.0f}ms（起動を含む）"
+    )
 
 
 if __name__ == "__main__":
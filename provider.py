@@ -0,0 +1,302 @@
+"""市場データの取得元
+
+スキャナーは yfinance を直接呼ばず、provider.get() が返す取得元を通す。
+- YahooProvider: 本番用（JPX 銘柄リスト + yfinance）
+- SyntheticProvider: ネットワーク不要の決定的な合成データ（ベンチマーク・動作確認用）
+
+環境変数 MARKET_DATA_PROVIDER=synthetic で合成データに切り替わる。
+"""
+
+import logging
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+
+# quotes() は yfinance を通さず、複数銘柄をまとめて返す spark エンドポイントを直接読む
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/spark"
+QUOTE_TIMEOUT = 10
+
+
+class YahooProvider:
+    """JPX の銘柄リストと yfinance から取得する。"""
+
+    name = "yahoo"
+
+    def __init__(self):
+        self._universe: tuple | None = None
+
+    def universe(self):
+        """東証上場銘柄のリスト（universe.Universe）。同じプロセスでは同じ日（JST）のうちは取り直さない（daemon.py 向け）。"""
+        today = datetime.now(JST).date()
+        if self._universe is None or self._universe[0] != today:
+            from fetch_tickers import fetch_tse_tickers
+            self._universe = (today, fetch_tse_tickers())
+        return self._universe[1]
+
+    def download(self, symbols: list[str], **kwargs):
+        """日足（配当・分割込み）を返す。列は (ticker, field) の MultiIndex。
+
+        kwargs は yf.download の period / start / end をそのまま渡す。
+        """
+        import pandas as pd
+        import yfinance as yf
+
+        data = yf.download(
+            symbols,
+            auto_adjust=False,
+            actions=True,
+            group_by="ticker",
+            threads=True,
+            progress=False,
+            **kwargs,
+        )
+        if data is not None and not data.empty and not isinstance(data.columns, pd.MultiIndex):
+            data = pd.concat({symbols[0]: data}, axis=1)
+        return data
+
+    def info(self, symbol: str) -> dict:
+        import yfinance as yf
+        return yf.Ticker(symbol).info
+
+    def quotes(self, symbols: list[str], prev: bool = True) -> dict[str, dict]:
+        """最新値と前日終値を1回のリクエストでまとめて返す（pandas / yfinance を import しない）。
+
+        prev=False なら前日終値は求めず、直近1日分だけを取る。
+        前日終値は最新の足の1本前の終値なので、当日の足ができる前は2日前の終値になる（day で確かめる）。
+
+        Returns:
+            {symbol: {"price": 最新値, "prev": 前日終値 or None, "day": 最新の足の日付（JST） or None}}:
+            取れなかった銘柄は含まない
+        """
+        import json
+        import urllib.parse
+        import urllib.request
+
+        query = urllib.parse.urlencode({
+            "symbols": ",".join(symbols),
+            "range": "5d" if prev else "1d",
+            "interval": "1d",
+        })
+        req = urllib.request.Request(f"{QUOTE_URL}?{query}", headers={"User-Agent": "Mozilla/5.0"})
+        with urllib.request.urlopen(req, timeout=QUOTE_TIMEOUT) as res:
+            body = json.load(res)
+
+        out = {}
+        for result in (body.get("spark") or {}).get("result") or []:
+            symbol = result.get("symbol")
+            if not symbol:
+                continue  # 銘柄の付いていない要素は捨てる（他の銘柄は使う）
+            for r in result.get("response") or []:
+                quote = ((r.get("indicators") or {}).get("quote") or [{}])[0]
+                closes = [c for c in quote.get("close") or [] if c is not None]
+                price = (r.get("meta") or {}).get("regularMarketPrice") or (closes[-1] if closes else None)
+                if price is None:
+                    continue
+                last = max(
+                    (t for t, c in zip(r.get("timestamp") or [], quote.get("close") or []) if c is not None),
+                    default=None,
+                )
+                out[symbol] = {
+                    "price": float(price),
+                    "prev": float(closes[-2]) if prev and len(closes) >= 2 else None,
+                    "day": datetime.fromtimestamp(last, JST).date().isoformat() if last else None,
+                }
+        return out
+
+
+SERIES_CACHE_SIZE = 1024  # 合成した日足を覚えておく銘柄数（メモリが銘柄数に比例しないよう上限を置く）
+
+SECTORS = ["水産・農林業", "建設業", "食料品", "化学", "医薬品", "機械", "電気機器",
+           "輸送用機器", "卸売業", "小売業", "銀行業", "情報・通信業", "サービス業"]
+
+
+class SyntheticProvider:
+    """決定的な合成データ。同じ銘柄・同じ seed なら呼び出し順によらず同じ値を返す。
+
+    Args:
+        n_tickers: 銘柄数
+        days: 履歴の営業日数
+        div_per_year: 年間の配当回数
+        missing_rate: 終値が欠損する日の割合
+        dead_rate: 日足が一切返らない銘柄の割合（Phase 2 の対象になる）
+        fail_rate: download 呼び出しが例外になる確率
+        latency: 呼び出し1回あたりの待ち時間（秒）
+        latency_per_symbol: 1銘柄あたりの追加待ち時間（秒）
+        seed: 乱数シード
+    """
+
+    name = "synthetic"
+
+    def __init__(self, n_tickers: int = 4000, days: int = 250, div_per_year: int = 2,
+                 missing_rate: float = 0.01, dead_rate: float = 0.005, fail_rate: float = 0.0,
+                 latency: float = 0.0, latency_per_symbol: float = 0.0, seed: int = 0):
+        self.n_tickers = n_tickers
+        self.days = days
+        self.div_per_year = div_per_year
+        self.missing_rate = missing_rate
+        self.dead_rate = dead_rate
+        self.fail_rate = fail_rate
+        self.latency = latency
+        self.latency_per_symbol = latency_per_symbol
+        self.seed = seed
+        self.end = datetime.now(JST).date()
+        self._index = None
+        self._attempts: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._series = lru_cache(maxsize=SERIES_CACHE_SIZE)(self._build_series)
+
+    @classmethod
+    def from_env(cls) -> "SyntheticProvider":
+        env = os.environ.get
+        return cls(
+            n_tickers=int(env("SYNTH_TICKERS", "4000")),
+            days=int(env("SYNTH_DAYS", "250")),
+            div_per_year=int(env("SYNTH_DIV_PER_YEAR", "2")),
+            missing_rate=float(env("SYNTH_MISSING_RATE", "0.01")),
+            dead_rate=float(env("SYNTH_DEAD_RATE", "0.005")),
+            fail_rate=float(env("SYNTH_FAIL_RATE", "0")),
+            latency=float(env("SYNTH_LATENCY", "0")),
+            latency_per_symbol=float(env("SYNTH_LATENCY_PER_SYMBOL", "0")),
+            seed=int(env("SYNTH_SEED", "0")),
+        )
+
+    def _rng(self, *key):
+        import numpy as np
+        return np.random.default_rng([self.seed, *key])
+
+    def _key(self, sym: str) -> int:
+        return zlib.crc32(sym.encode())
+
+    def _dead(self, sym: str) -> bool:
+        return self._rng(self._key(sym), 1).random() < self.dead_rate
+
+    def universe(self):
+        from universe import Universe
+
+        rng = self._rng(0)
+        return Universe(
+            [f"{1300 + i}.T" for i in range(self.n_tickers)],
+            [f"合成銘柄{i:04d}" for i in range(self.n_tickers)],
+            [SECTORS[rng.integers(len(SECTORS))] for _ in range(self.n_tickers)],
+        )
+
+    def _dates(self):
+        if self._index is None:
+            import pandas as pd
+            self._index = pd.bdate_range(end=pd.Timestamp(self.end), periods=self.days)
+        return self._index
+
+    def _build_series(self, sym: str):
+        import numpy as np
+        import pandas as pd
+
+        rng = self._rng(self._key(sym))
+        n = self.days
+        close = rng.uniform(200, 5000) * np.exp(np.cumsum(rng.normal(0, 0.015, n)))
+        spread = close * rng.uniform(0, 0.02, n)
+        missing = rng.random(n) < self.missing_rate
+        missing[-1] = False
+        divs = np.zeros(n)
+        if self.div_per_year > 0:
+            step = max(1, 245 // self.div_per_year)
+            amount = close.mean() * rng.uniform(0, 0.07) / self.div_per_year
+            divs[rng.integers(step)::step] = round(amount, 1)
+        opens = close + rng.normal(0, 1, n) * spread
+        high, low = close + spread, close - spread
+        for a in (opens, high, low, close):
+            a[missing] = np.nan
+        return pd.DataFrame({
+            "Open": opens,
+            "High": high,
+            "Low": low,
+            "Close": close,
+            "Adj Close": close.copy(),
+            "Volume": rng.integers(1_000, 1_000_000, n),
+            "Dividends": divs,
+            "Stock Splits": 0.0,
+        }, index=self._dates())
+
+    def _sleep(self, n_symbols: int):
+        delay = self.latency + self.latency_per_symbol * n_symbols
+        if delay > 0:
+            time.sleep(delay)
+
+    def download(self, symbols: list[str], start=None, period=None, **kwargs):
+        import pandas as pd
+
+        self._sleep(len(symbols))
+        key = zlib.crc32(",".join(symbols).encode())
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+        if self.fail_rate and self._rng(key, attempt).random() < self.fail_rate:
+            raise RuntimeError("synthetic: injected failure")
+
+        frames = {}
+        for sym in symbols:
+            if self._dead(sym):
+                continue
+            df = self._series(sym)
+            if start is not None:
+                df = df[df.index >= pd.Timestamp(start)]
+            elif period and period.endswith("d"):
+                df = df.iloc[-int(period[:-1]):]
+            elif period and period.endswith("y"):
+                df = df[df.index > df.index[-1] - pd.DateOffset(years=int(period[:-1]))]
+            frames[sym] = df
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1)
+
+    def info(self, symbol: str) -> dict:
+        self._sleep(1)
+        if self._key(symbol) % 2:
+            return {}
+        df = self._series(symbol)
+        price = float(df["Close"].iloc[-1])
+        rate = float(df["Dividends"].sum())
+        return {
+            "regularMarketPrice": price,
+            "trailingAnnualDividendRate": rate,
+            "trailingAnnualDividendYield": rate / price if price > 0 else 0,
+        }
+
+    def quotes(self, symbols: list[str], prev: bool = True) -> dict[str, dict]:
+        self._sleep(len(symbols))
+        out = {}
+        for sym in symbols:
+            if self._dead(sym):
+                continue
+            closes = self._series(sym)["Close"].dropna()
+            out[sym] = {
+                "price": float(closes.iloc[-1]),
+                "prev": float(closes.iloc[-2]) if prev and len(closes) >= 2 else None,
+                "day": closes.index[-1].date().isoformat(),
+            }
+        return out
+
+
+_provider = None
+
+
+def get():
+    """現在の取得元を返す（初回は MARKET_DATA_PROVIDER から決める）。"""
+    global _provider
+    if _provider is None:
+        name = os.environ.get("MARKET_DATA_PROVIDER", "yahoo")
+        _provider = SyntheticProvider.from_env() if name == "synthetic" else YahooProvider()
+        logger.info(f"市場データ取得元: {_provider.name}")
+    return _provider
+
+
+def set_provider(p):
+    """取得元を差し替える。"""
+    global _provider
+    _provider = p
@@ -0,0 +1,255 @@
+"""表形式レポートの共通出力
+
+列の定義（col）と行を受け取り、1回の走査で次の形式に書き出す。
+- pre: 全角幅をそろえた固定幅テキストを <pre> で包んだもの（メール本文。従来の <name>.html）
+- html: <table> の HTML（<name>_table.html）
+- csv / json: 列の生の値（<name>.csv / <name>.json）
+
+既定で書くのは pre だけで、環境変数 REPORT_FORMATS=pre,html,csv,json で増やせる。
+銘柄名の幅合わせ（textutil.fit）の結果は FIT_CACHE_PATH に保存し、次回以降の実行でも使う
+（銘柄名は毎日ほぼ同じなので、全銘柄の表でも幅の計算はほとんど起きない）。
+"""
+
+import csv
+import html
+import json
+import logging
+import os
+from contextlib import ExitStack, contextmanager
+
+import textutil
+
+logger = logging.getLogger(__name__)
+
+FORMATS = [f.strip() for f in os.environ.get("REPORT_FORMATS", "pre").split(",") if f.strip()]
+SUFFIXES = {"pre": ".html", "html": "_table.html", "csv": ".csv", "json": ".json"}
+
+FIT_CACHE_PATH = os.environ.get("FIT_CACHE_PATH", "cache/text/fit.json")
+FIT_CACHE_MAX = 20000  # 保存する件数の上限（超えたら古いものから捨てる）
+
+_fits: dict[str, str] | None = None  # "幅\t文字列" -> fit の結果
+_fits_added = 0
+
+
+def col(name: str, title: str, width: int, value, fmt: str = "", align: str = ">",
+        fit: bool = False, text=None) -> dict:
+    """列の定義。
+
+    Args:
+        name: CSV / JSON のキー
+        title: 見出し
+        width: 固定幅テキストでの表示幅（全角は2）
+        value: 行 -> 生の値（CSV / JSON に出す値）
+        fmt: 表示用の書式（format(value, fmt)）
+        align: ">" 右寄せ / "<" 左寄せ
+        fit: 幅を超える文字列を切り詰める（銘柄名など。結果はキャッシュする）
+        text: 行 -> 表示用の文字列（fmt で足りない場合）
+    """
+    return {"name": name, "title": title, "width": width, "value": value, "fmt": fmt,
+            "align": align, "fit": fit, "text": text}
+
+
+def _load_fits() -> dict[str, str]:
+    global _fits
+    if _fits is None:
+        try:
+            with open(FIT_CACHE_PATH, encoding="utf-8") as f:
+                _fits = json.load(f)
+        except (OSError, ValueError):
+            _fits = {}
+    return _fits
+
+
+def save_fits():
+    """追加された幅合わせの結果を FIT_CACHE_PATH に書き出す。"""
+    global _fits_added
+    if not _fits_added:
+        return
+    fits = _fits
+    if len(fits) > FIT_CACHE_MAX:
+        fits = dict(list(fits.items())[-FIT_CACHE_MAX:])
+    os.makedirs(os.path.dirname(FIT_CACHE_PATH) or ".", exist_ok=True)
+    tmp = f"{FIT_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(fits, f, ensure_ascii=False)
+    os.replace(tmp, FIT_CACHE_PATH)
+    _fits_added = 0
+
+
+def fit(s: str, w: int) -> str:
+    """textutil.fit の結果をキャッシュしたもの。"""
+    global _fits_added
+    if s.isascii():
+        return f"{s[:w]:<{w}}"
+    fits = _load_fits()
+    key = f"{w}\t{s}"
+    out = fits.get(key)
+    if out is None:
+        out = fits[key] = textutil.fit(s, w)
+        _fits_added += 1
+    return out
+
+
+def _align(s: str, w: int, align: str) -> str:
+    if s.isascii():
+        return f"{s:{align}{w}}"
+    space = " " * (w - textutil.width(s))
+    return space + s if align == ">" else s + space
+
+
+def _raw(v):
+    """CSV / JSON に出す値（NaN は空 / null）。"""
+    return None if isinstance(v, float) and v != v else v
+
+
+def _json_default(v):
+    """NumPy の数値など。"""
+    return v.item() if hasattr(v, "item") else str(v)
+
+
+def _cell(c: dict, row: dict) -> str:
+    """表示用の文字列（幅合わせ前）。"""
+    if c["text"]:
+        return c["text"](row)
+    v = c["value"](row)
+    return "" if v is None else format(v, c["fmt"])
+
+
+class _Pre:
+    def __init__(self, f, columns: list[dict], style: str):
+        self.f = f
+        self.columns = columns
+        self.sep = "+" + "+".join("-" * (c["width"] + 2) for c in columns) + "+"
+        self.first = True
+        f.write(f"<pre{style}>")
+
+    def line(self, s: str):
+        self.f.write(("" if self.first else "\n") + html.escape(s, quote=False))
+        self.first = False
+
+    def head(self, lines: list[str]):
+        for s in lines:
+            self.line(s)
+        self.line(self.sep)
+        self.line("|" + "|".join(f" {self._pad(c, c['title'])} " for c in self.columns) + "|")
+        self.line(self.sep)
+
+    def _pad(self, c: dict, s: str) -> str:
+        return fit(s, c["width"]) if c["fit"] else _align(s, c["width"], c["align"])
+
+    def row(self, cells: list[str], values: list):
+        self.line("|" + "|".join(f" {self._pad(c, s)} " for c, s in zip(self.columns, cells)) + "|")
+
+    def foot(self, lines: list[str]):
+        self.line(self.sep)
+        for s in lines:
+            self.line(s)
+        self.f.write("</pre>")
+
+
+class _Html:
+    def __init__(self, f, columns: list[dict], style: str):
+        self.f = f
+        self.columns = columns
+
+    def _attr(self, c: dict) -> str:
+        return ' align="right"' if c["align"] == ">" else ""
+
+    def head(self, lines: list[str]):
+        for s in lines:
+            if s.strip():
+                self.f.write(f"<div>{html.escape(s.strip())}</div>\n")
+        self.f.write('<table border="1" cellspacing="0" cellpadding="3">\n<tr>')
+        self.f.write("".join(f"<th{self._attr(c)}>{html.escape(c['title'])}</th>" for c in self.columns))
+        self.f.write("</tr>\n")
+
+    def row(self, cells: list[str], values: list):
+        self.f.write("<tr>" + "".join(
+            f"<td{self._attr(c)}>{html.escape(s.strip())}</td>" for c, s in zip(self.columns, cells)
+        ) + "</tr>\n")
+
+    def foot(self, lines: list[str]):
+        self.f.write("</table>\n")
+        for s in lines:
+            if s.strip():
+                self.f.write(f"<div>{html.escape(s.strip())}</div>\n")
+
+
+class _Csv:
+    def __init__(self, f, columns: list[dict], style: str):
+        self.w = csv.writer(f)
+        self.columns = columns
+
+    def head(self, lines: list[str]):
+        self.w.writerow([c["name"] for c in self.columns])
+
+    def row(self, cells: list[str], values: list):
+        self.w.writerow(values)
+
+    def foot(self, lines: list[str]):
+        pass
+
+
+class _Json:
+    def __init__(self, f, columns: list[dict], style: str):
+        self.f = f
+        self.names = [c["name"] for c in columns]
+        self.first = True
+
+    def head(self, lines: list[str]):
+        self.f.write("[")
+
+    def row(self, cells: list[str], values: list):
+        obj = dict(zip(self.names, values))
+        self.f.write(("" if self.first else ",") + "\n" + json.dumps(obj, ensure_ascii=False, default=_json_default))
+        self.first = False
+
+    def foot(self, lines: list[str]):
+        self.f.write("\n]\n")
+
+
+WRITERS = {"pre": _Pre, "html": _Html, "csv": _Csv, "json": _Json}
+
+
+def render(columns: list[dict], rows, out: dict, head: list[str] = (), foot: list[str] = (),
+           style: str = "") -> int:
+    """rows を1回だけ走査して、out の各形式（{形式: ファイル}）に書き出す。
+
+    head / foot は表の前後に置く行（pre ではそのまま、html では <div>、csv / json では出さない）。
+    style は pre の <pre> に付ける属性（例: ' style="font-size:11px"'）。
+
+    Returns:
+        int: 行数
+    """
+    writers = [WRITERS[fmt](f, columns, style) for fmt, f in out.items()]
+    raw = any(fmt in ("csv", "json") for fmt in out)
+    for w in writers:
+        w.head(list(head))
+    n = 0
+    for row in rows:
+        cells = [_cell(c, row) for c in columns]
+        values = [_raw(c["value"](row)) for c in columns] if raw else None
+        for w in writers:
+            w.row(cells, values)
+        n += 1
+    for w in writers:
+        w.foot(list(foot))
+    save_fits()
+    return n
+
+
+@contextmanager
+def open_outputs(base: str, formats: list[str] | None = None):
+    """<base>.html などの出力ファイルを開き、{形式: ファイル} を返す。"""
+    with ExitStack() as stack:
+        yield {
+            fmt: stack.enter_context(open(base + SUFFIXES[fmt], "w", encoding="utf-8", newline=""))
+            for fmt in (formats or FORMATS)
+        }
+
+
+def write(base: str, columns: list[dict], rows, head: list[str] = (), foot: list[str] = (),
+          style: str = "", formats: list[str] | None = None) -> int:
+    """render の結果を <base>.html（pre）ほか FORMATS のファイルに書く。"""
+    with open_outputs(base, formats) as out:
+        return render(columns, rows, out, head, foot, style)
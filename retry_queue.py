@@ -0,0 +1,137 @@
+"""取れなかった銘柄の再試行待ち（alerts.db の retry_queue）
+
+スキャンの最後まで取れなかった銘柄（日足が無い・バッチ取得も Phase 2 の問い合わせも失敗した）を
+理由と試行回数つきで記録する。次の実行からは、再試行の日が来た銘柄をスキャンの先頭に回し、
+まだ来ていない銘柄はスキャンしない（バッチの枠も Phase 2 の問い合わせも使わない）。
+
+再試行の間隔は失敗が続くたびに 1, 2, 4, 8, 16 日と延び、QUARANTINE_AFTER 回続いた銘柄
+（上場廃止・データ無しなど）は隔離して QUARANTINE_DAYS 日ごとに1回だけ確かめる。
+再試行で取れた銘柄は待ちから外す。待ちはスキャン（dividend / lowcheck / screens）ごとに持つ
+（日足が無くても配当は Phase 2 で取れる銘柄があるので、安値で取れない銘柄を配当でも見送りはしない）。
+
+Usage:
+    python retry_queue.py                  # 再試行待ちと隔離中の銘柄
+    python retry_queue.py --release 7203   # 全スキャンの待ち・隔離を解除して次の実行で取りに行く
+"""
+
+import argparse
+import logging
+import os
+from datetime import date, datetime, timezone, timedelta
+
+import metrics
+import store
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF_DAYS = int(os.environ.get("RETRY_MAX_BACKOFF_DAYS", "16"))
+QUARANTINE_AFTER = int(os.environ.get("RETRY_QUARANTINE_AFTER", "5"))  # 連続失敗回数
+QUARANTINE_DAYS = int(os.environ.get("RETRY_QUARANTINE_DAYS", "30"))
+
+
+def backoff_days(attempts: int) -> int:
+    """attempts 回続けて失敗した銘柄を次に試すまでの日数。"""
+    if attempts >= QUARANTINE_AFTER:
+        return QUARANTINE_DAYS
+    return min(2 ** (attempts - 1), MAX_BACKOFF_DAYS)
+
+
+def plan(scan: str, symbols: list[str], today: date | None = None) -> tuple[list[str], list[str]]:
+    """scan で今回スキャンする銘柄と、そのうち再試行の銘柄を返す。
+
+    再試行の日が来た銘柄を先頭に置き、まだ来ていない銘柄（隔離中を含む）は除く。
+
+    Returns:
+        (symbols, retrying)
+    """
+    queue = store.load_retry_queue(scan)
+    if not queue:
+        return symbols, []
+    day = (today or datetime.now(JST).date()).isoformat()
+    retrying, rest = [], []
+    waiting = quarantined = 0
+    for sym in symbols:
+        q = queue.get(sym)
+        if q is None:
+            rest.append(sym)
+        elif q["next_retry"] <= day:
+            retrying.append(sym)
+        elif q["quarantined"]:
+            quarantined += 1
+        else:
+            waiting += 1
+    metrics.count("retry.due", len(retrying))
+    metrics.count("retry.skipped", waiting + quarantined)
+    if retrying or waiting or quarantined:
+        logger.info(f"再試行待ち: 今回再試行 {len(retrying)}銘柄, 見送り {waiting}銘柄, 隔離中 {quarantined}銘柄")
+    return retrying + rest, retrying
+
+
+def update(scan: str, retrying: list[str], failures: dict[str, str], today: date | None = None):
+    """scan の今回の失敗 failures {ticker: 理由} を記録し、retrying のうち取れた銘柄を待ちから外す。
+
+    同じ日に2回失敗しても（再実行など）試行回数は1回と数える。
+    """
+    today = today or datetime.now(JST).date()
+    day = today.isoformat()
+    queue = store.load_retry_queue(scan) if failures else {}
+    rows, newly = [], []
+    for sym, reason in failures.items():
+        q = queue.get(sym)
+        if q and q["last_failed"] == day:
+            continue
+        attempts = q["attempts"] + 1 if q else 1
+        next_retry = (today + timedelta(days=backoff_days(attempts))).isoformat()
+        quarantined = int(attempts >= QUARANTINE_AFTER)
+        if quarantined and not (q and q["quarantined"]):
+            newly.append(sym)
+        rows.append((sym, reason, attempts, q["first_failed"] if q else day, day, next_retry, quarantined))
+    resolved = [sym for sym in retrying if sym not in failures]
+    if rows or resolved:
+        store.save_retry_queue(scan, rows, resolved)
+    metrics.count("retry.failed", len(rows))
+    metrics.count("retry.resolved", len(resolved))
+    metrics.count("retry.quarantined", len(newly))
+    if rows or resolved:
+        logger.info(f"再試行待ち: 記録 {len(rows)}銘柄, 解除 {len(resolved)}銘柄")
+    if newly:
+        logger.warning(f"{scan}: {QUARANTINE_AFTER}回続けて取れないため隔離: {', '.join(sorted(newly))}")
+
+
+def queues() -> list[str]:
+    return [r[0] for r in store.get().select("SELECT DISTINCT scan FROM retry_queue ORDER BY scan")]
+
+
+def release(codes: list[str]) -> int:
+    """銘柄（"7203" / "7203.T"）を全スキャンの待ちから外す。外した行数を返す。"""
+    tickers = [c if c.endswith(".T") else f"{c}.T" for c in codes]
+    n = 0
+    for scan in queues():
+        found = [t for t in tickers if t in store.load_retry_queue(scan)]
+        store.save_retry_queue(scan, [], found)
+        n += len(found)
+    return n
+
+
+def main(argv: list[str] | None = None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="取れなかった銘柄の再試行待ち")
+    parser.add_argument("--release", nargs="+", metavar="CODE", help="待ち・隔離を解除する銘柄コード")
+    args = parser.parse_args(argv)
+
+    if args.release:
+        logger.info(f"{release(args.release)}件の待ちを解除")
+        return
+    for scan in queues():
+        queue = store.load_retry_queue(scan)
+        rows = sorted(queue.items(), key=lambda kv: (-kv[1]["quarantined"], kv[1]["next_retry"], kv[0]))
+        print(f"{scan}: 再試行待ち {len(queue)}銘柄（うち隔離 {sum(q['quarantined'] for q in queue.values())}）")
+        for ticker, q in rows:
+            mark = "隔離" if q["quarantined"] else "    "
+            print(f"  {mark} {ticker:<8} 次回 {q['next_retry']}  {q['attempts']:>2}回  "
+                  f"{q['first_failed']}〜{q['last_failed']}  {q['reason']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""26週・52週安値のローリング状態（実行をまたいで差分更新）
+
+銘柄ごとに直近の終値とその日付を「本数×銘柄」の配列（古い順に右詰め）で cache/lows/state.npz に保存する。
+期間安値は compute.trailing_min で列ごとに一括で求めるので、毎日は前回の最終日以降の足だけを
+取得して積めばよく、銘柄ごとの Python ループも要らない。
+
+次のときはその銘柄だけ history の日足から作り直す。
+- 状態が無い / 最終日から MAX_GAP_DAYS 日以上空いた
+- 前回の最終日の足が返ってこない、または終値が変わった（分割・遡及修正）
+- 株式分割がある
+- 同じバッチの他銘柄にある日付が欠けている
+
+作り直しても最後の足が古い（history.stale）銘柄は状態を捨て、表にも出さない（取れなかった銘柄として扱われる）。
+当日の足は場中だと未確定なので、計算には使うが状態には積まない。
+"""
+
+import logging
+import os
+import zipfile
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pandas as pd
+
+import compute
+import history
+import provider
+
+logger = logging.getLogger(__name__)
+
+JST = timezone(timedelta(hours=9))
+STATE_PATH = os.environ.get("LOWS_STATE_PATH", "cache/lows/state.npz")
+MAX_GAP_DAYS = 7
+CLOSE_TOLERANCE = 1e-4
+MIN_CLOSES = 10
+NAT = np.datetime64("NaT", "D")
+
+
+class LowsState:
+    """安値の状態。tickers[j] の列に直近 rows 本の終値 close[:, j] と日付 day[:, j] を古い順に右詰めで持つ
+    （空きは NaN / NaT）。最後の行がその銘柄の最終日の足。
+
+    update は別スレッドのバッチから呼ばれるが、バッチ同士は銘柄（列）が重ならないので書き込みは衝突しない。
+    """
+
+    __slots__ = ("tickers", "day", "close", "_ids")
+
+    def __init__(self, tickers: list[str], rows: int):
+        self.tickers = list(tickers)
+        self.day = np.full((rows, len(tickers)), NAT)
+        self.close = np.full((rows, len(tickers)), np.nan)
+        self._ids = {t: i for i, t in enumerate(self.tickers)}
+
+    def ids(self, symbols: list[str]) -> np.ndarray:
+        return np.fromiter((self._ids[s] for s in symbols), dtype=np.intp, count=len(symbols))
+
+    def clear(self, cols: np.ndarray):
+        self.day[:, cols] = NAT
+        self.close[:, cols] = np.nan
+
+    def push(self, cols: np.ndarray, days: np.ndarray, close: np.ndarray, valid: np.ndarray):
+        """cols 列の後ろに足を積み、直近 rows 本にする。days は日付 (T,)、close / valid は T × len(cols)。"""
+        rows = self.day.shape[0]
+        day = np.vstack([self.day[:, cols], np.broadcast_to(days[:, None], close.shape)])
+        keep = np.vstack([~np.isnat(self.day[:, cols]), valid])
+        self.day[:, cols] = compute.pack(day, keep, rows, NAT)
+        self.close[:, cols] = compute.pack(np.vstack([self.close[:, cols], close]), keep, rows, np.nan)
+
+
+def load_state(tickers: list[str], rows: int, path: str = STATE_PATH) -> LowsState:
+    """tickers の列にそろえた状態を返す（保存されていない銘柄は空）。"""
+    state = LowsState(tickers, rows)
+    try:
+        with np.load(path) as f:
+            saved = {k: f[k] for k in ("tickers", "day", "close")}
+    except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+        return state
+    pos = {t: i for i, t in enumerate(saved["tickers"].tolist())}
+    src = np.array([pos.get(t, -1) for t in state.tickers], dtype=np.intp)
+    have = np.flatnonzero(src >= 0)
+    k = min(rows, saved["day"].shape[0])
+    state.day[rows - k:, have] = saved["day"][saved["day"].shape[0] - k:][:, src[have]]
+    state.close[rows - k:, have] = saved["close"][saved["day"].shape[0] - k:][:, src[have]]
+    return state
+
+
+def save_state(state: LowsState, path: str = STATE_PATH):
+    """足のある銘柄の列を保存する。"""
+    keep = ~np.isnat(state.day[-1])
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(
+            f,
+            tickers=np.array(state.tickers, dtype=str)[keep],
+            day=state.day[:, keep],
+            close=state.close[:, keep],
+        )
+    os.replace(tmp, path)
+
+
+def _last(days: np.ndarray, close: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """各列の valid な最後の足の日付と終値（無ければ NaT / NaN）。"""
+    day = compute.pack(np.broadcast_to(days[:, None], close.shape), valid, 1, NAT)[0]
+    return day, compute.pack(close, valid, 1, np.nan)[0]
+
+
+def _continues(days: np.ndarray, close: np.ndarray, splits: np.ndarray, last_day: np.ndarray,
+               last_close: np.ndarray) -> np.ndarray:
+    """差分の足が前回の状態にそのまま続くか（列ごとの bool 配列）。close / splits は日付×銘柄の行列。"""
+    has = ~np.isnan(close)
+    anchor, _ = compute.last_valid(np.where(days[:, None] == last_day, close, np.nan))
+    ok = np.abs(anchor - last_close) <= CLOSE_TOLERANCE * last_close  # 最終日の足が無ければ NaN で False
+    after = days[:, None] >= last_day
+    ok &= ~((splits > 0) & after).any(axis=0)
+    # バッチの半数以上の銘柄に足がある日付が、最終日より後で欠けていないか
+    returned = has.any(axis=0)
+    common = has.sum(axis=1) >= returned.sum() / 2
+    ok &= ~(common[:, None] & (days[:, None] > last_day) & ~has).any(axis=0)
+    return ok & returned
+
+
+def update(batch: list[str], state: LowsState, periods: list[tuple[str, int]]) -> pd.DataFrame:
+    """batch の状態を最新の足で更新し、銘柄ごとの表（列は price / n_close / low_<label> / pct_<label>、
+    安値が 0 以下・不明の乖離は 999）を返す。足が1本も無い銘柄は表に出さない。
+
+    state はその場で更新する（別スレッドのバッチとは銘柄が重ならない前提）。
+    n_close は MIN_CLOSES で頭打ちにした本数。
+    """
+    today = np.datetime64(datetime.now(JST).date(), "D")
+    cutoff = np.datetime64((pd.Timestamp(today) - pd.DateOffset(years=1)).date(), "D")
+    cols = state.ids(batch)
+    last_day, last_close = state.day[-1, cols], state.close[-1, cols]
+    rebuild = ~(today - last_day <= np.timedelta64(MAX_GAP_DAYS, "D"))  # 状態が無い（NaT）銘柄も含む
+    transient_day = np.full(len(batch), NAT)
+    transient_close = np.full(len(batch), np.nan)
+    requested = missing = 0
+
+    def apply(idx: np.ndarray, days: np.ndarray, close: np.ndarray, valid: np.ndarray):
+        state.push(cols[idx], days, close, valid & (days[:, None] < today))
+        transient_day[idx], transient_close[idx] = _last(days, close, valid & (days[:, None] >= today))
+
+    warm = np.flatnonzero(~rebuild)
+    if len(warm):
+        symbols = [batch[i] for i in warm]
+        frames = history.split_frames(provider.get().download(symbols, start=str(last_day[warm].min())), symbols)
+        requested += len(symbols)
+        missing += len(symbols) - len(frames)
+        data = history.combine(frames)
+        del frames
+        days = data.index.values.astype("datetime64[D]")
+        close = compute.matrix(data, "Close", symbols)
+        ok = _continues(days, close, compute.matrix(data, "Stock Splits", symbols), last_day[warm], last_close[warm])
+        del data
+        # 何も返ってこなかった銘柄は、最後の足が新しければ次の足がまだ出ていないだけとみなしてそのまま使う
+        absent = np.isnan(close).all(axis=0)
+        rebuild[warm] = ~ok & ~(absent & ~history.stale(last_day[warm], today))
+        # 取得の開始はバッチで最も古い最終日なので、各銘柄の最終日以前の足は積まない
+        apply(warm[ok], days, close[:, ok], ~np.isnan(close[:, ok]) & (days[:, None] > last_day[warm[ok]]))
+
+    todo = np.flatnonzero(rebuild)
+    if len(todo):
+        symbols = [batch[i] for i in todo]
+        data = history.download(symbols)
+        requested += data.attrs.get("requested", 0)
+        missing += data.attrs.get("missing", 0)
+        days = data.index.values.astype("datetime64[D]")
+        close = compute.matrix(data, "Close", symbols)
+        del data
+        valid = ~np.isnan(close)
+        last, _ = _last(days, close, valid)
+        keep = ~np.isnat(last)
+        keep[keep] = ~history.stale(last[keep], today)
+        state.clear(cols[todo])
+        apply(todo[keep], days, close[:, keep], valid[:, keep])
+    logger.info(f"  安値状態: 差分更新 {len(batch) - len(todo)}銘柄, 再構築 {len(todo)}銘柄")
+
+    day = np.vstack([state.day[:, cols], transient_day[None]])
+    close = np.vstack([state.close[:, cols], transient_close[None]])
+    price, n = compute.last_valid(close)
+    recent = np.where(day > cutoff, close, np.nan)
+    table = pd.DataFrame(
+        {"price": price, "n_close": np.minimum(compute.last_valid(recent)[1], MIN_CLOSES)}, index=batch
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for label, days in periods:
+            low = compute.trailing_min(recent, days)
+            table[f"low_{label}"] = low
+            table[f"pct_{label}"] = np.where(low > 0, (price - low) / low * 100, 999.0)
+    table = table[n > 0]
+    table.attrs["requested"] = requested
+    table.attrs["missing"] = missing
+    return table
@@ -0,0 +1,192 @@
+"""スクリーニング条件の定義と一括評価
+
+screens.toml に並べたスクリーン（条件・並び順・出力先）を読み込み、
+各スクリーンが必要とする指標だけを1バッチにつき1回ずつ計算して、全スクリーンをまとめて評価する。
+スクリーンを増やしても増えるのは計算だけで、ダウンロードは増えない。
+
+    [[screen]]
+    name = "yield_near_low"
+    title = "高配当かつ52週安値圏"
+    all = [
+        { metric = "dividend_yield", op = ">=", value = 0.04 },
+        { metric = "pct_from_low", lookback = 245, op = "<=", value = 3.0 },
+    ]
+    sort = { metric = "pct_from_low", lookback = 245 }
+
+all は全て満たす、any はどれか1つを満たす（両方書いたら両方）。
+値が不明な指標の比較は常に偽になる。
+"""
+
+import os
+import tomllib
+
+import numpy as np
+import pandas as pd
+
+import compute
+
+SCREENS_PATH = os.environ.get("SCREENS_PATH", "screens.toml")
+
+# 指標名 -> lookback が必須か（None の指標は lookback を取らない）
+METRICS = {
+    "price": None,  # 最終終値
+    "n_close": None,  # 有効な終値の本数
+    "annual_dividend": None,  # 直近12か月の配当合計
+    "dividend_yield": None,  # annual_dividend / price
+    "low": True,  # 直近 lookback 本の終値の最小値
+    "pct_from_low": True,  # low からの乖離(%)、low が 0 以下・不明なら 999
+    "return_pct": True,  # lookback 本前の終値からの騰落率(%)
+}
+
+OPS = {
+    ">=": np.greater_equal,
+    ">": np.greater,
+    "<=": np.less_equal,
+    "<": np.less,
+    "==": np.equal,
+}
+
+OUTPUTS = ("dividend", "lowcheck", "report")
+
+
+def column(metric: str, lookback: int | None = None) -> str:
+    """指標の列名（lookback 付きの指標は "<metric>_<lookback>"）。"""
+    return metric if lookback is None else f"{metric}_{lookback}"
+
+
+def _metric(spec: dict, where: str) -> tuple[str, int | None]:
+    metric = spec.get("metric")
+    if metric not in METRICS:
+        raise ValueError(f"{where}: 未知の指標 {metric!r}（使えるのは {', '.join(METRICS)}）")
+    lookback = spec.get("lookback")
+    if METRICS[metric] and not lookback:
+        raise ValueError(f"{where}: {metric} には lookback（営業日数）が必要です")
+    if not METRICS[metric] and lookback is not None:
+        raise ValueError(f"{where}: {metric} は lookback を取りません")
+    return metric, lookback
+
+
+def _parse(raw: dict, i: int) -> dict:
+    name = raw.get("name") or f"screen{i}"
+    where = f"screens[{name}]"
+    conditions = {}
+    for key in ("all", "any"):
+        conditions[key] = []
+        for c in raw.get(key, []):
+            if c.get("op") not in OPS:
+                raise ValueError(f"{where}: 未知の比較 {c.get('op')!r}（使えるのは {', '.join(OPS)}）")
+            conditions[key].append((*_metric(c, where), c["op"], float(c["value"])))
+    if not conditions["all"] and not conditions["any"]:
+        raise ValueError(f"{where}: all / any のどちらかに条件が必要です")
+
+    sort = raw.get("sort", {"metric": "price"})
+    if isinstance(sort, str):
+        sort = {"metric": sort}
+    output = raw.get("output", "report")
+    if output not in OUTPUTS:
+        raise ValueError(f"{where}: 未知の出力先 {output!r}（使えるのは {', '.join(OUTPUTS)}）")
+    return {
+        "name": name,
+        "title": raw.get("title", name),
+        "all": conditions["all"],
+        "any": conditions["any"],
+        "sort": _metric(sort, where),
+        "descending": bool(sort.get("descending", False)),
+        "output": output,
+    }
+
+
+def load(path: str = SCREENS_PATH) -> list[dict]:
+    """screens.toml を読み込み、検証済みのスクリーン定義を返す。"""
+    with open(path, "rb") as f:
+        raw = tomllib.load(f)
+    screens = [_parse(s, i) for i, s in enumerate(raw.get("screen", []), start=1)]
+    names = [s["name"] for s in screens]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: スクリーン名が重複しています")
+    for output in ("dividend", "lowcheck"):
+        if sum(s["output"] == output for s in screens) > 1:
+            raise ValueError(f"{path}: output = {output!r} のスクリーンは1つまでです")
+    return screens
+
+
+def required(screens: list[dict]) -> set[tuple[str, int | None]]:
+    """スクリーン群の評価・並べ替えに必要な (指標, lookback) の集合。"""
+    need = {("price", None), ("n_close", None)}
+    for s in screens:
+        need.update((m, lb) for m, lb, _, _ in s["all"] + s["any"])
+        need.add(s["sort"])
+    return need
+
+
+def metrics(data: pd.DataFrame, symbols: list[str], need: set[tuple[str, int | None]]) -> pd.DataFrame:
+    """必要な指標だけを日付×銘柄の行列から一括計算する。index は symbols。"""
+    close = compute.matrix(data, "Close", symbols)
+    price, counts = compute.last_valid(close)
+    cols = {"price": price, "n_close": counts}
+
+    if any(m in ("annual_dividend", "dividend_yield") for m, _ in need):
+        annual = np.nansum(compute.matrix(data, "Dividends", symbols), axis=0)
+        cols["annual_dividend"] = annual
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cols["dividend_yield"] = annual / price
+
+    lows = {}
+    for metric, lookback in need:
+        if metric in ("low", "pct_from_low"):
+            if lookback not in lows:
+                lows[lookback] = compute.trailing_min(close, lookback)
+            low = lows[lookback]
+            if metric == "low":
+                cols[column(metric, lookback)] = low
+            else:
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cols[column(metric, lookback)] = np.where(low > 0, (price - low) / low * 100, 999.0)
+        elif metric == "return_pct":
+            cols[column(metric, lookback)] = _return_pct(close, price, lookback)
+    return pd.DataFrame(cols, index=symbols)
+
+
+def _return_pct(close: np.ndarray, price: np.ndarray, n: int) -> np.ndarray:
+    """各列の最後の有効値と、その n 個前の有効値との騰落率(%)。"""
+    if close.shape[0] == 0:
+        return np.full(close.shape[1], np.nan)
+    valid = ~np.isnan(close)
+    from_end = np.cumsum(valid[::-1], axis=0)[::-1]
+    base = np.fmax.reduce(np.where(valid & (from_end == n + 1), close, np.nan), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(base > 0, (price / base - 1) * 100, np.nan)
+
+
+def evaluate(table: pd.DataFrame, screens: list[dict]) -> dict[str, list[str]]:
+    """全スクリーンを table（metrics の結果）に対して評価し、{スクリーン名: ヒットした銘柄} を返す。"""
+    masks: dict[tuple, np.ndarray] = {}
+
+    def mask(cond):
+        if cond not in masks:
+            metric, lookback, op, value = cond
+            values = table[column(metric, lookback)].to_numpy(dtype=float)
+            with np.errstate(invalid="ignore"):
+                masks[cond] = OPS[op](values, value) & ~np.isnan(values)
+        return masks[cond]
+
+    hits = {}
+    ones = np.ones(len(table), dtype=bool)
+    for s in screens:
+        m = np.logical_and.reduce([mask(c) for c in s["all"]] + [ones])
+        if s["any"]:
+            m &= np.logical_or.reduce([mask(c) for c in s["any"]])
+        hits[s["name"]] = table.index[m].tolist()
+    return hits
+
+
+def sort_key(screen: dict):
+    """スクリーンの並び順のキー（同値はコード順）。行は metrics の列を持つ dict。"""
+    col = column(*screen["sort"])
+    sign = -1 if screen["descending"] else 1
+
+    def key(row: dict):
+        v = row.get(col)
+        v = np.inf if v is None or v != v else sign * v
+        return v, row["ticker"]
+    return key
@@ -0,0 +1,243 @@
+"""スクリーニングの一括実行
+
+screens.toml の全スクリーンを、1バッチ1回のダウンロードでまとめて評価する。
+出力先が dividend / lowcheck のスクリーンは main.py / lowcheck.py と同じレポートと DB 行を、
+report のスクリーンは <name>.html / <name>_subject.txt を書き出す。
+
+手動実行用（定期実行は main.py / lowcheck.py）。任意の指標を評価するため history の1年分の日足を使い、
+dividend_index / rolling_lows の差分ストアは使わない（更新もしない）。
+"""
+
+import argparse
+import logging
+import time
+from collections.abc import Iterator
+from datetime import datetime, timezone, timedelta
+
+import pandas as pd
+
+import fetcher
+import lowcheck
+import metrics
+import main as dividend
+import provider
+import report
+import retry_queue
+import rules
+import store
+from universe import Universe
+from scan_dividends import run_fallback
+
+JST = timezone(timedelta(hours=9))
+logger = logging.getLogger(__name__)
+
+SCAN = "screens"
+NW = 16
+
+
+def _needs(screens: list[dict]) -> set[tuple[str, int | None]]:
+    """評価に加えて、出力先のレポートが表示する指標も含めた必要な指標。"""
+    need = rules.required(screens)
+    for s in screens:
+        if s["output"] == "dividend":
+            need.update({("annual_dividend", None), ("dividend_yield", None)})
+        elif s["output"] == "lowcheck":
+            for _, days in lowcheck.PERIODS:
+                need.update({("low", days), ("pct_from_low", days)})
+    return need
+
+
+def _format(screen: dict, row: dict) -> dict:
+    """出力先のレポート・DB が期待する形式に変える。"""
+    if screen["output"] == "dividend":
+        return {k: row[k] for k in ("ticker", "name", "sector", "dividend_yield", "annual_dividend", "price")}
+    if screen["output"] == "lowcheck":
+        out = {"ticker": row["ticker"], "code": row["ticker"].replace(".T", ""), "name": row["name"],
+               "price": row["price"]}
+        for label, days in lowcheck.PERIODS:
+            out[f"low_{label}"] = row[rules.column("low", days)]
+            out[f"pct_{label}"] = row[rules.column("pct_from_low", days)]
+        return out
+    return row
+
+
+def _hits(table: pd.DataFrame, screens: list[dict], tickers: Universe) -> dict[str, dict[str, dict]]:
+    """{ticker: {スクリーン名: 行}}。行は銘柄情報と table の全指標を持つ（ヒットした銘柄だけ dict にする）。"""
+    out: dict[str, dict[str, dict]] = {}
+    hits = rules.evaluate(table, screens)
+    matched = sorted({sym for syms in hits.values() for sym in syms})
+    rows = table.loc[matched].to_dict("index")
+    for name, syms in hits.items():
+        for sym in syms:
+            i = tickers.id(sym)
+            info = {"name": "", "sector": ""} if i is None else {"name": tickers.names[i], "sector": tickers.sector(i)}
+            out.setdefault(sym, {})[name] = {"ticker": sym, **info, **rows[sym]}
+    return out
+
+
+def _by_screen(per_ticker) -> dict[str, list[dict]]:
+    out: dict[str, list[dict]] = {}
+    for hits in per_ticker:
+        for name, row in (hits or {}).items():
+            out.setdefault(name, []).append(row)
+    return out
+
+
+def scan_stream(tickers: Universe, screens: list[dict]) -> Iterator[dict[str, list[dict]]]:
+    """全銘柄を1パスでスキャンし、バッチが完了するたびにスクリーンごとのヒットを返す。
+
+    各バッチでは screens が必要とする指標だけを1回ずつ計算し、全スクリーンをまとめて評価する。
+    日足が取れなかった銘柄は、配当の指標を使うスクリーンがあれば Phase 2 で Ticker.info から補完する
+    （補完した銘柄は配当・株価以外の指標が不明なので、それらの条件は満たさない）。
+    完了したバッチの結果は alerts.db に記録し、同じ日に再実行すると未完了の銘柄から再開する。
+    取れなかった銘柄は retry_queue に記録し、再試行の日が来るまでスキャンしない。
+
+    Yields:
+        {スクリーン名: 行のリスト}: 行は ticker / name / sector と指標の列（rules.column の名前）を持つ
+    """
+    symbols, retrying = retry_queue.plan(SCAN, tickers.tickers)
+    reasons = {}  # Phase 1 の失敗理由（既定は no_data）
+    need = _needs(screens)
+
+    done, failed = store.load_checkpoint(SCAN, phase=1)
+    failed_set = set(failed)
+    remaining = [sym for sym in symbols if sym not in done and sym not in failed_set]
+    del failed_set
+    if done or failed:
+        logger.info(f"途中結果から再開: {len(symbols) - len(remaining)}銘柄済み")
+        yield _by_screen(done.values())
+    del done
+
+    logger.info(f"Phase 1: {len(remaining)}銘柄をバッチスキャン中（{len(screens)}スクリーン）...")
+    for batch, data in fetcher.iter_batches(remaining):
+        if data is None:
+            failed.extend(batch)
+            reasons.update(dict.fromkeys(batch, "fetch_error"))
+            store.save_checkpoint(SCAN, 1, {}, batch)
+            continue
+        with metrics.span("compute"):
+            table = rules.metrics(data, batch, need)
+        del data
+        has_close = table["n_close"] > 0
+        f = table.index[~has_close].tolist()
+        hits = _hits(table[has_close], screens, tickers)
+        failed.extend(f)
+        store.save_checkpoint(SCAN, 1, {sym: hits.get(sym) for sym in table.index[has_close]}, f)
+        yield _by_screen(hits.values())
+
+    logger.info(f"Phase 1完了: {len(failed)}件失敗")
+
+    recovered, errors = {}, {}
+    if failed and any(m in ("annual_dividend", "dividend_yield") for m, _ in need):
+        recovered = run_fallback(failed, SCAN, errors)
+        if recovered:
+            cols = sorted({rules.column(m, lb) for m, lb in need})
+            table = pd.DataFrame.from_dict(recovered, orient="index").reindex(columns=cols)
+            yield _by_screen(_hits(table, screens, tickers).values())
+
+    retry_queue.update(SCAN, retrying, {
+        sym: f"phase2 {errors[sym]}" if sym in errors else reasons.get(sym, "no_data")
+        for sym in failed if sym not in recovered
+    })
+    store.clear_checkpoint(SCAN)
+
+
+def _fmt(col: str, v) -> str:
+    if v is None or v != v:
+        return "-"
+    if col == "dividend_yield":
+        return f"{v * 100:.2f}%"
+    if col.startswith("return_pct"):
+        return f"{v:+.1f}%"
+    if col.startswith("pct_from_low"):
+        return f"{v:.1f}%"
+    if col == "n_close":
+        return f"{v:.0f}"
+    return f"{v:,.0f}" if abs(v) >= 100 else f"{v:,.1f}"
+
+
+def report_columns(screen: dict) -> list[dict]:
+    """output = "report" のスクリーンの列。条件と並び順に使った指標を price の後に並べる。"""
+    cols = []
+    for m, lb, _, _ in screen["all"] + screen["any"] + [(*screen["sort"], None, None)]:
+        col = rules.column(m, lb)
+        if col not in cols and col != "price":
+            cols.append(col)
+    return [
+        report.col("code", "code", 4, lambda r: r["ticker"].replace(".T", ""), align="<"),
+        report.col("name", "name", NW, lambda r: r["name"], align="<", fit=True),
+        report.col("price", "price", 7, lambda r: r["price"], ",.0f"),
+        *(
+            report.col(c, c, max(len(c), 10), lambda r, c=c: r.get(c), text=lambda r, c=c: _fmt(c, r.get(c)))
+            for c in cols
+        ),
+    ]
+
+
+def write_report(screen: dict, rows: list[dict], scan_info: dict):
+    """<name>.html / <name>_subject.txt を書き出す（ヒットが無ければ空の html）。
+
+    REPORT_FORMATS で <name>_table.html / <name>.csv / <name>.json も同じ走査で書く。
+    """
+    name = screen["name"]
+    if rows:
+        now = datetime.now(JST).strftime("%Y-%m-%d %H:%M")
+        head = [f"  {screen['title']}  {now}", f"  {len(rows)} stocks", ""]
+        foot = ["", f"  scanned: {scan_info['total']}  duration: {scan_info['duration']}", ""]
+        report.write(name, report_columns(screen), rows, head, foot)
+    else:
+        with open(f"{name}.html", "w", encoding="utf-8") as f:
+            f.write("")
+    today = datetime.now(JST).strftime("%Y-%m-%d")
+    with open(f"{name}_subject.txt", "w", encoding="utf-8") as f:
+        f.write(f"[{screen['title']}] {len(rows)}件 ({today})")
+    logger.info(f"{name}.html 出力完了 ({len(rows)}銘柄)")
+
+
+@metrics.recorded("screens")
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="screens.toml の全スクリーンを1パスで評価")
+    parser.add_argument("--screens", default=rules.SCREENS_PATH, metavar="PATH", help="スクリーン定義のファイル")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+
+    screens = rules.load(args.screens)
+    tickers = provider.get().universe()
+    logger.info(f"対象銘柄数: {len(tickers)}, スクリーン: {', '.join(s['name'] for s in screens)}")
+
+    # dividend / lowcheck への出力はバッチが終わるたびに DB に書き、レポート用に全ヒットを手元に溜める
+    by_name = {s["name"]: s for s in screens}
+    results: dict[str, list[dict]] = {s["name"]: [] for s in screens}
+    for hits in scan_stream(tickers, screens):
+        for name, rows in hits.items():
+            results[name].extend(rows)
+            screen = by_name[name]
+            if screen["output"] == "dividend":
+                store.save_dividend([_format(screen, r) for r in rows])
+            elif screen["output"] == "lowcheck":
+                store.save_lowcheck([_format(screen, r) for r in rows])
+    for output in dict.fromkeys(s["output"] for s in screens):
+        if output in store.ROLLUP_PERIODS:
+            store.mark_period(output)
+
+    duration = time.time() - start
+    m, s = int(duration // 60), int(duration % 60)
+    scan_info = {"total": len(tickers), "duration": f"{m}分{s}秒"}
+    logger.info(
+        "スキャン完了: " + ", ".join(f"{name} {len(rows)}銘柄" for name, rows in results.items())
+        + f" ({scan_info['duration']})"
+    )
+
+    for screen in screens:
+        rows = sorted(results[screen["name"]], key=rules.sort_key(screen))
+        if screen["output"] == "dividend":
+            dividend.write_outputs([_format(screen, r) for r in rows], scan_info)
+        elif screen["output"] == "lowcheck":
+            lowcheck.write_outputs([_format(screen, r) for r in rows], scan_info)
+        else:
+            write_report(screen, rows, scan_info)
+
+
+if __name__ == "__main__":
+    main()
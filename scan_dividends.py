@@ -1,128 +1,248 @@
-"""yfinanceで配当利回りをスキャン"""
+"""配当利回りをスキャン"""
 
 import logging
 import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import yfinance as yf
+import numpy as np
+import pandas as pd
+
+import dividend_index
+import fetcher
+import metrics
+import provider
+import retry_queue
+import store
+from universe import Results, Universe
 
 logger = logging.getLogger(__name__)
 
-BATCH_SIZE = 100
-SLEEP_BETWEEN_BATCHES = 2.0
-FALLBACK_SLEEP = 0.5
+FALLBACK_WORKERS = 8
+FALLBACK_RATE = 4.0  # 問い合わせ開始/秒
+FALLBACK_TIMEOUT = 20.0  # 1銘柄あたり（秒）
+FALLBACK_RETRY_BUDGET = 50  # Phase 2 全体での再試行回数
 
+COLUMNS = ["dividend_yield", "annual_dividend", "price"]  # Results の列
 
-def scan_all(tickers: list[dict], threshold: float = 0.05) -> list[dict]:
-    """全銘柄の配当利回りをスキャンし、閾値以上の銘柄を返す。
+
+def select_yields(df: pd.DataFrame, tickers: Universe) -> tuple[Results, list[str]]:
+    """dividend_index.update の表を (results, failed) にする。
+
+    Returns:
+        (results, failed): results は終値が取れた銘柄の Results（利回りが求まらない銘柄は
+        dividend_yield が NaN）、failed はフォールバック対象
+    """
+    has_close = (df["n_close"] > 0).to_numpy()
+    failed = df.index[~has_close].tolist()
+    results = Results.from_frame(tickers, df[has_close], COLUMNS)
+    c = results.columns
+    c["dividend_yield"] = np.where((c["price"] > 0) & (c["annual_dividend"] > 0), c["dividend_yield"], np.nan)
+    return results, failed
+
+
+def _fetch_fallback(sym: str) -> dict | None:
+    info = provider.get().info(sym)
+    y = info.get("trailingAnnualDividendYield")
+    if not y or y <= 0:
+        y = info.get("dividendYield")
+    if not y or y <= 0:
+        rate = info.get("trailingAnnualDividendRate")
+        price = info.get("regularMarketPrice") or info.get("currentPrice")
+        if rate and price and price > 0:
+            y = rate / price
+    if y and y > 0:
+        price = info.get("regularMarketPrice") or info.get("currentPrice", 0)
+        return {
+            "dividend_yield": float(y),
+            "annual_dividend": float(info.get("trailingAnnualDividendRate", 0)),
+            "price": float(price) if price else 0,
+        }
+    return None
+
+
+@metrics.timed("fallback")
+def fallback(failed: list[str], on_result=None, errors: dict | None = None) -> dict:
+    """Phase 2: バッチで取れなかった銘柄を Ticker.info から個別に補完する。
+
+    FALLBACK_WORKERS 本まで並列に問い合わせ、開始レートは FALLBACK_RATE 回/秒に制限する。
+    例外・タイムアウトした銘柄は全体で FALLBACK_RETRY_BUDGET 回まで再試行する。
+    結果は完了順によらず failed の順に並ぶ。
+    on_result(sym, result) は問い合わせが完了した銘柄ごとに呼ばれる（result は None のこともある）。
+    errors を渡すと、再試行しても問い合わせが完了しなかった銘柄の理由（timeout / 例外名）を入れる。
+    """
+    logger.info(f"Phase 2: {len(failed)}銘柄をフォールバックスキャン中...")
+    start = time.time()
+    limiter = fetcher.RateLimiter(FALLBACK_RATE)
+    pending = deque(failed)
+    retries_left = FALLBACK_RETRY_BUDGET
+    timeouts = 0
+    recovered = {}
+    last_error = {}
+    running = {}  # future -> (sym, 開始時刻)
+
+    # タイムアウトで見捨てたスレッドが枠を塞がないよう、プールは並列上限より大きめに取る
+    pool = ThreadPoolExecutor(max_workers=FALLBACK_WORKERS * 4)
+    try:
+        while pending or running:
+            while pending and len(running) < FALLBACK_WORKERS:
+                sym = pending.popleft()
+                limiter.wait()
+                running[pool.submit(_fetch_fallback, sym)] = (sym, time.monotonic())
+
+            done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for fut, (sym, started) in list(running.items()):
+                if fut in done:
+                    del running[fut]
+                    try:
+                        recovered[sym] = fut.result()
+                        if on_result:
+                            on_result(sym, recovered[sym])
+                        continue
+                    except Exception as e:
+                        logger.debug(f"  {sym}: {e}")
+                        last_error[sym] = type(e).__name__
+                elif now - started > FALLBACK_TIMEOUT:
+                    del running[fut]
+                    timeouts += 1
+                    last_error[sym] = "timeout"
+                else:
+                    continue
+                if retries_left > 0:
+                    retries_left -= 1
+                    pending.append(sym)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    results = {sym: recovered[sym] for sym in failed if recovered.get(sym)}
+    if errors is not None:
+        errors.update({sym: last_error[sym] for sym in failed if sym not in recovered})
+    metrics.count("fallback.rows", len(failed))
+    metrics.count("fallback.recovered", len(results))
+    metrics.count("fallback.retries", FALLBACK_RETRY_BUDGET - retries_left)
+    metrics.count("fallback.timeouts", timeouts)
+    logger.info(
+        f"Phase 2完了: {len(failed)}銘柄中 {len(results)}銘柄を補完 "
+        f"({time.time() - start:.1f}秒, リトライ {FALLBACK_RETRY_BUDGET - retries_left}回, "
+        f"タイムアウト {timeouts}件)"
+    )
+    return results
+
+
+def by_yield(row: dict):
+    """利回り降順（同率はコード順）の並び替えキー。シャード統合後も同じ順になるようにする。"""
+    return -row["dividend_yield"], row["ticker"]
+
+
+def qualify(results: Results, threshold: float) -> Results:
+    """閾値以上の銘柄を利回り降順に並べる。"""
+    return results.select(results.columns["dividend_yield"] >= threshold).sorted(by_yield)
+
+
+def checkpoint_rows(results: Results, hits: Results) -> dict:
+    """バッチの結果を store.save_checkpoint 用に {ticker: 結果 or None} にする。
+
+    再開時に使うのは閾値以上の銘柄だけなので、それ以外は完了の印（None）だけを残す。
+    """
+    rows = dict.fromkeys(results.universe.tickers[i] for i in results.ids)
+    rows.update({r["ticker"]: {c: r[c] for c in COLUMNS} for r in hits})
+    return rows
+
+
+def run_fallback(failed: list[str], scan: str = "dividend", errors: dict | None = None) -> dict:
+    """Phase 2 を途中結果の記録付きで実行し、補完できた銘柄の結果を返す（errors は fallback と同じ）。"""
+    done, _ = store.load_checkpoint(scan, phase=2)
+    results = {sym: r for sym, r in done.items() if r}
+    todo = [sym for sym in failed if sym not in done]
+    if done:
+        logger.info(f"Phase 2: 途中結果から再開 ({len(done)}銘柄済み)")
+    if todo:
+        results.update(fallback(todo, on_result=lambda sym, r: store.save_checkpoint(scan, 2, {sym: r}),
+                                errors=errors))
+    return results
+
+
+def scan_stream(tickers: Universe, threshold: float = 0.05, scan: str = "dividend",
+                index_path: str = dividend_index.INDEX_PATH) -> Iterator[Results]:
+    """全銘柄の配当利回りをスキャンし、閾値以上の銘柄をバッチが完了するたびに返す。
+
+    配当は dividend_index の索引から求め、権利落ちが近い銘柄・確認が古い銘柄だけ日足を取り直す。
+    各バッチの取得結果は計算が済んだ時点で手放し、閾値以上の銘柄だけを列ごとの配列（Results）で返す。
+    メモリに持ち続けるのは失敗銘柄のリストだけなので、銘柄数・履歴長が増えてもピークは変わらない。
+    同じ日に再実行すると、記録済みの閾値以上の銘柄を最初に返してから未完了の銘柄を取りに行く。
+    Phase 2 でも取れなかった銘柄は retry_queue に記録し、再試行の日が来るまでスキャンしない。
 
     Args:
-        tickers: fetch_tickers.pyの出力 [{"ticker": "7203.T", "name": ..., "sector": ...}]
+        tickers: 銘柄リスト（provider.get().universe() か shard.select() の結果）
         threshold: 配当利回り閾値（デフォルト5.0%）
+        scan: 途中結果の記録名（シャード実行ではシャードごとに分ける）
+        index_path: 配当索引の保存先（同上）
 
-    Returns:
-        list[dict]: 閾値以上の銘柄リスト（利回り降順）
+    Yields:
+        Results: 1バッチ分の閾値以上の銘柄（バッチ内で利回り降順、空のバッチは返さない）
     """
-    ticker_map = {t["ticker"]: t for t in tickers}
-    symbols = [t["ticker"] for t in tickers]
+    symbols, retrying = retry_queue.plan("dividend", tickers.tickers)
+    reasons = {}  # Phase 1 の失敗理由（既定は no_data）
 
     # Phase 1: バッチダウンロード
-    logger.info(f"Phase 1: {len(symbols)}銘柄をバッチスキャン中...")
-    results = {}
-    failed = []
-
-    for i in range(0, len(symbols), BATCH_SIZE):
-        batch = symbols[i : i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(symbols) + BATCH_SIZE - 1) // BATCH_SIZE
-        logger.info(f"  バッチ {batch_num}/{total_batches} ({len(batch)}銘柄)")
-
-        try:
-            data = yf.download(
-                batch,
-                period="1y",
-                auto_adjust=False,
-                actions=True,
-                group_by="ticker",
-                threads=True,
-                progress=False,
-            )
-
-            for sym in batch:
-                try:
-                    if len(batch) == 1:
-                        divs = data["Dividends"].dropna()
-                        close = data["Close"].dropna()
-                    else:
-                        divs = data[(sym, "Dividends")].dropna()
-                        close = data[(sym, "Close")].dropna()
-
-                    if len(close) == 0:
-                        failed.append(sym)
-                        continue
-
-                    annual_div = divs.sum()
-                    current_price = close.iloc[-1]
-
-                    if current_price > 0 and annual_div > 0:
-                        results[sym] = {
-                            "dividend_yield": float(annual_div / current_price),
-                            "annual_dividend": float(annual_div),
-                            "price": float(current_price),
-                        }
-                    else:
-                        results[sym] = None
-                except (KeyError, IndexError):
-                    failed.append(sym)
-
-        except Exception as e:
-            logger.warning(f"  バッチダウンロード失敗: {e}")
+    done, failed = store.load_checkpoint(scan, phase=1)
+    failed_set = set(failed)
+    remaining = [sym for sym in symbols if sym not in done and sym not in failed_set]
+    del failed_set
+    n_ok = len(done)
+    if done or failed:
+        logger.info(f"途中結果から再開: {len(symbols) - len(remaining)}銘柄済み")
+        rows = qualify(Results.from_records(tickers, done, COLUMNS), threshold)
+        del done
+        if rows:
+            yield rows
+    logger.info(f"Phase 1: {len(remaining)}銘柄をバッチスキャン中...")
+
+    index = dividend_index.load_index(tickers.tickers, index_path)
+    for batch, table in fetcher.iter_batches(remaining, fetch=lambda b: dividend_index.update(b, index)):
+        if table is None:
             failed.extend(batch)
+            reasons.update(dict.fromkeys(batch, "fetch_error"))
+            store.save_checkpoint(scan, 1, {}, batch)
+            continue
+        with metrics.span("compute"):
+            r, f = select_yields(table, tickers)
+        del table
+        n_ok += len(r)
+        failed.extend(f)
+        rows = qualify(r, threshold)
+        store.save_checkpoint(scan, 1, checkpoint_rows(r, rows), f)
+        if rows:
+            yield rows
+
+    dividend_index.save_index(index, index_path)
+    del index
+    logger.info(f"Phase 1完了: {n_ok}件成功, {len(failed)}件失敗")
 
-        if i + BATCH_SIZE < len(symbols):
-            time.sleep(SLEEP_BETWEEN_BATCHES)
+    # Phase 2: 失敗銘柄のフォールバック
+    errors = {}
+    recovered = run_fallback(failed, scan, errors) if failed else {}
+    rows = qualify(Results.from_records(tickers, recovered, COLUMNS), threshold)
+    if rows:
+        yield rows
 
-    logger.info(f"Phase 1完了: {len(results)}件成功, {len(failed)}件失敗")
+    retry_queue.update("dividend", retrying, {
+        sym: f"phase2 {errors[sym]}" if sym in errors else reasons.get(sym, "no_data")
+        for sym in failed if sym not in recovered
+    })
+    store.clear_checkpoint(scan)
 
-    # Phase 2: 失敗銘柄のフォールバック
-    if failed:
-        logger.info(f"Phase 2: {len(failed)}銘柄をフォールバックスキャン中...")
-        for sym in failed:
-            try:
-                t = yf.Ticker(sym)
-                info = t.info
-                y = info.get("trailingAnnualDividendYield")
-                if not y or y <= 0:
-                    y = info.get("dividendYield")
-                if not y or y <= 0:
-                    rate = info.get("trailingAnnualDividendRate")
-                    price = info.get("regularMarketPrice") or info.get("currentPrice")
-                    if rate and price and price > 0:
-                        y = rate / price
-                if y and y > 0:
-                    price = info.get("regularMarketPrice") or info.get("currentPrice", 0)
-                    results[sym] = {
-                        "dividend_yield": float(y),
-                        "annual_dividend": float(info.get("trailingAnnualDividendRate", 0)),
-                        "price": float(price) if price else 0,
-                    }
-                time.sleep(FALLBACK_SLEEP)
-            except Exception:
-                pass
-
-    # フィルタリング
-    qualified = []
-    for sym, data in results.items():
-        if data and data["dividend_yield"] >= threshold:
-            info = ticker_map.get(sym, {})
-            qualified.append({
-                "ticker": sym,
-                "name": info.get("name", ""),
-                "sector": info.get("sector", ""),
-                "dividend_yield": data["dividend_yield"],
-                "annual_dividend": data["annual_dividend"],
-                "price": data["price"],
-            })
-
-    qualified.sort(key=lambda x: x["dividend_yield"], reverse=True)
+
+def scan_all(tickers: Universe, threshold: float = 0.05) -> Results:
+    """全銘柄の配当利回りをスキャンし、閾値以上の銘柄を返す。
+
+    scan_stream の結果をまとめて利回り降順に並べたもの。
+
+    Returns:
+        Results: 閾値以上の銘柄（利回り降順）
+    """
+    qualified = Results.concat(tickers, list(scan_stream(tickers, threshold)), COLUMNS).sorted(by_yield)
     logger.info(f"閾値{threshold*100:.1f}%以上: {len(qualified)}銘柄")
     return qualified
@@ -0,0 +1,113 @@
+"""銘柄リストの分割スキャンと途中結果の統合
+
+main.py / lowcheck.py の --shard i/N で銘柄を N 分割した i 番目（1 始まり）だけをスキャンし、
+結果を SHARD_DIR に JSON で書き出す。--merge N で N 個の途中結果をまとめ、
+1プロセスで実行した場合と同じレポートと DB 行を作る。--workers N は同じマシンで
+N プロセスに分けて実行し、統合まで行う。
+
+分割は銘柄コードのハッシュで決めるので、銘柄リストの並びや増減によらず同じ銘柄は同じシャードに入る。
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SHARD_DIR = os.environ.get("SHARD_DIR", "shards")
+
+
+def parse(spec: str) -> tuple[int, int]:
+    """"i/N" を (i, N) にする（argparse の type に使う）。"""
+    try:
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"i/N 形式で指定してください: {spec}")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"1 <= i <= N の範囲で指定してください: {spec}")
+    return i, n
+
+
+def name(base: str, i: int, n: int) -> str:
+    """シャードごとの途中結果・チェックポイントの名前。"""
+    return f"{base}-{i}of{n}"
+
+
+def path(p: str, i: int, n: int) -> str:
+    """キャッシュファイルのシャードごとの保存先（拡張子の前に -iofN を付ける）。"""
+    base, ext = os.path.splitext(p)
+    return name(base, i, n) + ext
+
+
+def select(tickers, i: int, n: int):
+    """tickers（universe.Universe）のうち i 番目のシャードに入る銘柄を返す。"""
+    return tickers.take([k for k, t in enumerate(tickers.tickers) if zlib.crc32(t.encode()) % n == i - 1])
+
+
+def _path(kind: str, i: int, n: int) -> str:
+    return os.path.join(SHARD_DIR, name(kind, i, n) + ".json")
+
+
+def write_partial(kind: str, i: int, n: int, rows: list[dict], total: int, duration: float):
+    """シャード i の結果を書き出す。
+
+    Args:
+        kind: "dividend" / "lowcheck"
+        rows: このシャードでヒットした銘柄（並び順は問わない）
+        total: このシャードでスキャンした銘柄数
+        duration: このシャードの所要時間（秒）
+    """
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    path = _path(kind, i, n)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"shard": i, "shards": n, "total": total, "duration": duration, "rows": rows},
+                  f, ensure_ascii=False)
+    os.replace(tmp, path)
+    logger.info(f"シャード {i}/{n}: {len(rows)}件を {path} に出力")
+
+
+def read_partials(kind: str, n: int) -> tuple[list[dict], dict]:
+    """N 個の途中結果をまとめて返す。欠けているシャードがあれば RuntimeError。
+
+    Returns:
+        (rows, info): info は total（全シャードの銘柄数合計）と duration（最も遅いシャードの秒数）
+    """
+    missing = [i for i in range(1, n + 1) if not os.path.exists(_path(kind, i, n))]
+    if missing:
+        raise RuntimeError(f"{kind}: 途中結果が無いシャード {missing} / {n}")
+
+    rows, total, duration = [], 0, 0.0
+    for i in range(1, n + 1):
+        with open(_path(kind, i, n), encoding="utf-8") as f:
+            part = json.load(f)
+        rows.extend(part["rows"])
+        total += part["total"]
+        duration = max(duration, part["duration"])
+    return rows, {"total": total, "duration": duration}
+
+
+def clear_partials(kind: str, n: int):
+    for i in range(1, n + 1):
+        try:
+            os.remove(_path(kind, i, n))
+        except FileNotFoundError:
+            pass
+
+
+def run_local(script: str, n: int):
+    """script --shard i/N を N プロセス並列に実行し、全て終わるまで待つ。"""
+    start = time.time()
+    procs = [
+        subprocess.Popen([sys.executable, script, "--shard", f"{i}/{n}"])
+        for i in range(1, n + 1)
+    ]
+    failed = [i for i, p in enumerate(procs, start=1) if p.wait() != 0]
+    if failed:
+        raise RuntimeError(f"シャード {failed} / {n} が失敗しました")
+    logger.info(f"{n}シャード完了 ({time.time() - start:.1f}秒)")
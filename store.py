@@ -1,21 +1,25 @@
-"""配信データを SQLite に蓄積する共通モジュール"""
+"""配信データを SQLite に蓄積する共通モジュール
 
+プロセスごとに1本の接続を使い回す Store を持つ。スキーマは PRAGMA user_version で
+バージョン管理し、起動時に未適用のマイグレーションだけを流す。
+書き込みは明示トランザクションで、同じ日・同じセッションの再実行は行を上書きする（upsert）。
+"""
+
+import atexit
+import json
+import os
 import sqlite3
-from datetime import datetime, timezone, timedelta
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timezone, timedelta
+
+import metrics
 
 JST = timezone(timedelta(hours=9))
 DB_PATH = "alerts.db"
 
 
-def _conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL")
-    return conn
-
-
-def save_portfolio(stocks: list[dict], session: str):
-    ts = datetime.now(JST).isoformat()
-    conn = _conn()
+def _v1(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS portfolio (
             id         INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -28,17 +32,6 @@ def save_portfolio(stocks: list[dict], session: str):
             change_pct REAL NOT NULL
         )
     """)
-    conn.executemany(
-        "INSERT INTO portfolio (ts, session, code, shares, price, value, change_pct) VALUES (?,?,?,?,?,?,?)",
-        [(ts, session, s["code"], s["shares"], s["price"], s["value"], s["change_pct"]) for s in stocks],
-    )
-    conn.commit()
-    conn.close()
-
-
-def save_lowcheck(stocks: list[dict]):
-    ts = datetime.now(JST).isoformat()
-    conn = _conn()
     conn.execute("""
         CREATE TABLE IF NOT EXISTS lowcheck (
             id      INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -52,22 +45,6 @@ def save_lowcheck(stocks: list[dict]):
             pct_52w REAL NOT NULL
         )
     """)
-    conn.executemany(
-        "INSERT INTO lowcheck (ts, code, name, price, low_26w, pct_26w, low_52w, pct_52w) VALUES (?,?,?,?,?,?,?,?)",
-        [
-            (ts, s["code"], s["name"], s["price"],
-             s["lows"]["26w"]["low"], s["lows"]["26w"]["pct"],
-             s["lows"]["52w"]["low"], s["lows"]["52w"]["pct"])
-            for s in stocks
-        ],
-    )
-    conn.commit()
-    conn.close()
-
-
-def save_dividend(stocks: list[dict]):
-    ts = datetime.now(JST).isoformat()
-    conn = _conn()
     conn.execute("""
         CREATE TABLE IF NOT EXISTS dividend (
             id              INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -80,13 +57,624 @@ def save_dividend(stocks: list[dict]):
             annual_dividend REAL NOT NULL
         )
     """)
-    conn.executemany(
-        "INSERT INTO dividend (ts, code, name, sector, price, dividend_yield, annual_dividend) VALUES (?,?,?,?,?,?,?)",
-        [
-            (ts, s["ticker"].replace(".T", ""), s["name"], s.get("sector", ""),
-             s["price"], s["dividend_yield"], s["annual_dividend"])
-            for s in stocks
-        ],
-    )
-    conn.commit()
-    conn.close()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS scan_checkpoint (
+            scan    TEXT NOT NULL,
+            day     TEXT NOT NULL,
+            phase   INTEGER NOT NULL,
+            ticker  TEXT NOT NULL,
+            status  TEXT NOT NULL,
+            payload TEXT,
+            PRIMARY KEY (scan, day, phase, ticker)
+        )
+    """)
+
+
+def _v2(conn):
+    # 取引日列を足して (日, [セッション,] コード) で一意にする。既存の重複は最新の行だけ残す
+    keys = {"portfolio": "day, session, code", "lowcheck": "day, code", "dividend": "day, code"}
+    for table, key in keys.items():
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN day TEXT NOT NULL DEFAULT ''")
+        conn.execute(f"UPDATE {table} SET day = substr(ts, 1, 10)")
+        conn.execute(f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})")
+        conn.execute(f"CREATE UNIQUE INDEX idx_{table}_key ON {table} ({key})")
+        conn.execute(f"CREATE INDEX idx_{table}_code_ts ON {table} (code, ts)")
+        conn.execute(f"CREATE INDEX idx_{table}_ts ON {table} (ts)")
+
+
+def _v3(conn):
+    # backtest.py のリプレイ結果。run は実行開始時刻、param はその判定に使った閾値
+    conn.execute("""
+        CREATE TABLE backtest (
+            run    TEXT NOT NULL,
+            day    TEXT NOT NULL,
+            screen TEXT NOT NULL,
+            param  REAL NOT NULL,
+            code   TEXT NOT NULL,
+            price  REAL NOT NULL,
+            value  REAL NOT NULL,
+            PRIMARY KEY (run, screen, param, day, code)
+        )
+    """)
+
+
+def _v4(conn):
+    # portfolio.py が使った前日終値。同じ日の2回目以降はこれを使い、前日終値を取り直さない
+    conn.execute("ALTER TABLE portfolio ADD COLUMN prev_close REAL")
+
+
+def _v5(conn):
+    # metrics.py の計測値。kind = "time" は1回ごとの秒数、"count" は実行全体の合計
+    conn.execute("""
+        CREATE TABLE run_metrics (
+            run   TEXT NOT NULL,
+            job   TEXT NOT NULL,
+            name  TEXT NOT NULL,
+            kind  TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_run_metrics_job_run ON run_metrics (job, run)")
+
+
+def _v6(conn):
+    # 集計表。保存のたびに同じトランザクションで更新する（_roll_up / _roll_portfolio）
+    # screen_periods: スクリーンが実行された期間、code_rollup: 銘柄ごとの初出・最終・連続期間数
+    conn.execute("""
+        CREATE TABLE screen_periods (
+            screen TEXT NOT NULL,
+            period TEXT NOT NULL,
+            PRIMARY KEY (screen, period)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE code_rollup (
+            screen       TEXT NOT NULL,
+            code         TEXT NOT NULL,
+            first_day    TEXT NOT NULL,
+            last_day     TEXT NOT NULL,
+            last_period  TEXT NOT NULL,
+            streak_start TEXT NOT NULL,
+            streak       INTEGER NOT NULL,
+            periods      INTEGER NOT NULL,
+            PRIMARY KEY (screen, code)
+        )
+    """)
+    conn.execute("CREATE INDEX idx_code_rollup_last ON code_rollup (screen, last_period)")
+    conn.execute("""
+        CREATE TABLE portfolio_totals (
+            day     TEXT NOT NULL,
+            session TEXT NOT NULL,
+            ts      TEXT NOT NULL,
+            total   REAL NOT NULL,
+            n_codes INTEGER NOT NULL,
+            PRIMARY KEY (day, session)
+        )
+    """)
+    # 既存の行から作る（アーカイブ済みの月も含めるには analytics.py rebuild）
+    for screen in ROLLUP_PERIODS:
+        days: dict[str, list[str]] = {}
+        for day, code in conn.execute(f"SELECT day, code FROM {screen} ORDER BY day"):
+            days.setdefault(day, []).append(code)
+        for day, codes in days.items():
+            _roll_up(conn, screen, day, codes)
+    for day, session in conn.execute("SELECT DISTINCT day, session FROM portfolio").fetchall():
+        _roll_portfolio(conn, day, session)
+
+
+def _v7(conn):
+    # 取れなかった銘柄の再試行待ち（retry_queue.py）。next_retry の日まではそのスキャンで取りに行かない
+    conn.execute("""
+        CREATE TABLE retry_queue (
+            scan         TEXT NOT NULL,
+            ticker       TEXT NOT NULL,
+            reason       TEXT NOT NULL,
+            attempts     INTEGER NOT NULL,
+            first_failed TEXT NOT NULL,
+            last_failed  TEXT NOT NULL,
+            next_retry   TEXT NOT NULL,
+            quarantined  INTEGER NOT NULL,
+            PRIMARY KEY (scan, ticker)
+        )
+    """)
+
+
+def _v8(conn):
+    # 複数口座の保有（portfolio.py の holdings.csv）。同じ銘柄を口座ごとに持てるよう一意キーに口座を足し、
+    # 取得額（取得単価 × 株数、不明なら NULL）を記録する。既存の行は口座 ''
+    conn.execute("ALTER TABLE portfolio ADD COLUMN account TEXT NOT NULL DEFAULT ''")
+    conn.execute("ALTER TABLE portfolio ADD COLUMN cost REAL")
+    conn.execute("DROP INDEX idx_portfolio_key")
+    conn.execute("CREATE UNIQUE INDEX idx_portfolio_key ON portfolio (day, session, account, code)")
+
+
+def _v9(conn):
+    # 実行ごとの差分（delta.py）。change_log はこの DB で書き換えた (テーブル, 置き換えの単位) で、
+    # DELTA_CAPTURE=1 の接続だけが記録する。delta_applied は適用済み（または書き出し元）の差分
+    conn.execute("""
+        CREATE TABLE change_log (
+            tbl TEXT NOT NULL,
+            grp TEXT NOT NULL,
+            PRIMARY KEY (tbl, grp)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE delta_applied (
+            id      TEXT PRIMARY KEY,
+            created TEXT NOT NULL,
+            source  TEXT NOT NULL,
+            applied TEXT NOT NULL
+        )
+    """)
+
+
+MIGRATIONS = [_v1, _v2, _v3, _v4, _v5, _v6, _v7, _v8, _v9]
+
+# 差分で運ぶテーブルと置き換えの単位。差分はこの列の値ごとに、その時点の行をまとめて運ぶ
+# （行の無い単位は削除を表す）。portfolio は保有ごと置き換えるので (日, セッション)
+DELTA_GROUPS = {
+    "portfolio": ("day", "session"),
+    "lowcheck": ("day", "code"),
+    "dividend": ("day", "code"),
+    "backtest": ("run",),
+    "run_metrics": ("run", "job"),
+    "scan_checkpoint": ("scan",),
+    "retry_queue": ("scan", "ticker"),
+    "screen_periods": ("screen", "period"),
+    "code_rollup": ("screen", "code"),
+    "portfolio_totals": ("day", "session"),
+}
+DELTA_CAPTURE = os.environ.get("DELTA_CAPTURE") == "1"
+
+# 連続の数え方: dividend は週（月曜の日付）、lowcheck は日ごと
+ROLLUP_PERIODS = {"dividend": "week", "lowcheck": "day"}
+
+
+def period(screen: str, day: str) -> str:
+    """day が属する screen の集計期間（YYYY-MM-DD）。"""
+    if ROLLUP_PERIODS[screen] == "week":
+        d = date.fromisoformat(day)
+        return (d - timedelta(days=d.weekday())).isoformat()
+    return day
+
+
+def _roll_up(conn, screen: str, day: str, codes: list[str]):
+    """day に screen に載った codes で code_rollup を進める。
+
+    直前の実行期間にも載っていれば連続を伸ばし、そうでなければ1から数え直す。
+    同じ期間の2回目以降（バッチごとの保存・再実行）は数えない。古い期間の行は無視する。
+    """
+    p = period(screen, day)
+    conn.execute("INSERT OR IGNORE INTO screen_periods VALUES (?, ?)", (screen, p))
+    prev = conn.execute(
+        "SELECT MAX(period) FROM screen_periods WHERE screen = ? AND period < ?", (screen, p)
+    ).fetchone()[0]
+    conn.executemany("""
+        INSERT INTO code_rollup (screen, code, first_day, last_day, last_period, streak_start, streak, periods)
+        VALUES (?1, ?2, ?3, ?3, ?4, ?4, 1, 1)
+        ON CONFLICT (screen, code) DO UPDATE SET
+            last_day = excluded.last_day,
+            streak = CASE WHEN last_period = excluded.last_period THEN streak
+                          WHEN last_period = ?5 THEN streak + 1 ELSE 1 END,
+            streak_start = CASE WHEN last_period IN (excluded.last_period, ?5) THEN streak_start
+                                ELSE excluded.last_period END,
+            periods = periods + (last_period <> excluded.last_period),
+            last_period = excluded.last_period
+        WHERE excluded.last_period >= last_period
+    """, [(screen, code, day, p, prev) for code in codes])
+
+
+def _roll_portfolio(conn, day: str, session: str):
+    conn.execute("""
+        INSERT INTO portfolio_totals (day, session, ts, total, n_codes)
+        SELECT day, session, MAX(ts), SUM(value), COUNT(*) FROM portfolio
+        WHERE day = ? AND session = ? GROUP BY day, session
+        ON CONFLICT (day, session) DO UPDATE SET
+            ts = excluded.ts, total = excluded.total, n_codes = excluded.n_codes
+    """, (day, session))
+
+
+class Store:
+    """alerts.db への接続1本と、その上の読み書き。"""
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        # シャード実行では複数プロセスが同じ DB に書くので、ロック待ちを長めに取る
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._migrate()
+        if DELTA_CAPTURE:
+            self._capture()
+
+    def _migrate(self):
+        # 複数プロセスが同時に開いても一度だけ流れるよう、書き込みロックを取ってから版を読む
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for i, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {i}")
+
+    def _capture(self):
+        """この接続の書き込みが触れた (テーブル, 置き換えの単位) を change_log に記録する一時トリガー。"""
+        for table, key in DELTA_GROUPS.items():
+            for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                grp = ", ".join(f"{ref}.{k}" for k in key)
+                self.conn.execute(f"""
+                    CREATE TEMP TRIGGER IF NOT EXISTS capture_{table}_{event.lower()} AFTER {event} ON main.{table}
+                    BEGIN INSERT OR IGNORE INTO change_log VALUES ('{table}', json_array({grp})); END
+                """)
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def select(self, sql: str, params: tuple = ()) -> list[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def vacuum(self):
+        """空いたページを返して DB ファイルを縮める（トランザクションの外で呼ぶ）。"""
+        with self.lock:
+            self.conn.execute("VACUUM")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            # Artifact には alerts.db 本体だけを上げるので WAL を本体に書き戻してから閉じる
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.close()
+
+    @metrics.timed("store.save_portfolio")
+    def save_portfolio(self, stocks: list[dict], session: str):
+        metrics.count("store.rows", len(stocks))
+        now = datetime.now(JST)
+        ts, day = now.isoformat(), now.date().isoformat()
+        with self.transaction() as conn:
+            # 同じ日・同じセッションの行は今回の保有で置き換える（売った保有の行を合計に残さない）
+            conn.execute("DELETE FROM portfolio WHERE day = ? AND session = ?", (day, session))
+            conn.executemany("""
+                INSERT INTO portfolio (ts, day, session, account, code, shares, price, value, change_pct,
+                                       prev_close, cost)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?)
+            """, [
+                (ts, day, session, s.get("account", ""), s["code"], s["shares"], s["price"], s["value"],
+                 s["change_pct"], s.get("prev_close"), s.get("cost"))
+                for s in stocks
+            ])
+            _roll_portfolio(conn, day, session)
+
+    def load_prev_closes(self) -> dict[str, float]:
+        day = datetime.now(JST).date().isoformat()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT code, prev_close FROM portfolio WHERE day = ? AND prev_close > 0 ORDER BY ts",
+                (day,),
+            ).fetchall()
+        return dict(rows)
+
+    @metrics.timed("store.save_lowcheck")
+    def save_lowcheck(self, stocks: list[dict]):
+        metrics.count("store.rows", len(stocks))
+        now = datetime.now(JST)
+        ts, day = now.isoformat(), now.date().isoformat()
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO lowcheck (ts, day, code, name, price, low_26w, pct_26w, low_52w, pct_52w)
+                VALUES (?,?,?,?,?,?,?,?,?)
+                ON CONFLICT (day, code) DO UPDATE SET
+                    ts = excluded.ts, name = excluded.name, price = excluded.price,
+                    low_26w = excluded.low_26w, pct_26w = excluded.pct_26w,
+                    low_52w = excluded.low_52w, pct_52w = excluded.pct_52w
+            """, [
+                (ts, day, s["code"], s["name"], s["price"], s["low_26w"], s["pct_26w"], s["low_52w"], s["pct_52w"])
+                for s in stocks
+            ])
+            _roll_up(conn, "lowcheck", day, [s["code"] for s in stocks])
+
+    @metrics.timed("store.save_dividend")
+    def save_dividend(self, stocks: list[dict]):
+        metrics.count("store.rows", len(stocks))
+        now = datetime.now(JST)
+        ts, day = now.isoformat(), now.date().isoformat()
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT INTO dividend (ts, day, code, name, sector, price, dividend_yield, annual_dividend)
+                VALUES (?,?,?,?,?,?,?,?)
+                ON CONFLICT (day, code) DO UPDATE SET
+                    ts = excluded.ts, name = excluded.name, sector = excluded.sector, price = excluded.price,
+                    dividend_yield = excluded.dividend_yield, annual_dividend = excluded.annual_dividend
+            """, [
+                (ts, day, s["ticker"].replace(".T", ""), s["name"], s.get("sector", ""),
+                 s["price"], s["dividend_yield"], s["annual_dividend"])
+                for s in stocks
+            ])
+            _roll_up(conn, "dividend", day, [s["ticker"].replace(".T", "") for s in stocks])
+
+    def mark_period(self, screen: str, day: str | None = None):
+        day = day or datetime.now(JST).date().isoformat()
+        with self.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO screen_periods VALUES (?, ?)", (screen, period(screen, day)))
+
+    @metrics.timed("store.save_backtest")
+    def save_backtest(self, run: str, rows: list[tuple]):
+        metrics.count("store.rows", len(rows))
+        with self.transaction() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO backtest (day, screen, param, code, price, value, run)
+                VALUES (?,?,?,?,?,?,?)
+            """, [(*r, run) for r in rows])
+
+    def load_checkpoint(self, scan: str, phase: int = 1) -> tuple[dict, list[str]]:
+        day = datetime.now(JST).date().isoformat()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM scan_checkpoint WHERE scan = ? AND day <> ?", (scan, day))
+            rows = conn.execute(
+                "SELECT ticker, status, payload FROM scan_checkpoint WHERE scan = ? AND day = ? AND phase = ?",
+                (scan, day, phase),
+            ).fetchall()
+
+        results = {}
+        failed = []
+        for ticker, status, payload in rows:
+            if status == "failed":
+                failed.append(ticker)
+            else:
+                results[ticker] = json.loads(payload) if payload else None
+        return results, failed
+
+    @metrics.timed("store.save_checkpoint")
+    def save_checkpoint(self, scan: str, phase: int, results: dict, failed: list[str] = ()):
+        day = datetime.now(JST).date().isoformat()
+        rows = [
+            (scan, day, phase, ticker, "ok" if r else "none", json.dumps(r) if r else None)
+            for ticker, r in results.items()
+        ]
+        rows += [(scan, day, phase, ticker, "failed", None) for ticker in failed]
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO scan_checkpoint VALUES (?,?,?,?,?,?)", rows)
+
+    def load_streaks(self, screen: str, codes: list[str]) -> dict[str, dict]:
+        cols = ["code", "first_day", "last_day", "last_period", "streak_start", "streak", "periods"]
+        out = {}
+        with self.lock:
+            for i in range(0, len(codes), 500):
+                chunk = codes[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT {', '.join(cols)} FROM code_rollup WHERE screen = ? AND code IN ({', '.join('?' * len(chunk))})",
+                    (screen, *chunk),
+                ).fetchall()
+                out.update((r[0], dict(zip(cols, r))) for r in rows)
+        return out
+
+    def rebuild_rollups(self, days: dict[str, dict[str, list[str]]], totals: list[tuple]):
+        with self.transaction() as conn:
+            # screen_periods にはヒットの無かった期間も入っているので消さない
+            for table in ("code_rollup", "portfolio_totals"):
+                conn.execute(f"DELETE FROM {table}")
+            for screen, by_day in days.items():
+                for day in sorted(by_day):
+                    _roll_up(conn, screen, day, by_day[day])
+            conn.executemany("INSERT INTO portfolio_totals (day, session, ts, total, n_codes) VALUES (?,?,?,?,?)", totals)
+
+    def save_metrics(self, run: str, job: str, rows: list[tuple]):
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO run_metrics (run, job, name, kind, value) VALUES (?,?,?,?,?)",
+                [(run, job, *r) for r in rows],
+            )
+
+    def load_metrics(self, job: str, runs: int) -> dict[str, list[tuple]]:
+        with self.lock:
+            rows = self.conn.execute("""
+                SELECT run, name, kind, value FROM run_metrics
+                WHERE job = ? AND run IN (
+                    SELECT DISTINCT run FROM run_metrics WHERE job = ? ORDER BY run DESC LIMIT ?
+                )
+            """, (job, job, runs)).fetchall()
+        out: dict[str, list[tuple]] = {}
+        for run, name, kind, value in rows:
+            out.setdefault(run, []).append((name, kind, value))
+        return out
+
+    def metric_jobs(self) -> list[str]:
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT DISTINCT job FROM run_metrics ORDER BY job")]
+
+    def clear_checkpoint(self, scan: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM scan_checkpoint WHERE scan = ?", (scan,))
+
+    def load_retry_queue(self, scan: str) -> dict[str, dict]:
+        cols = ["ticker", "reason", "attempts", "first_failed", "last_failed", "next_retry", "quarantined"]
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {', '.join(cols)} FROM retry_queue WHERE scan = ?", (scan,)).fetchall()
+        return {r[0]: dict(zip(cols[1:], r[1:])) for r in rows}
+
+    @metrics.timed("store.save_retry_queue")
+    def save_retry_queue(self, scan: str, rows: list[tuple], resolved: list[str]):
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO retry_queue VALUES (?,?,?,?,?,?,?,?)",
+                             [(scan, *r) for r in rows])
+            conn.executemany("DELETE FROM retry_queue WHERE scan = ? AND ticker = ?", [(scan, t) for t in resolved])
+
+    def _columns(self, table: str) -> list[str]:
+        """差分で運ぶ列（AUTOINCREMENT の id は適用先で振り直す）。"""
+        return [r[1] for r in self.conn.execute(f"PRAGMA table_info({table})") if r[1] != "id"]
+
+    def export_changes(self) -> dict[str, dict]:
+        """change_log の単位ごとの現在の行 {table: {"columns", "groups", "rows"}}。"""
+        out = {}
+        with self.transaction() as conn:
+            for table, key in DELTA_GROUPS.items():
+                groups = [json.loads(g) for (g,) in conn.execute("SELECT grp FROM change_log WHERE tbl = ?", (table,))]
+                if not groups:
+                    continue
+                columns = self._columns(table)
+                on = " AND ".join(f"t.{k} = json_extract(c.grp, '$[{i}]')" for i, k in enumerate(key))
+                rows = conn.execute(
+                    f"SELECT {', '.join('t.' + c for c in columns)} FROM change_log c JOIN {table} t ON {on} "
+                    f"WHERE c.tbl = ?",
+                    (table,),
+                ).fetchall()
+                out[table] = {"columns": columns, "groups": groups, "rows": [list(r) for r in rows]}
+        return out
+
+    def mark_exported(self, delta: dict):
+        """書き出した差分を適用済みとして記録し、その単位を change_log から消す。"""
+        with self.transaction() as conn:
+            for table, d in delta["tables"].items():
+                grp = ", ".join("?" * len(DELTA_GROUPS[table]))
+                conn.executemany(f"DELETE FROM change_log WHERE tbl = '{table}' AND grp = json_array({grp})",
+                                 d["groups"])
+            conn.execute("INSERT OR IGNORE INTO delta_applied VALUES (?,?,?,?)",
+                         (delta["id"], delta["created"], delta["source"], datetime.now(JST).isoformat()))
+
+    @metrics.timed("store.apply_delta")
+    def apply_delta(self, delta: dict) -> bool:
+        """差分を1トランザクションで適用する（単位ごとに行を置き換える）。適用済みなら何もせず False。"""
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM delta_applied WHERE id = ?", (delta["id"],)).fetchone():
+                return False
+            for table, d in delta["tables"].items():
+                if table not in DELTA_GROUPS or not set(d["columns"]) <= set(self._columns(table)):
+                    raise ValueError(f"差分 {delta['id']}: 未知のテーブルまたは列 {table} {d['columns']}")
+                where = " AND ".join(f"{k} = ?" for k in DELTA_GROUPS[table])
+                conn.executemany(f"DELETE FROM {table} WHERE {where}", d["groups"])
+                cols = d["columns"]
+                conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})", d["rows"]
+                )
+                metrics.count("store.rows", len(d["rows"]))
+            conn.execute("INSERT INTO delta_applied VALUES (?,?,?,?)",
+                         (delta["id"], delta["created"], delta["source"], datetime.now(JST).isoformat()))
+        return True
+
+
+_store: Store | None = None
+_store_lock = threading.Lock()
+
+
+def get() -> Store:
+    """このプロセスの Store を返す（DB_PATH が変わっていれば開き直す）。"""
+    global _store
+    with _store_lock:
+        if _store is None or _store.path != DB_PATH:
+            if _store is not None:
+                _store.close()
+            _store = Store(DB_PATH)
+        return _store
+
+
+@atexit.register
+def close():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+def save_portfolio(stocks: list[dict], session: str):
+    """当日・session の保有の時価を保存する（同じ日・同じセッションの既存の行は置き換える）。"""
+    get().save_portfolio(stocks, session)
+
+
+def load_prev_closes() -> dict[str, float]:
+    """当日の portfolio 行に記録済みの前日終値 {code: 前日終値}。"""
+    return get().load_prev_closes()
+
+
+def save_lowcheck(stocks: list[dict]):
+    get().save_lowcheck(stocks)
+
+
+def save_dividend(stocks: list[dict]):
+    get().save_dividend(stocks)
+
+
+def mark_period(screen: str, day: str | None = None):
+    """screen が day（既定は今日）の期間に最後まで実行されたことを記録する。
+
+    ヒットが0件の期間も記録しておかないと、その期間をまたいで連続が途切れない。
+    """
+    get().mark_period(screen, day)
+
+
+def save_backtest(run: str, rows: list[tuple]):
+    """リプレイのヒット (day, screen, param, code, price, value) を保存する。"""
+    get().save_backtest(run, rows)
+
+
+def load_streaks(screen: str, codes: list[str]) -> dict[str, dict]:
+    """code_rollup の行 {code: {first_day, last_day, last_period, streak_start, streak, periods}}。"""
+    return get().load_streaks(screen, codes)
+
+
+def save_metrics(run: str, job: str, rows: list[tuple]):
+    """1回の実行の計測値 (name, kind, value) を保存する。"""
+    get().save_metrics(run, job, rows)
+
+
+def load_metrics(job: str, runs: int = 10) -> dict[str, list[tuple]]:
+    """job の直近 runs 回の計測値 {run: [(name, kind, value)]}。"""
+    return get().load_metrics(job, runs)
+
+
+def metric_jobs() -> list[str]:
+    return get().metric_jobs()
+
+
+def load_checkpoint(scan: str, phase: int = 1) -> tuple[dict, list[str]]:
+    """当日のスキャン途中結果を返す。前日以前の途中結果は破棄する。
+
+    Returns:
+        (results, failed): results は {ticker: 結果 dict or None}、failed は失敗として記録済みの銘柄
+    """
+    return get().load_checkpoint(scan, phase)
+
+
+def save_checkpoint(scan: str, phase: int, results: dict, failed: list[str] = ()):
+    """完了した銘柄の結果を当日の途中結果として記録する（1バッチ1トランザクション）。"""
+    get().save_checkpoint(scan, phase, results, failed)
+
+
+def clear_checkpoint(scan: str):
+    """スキャン完了後に途中結果を消す。"""
+    get().clear_checkpoint(scan)
+
+
+def load_retry_queue(scan: str) -> dict[str, dict]:
+    """scan の再試行待ち {ticker: {reason, attempts, first_failed, last_failed, next_retry, quarantined}}。"""
+    return get().load_retry_queue(scan)
+
+
+def save_retry_queue(scan: str, rows: list[tuple], resolved: list[str] = ()):
+    """scan の再試行待ちの行を書き（1トランザクション）、resolved の銘柄を外す。
+
+    rows は (ticker, reason, attempts, first_failed, last_failed, next_retry, quarantined)。
+    """
+    get().save_retry_queue(scan, rows, resolved)
+
+
+def export_changes() -> dict[str, dict]:
+    """DELTA_CAPTURE=1 で書き換えた単位ごとの現在の行 {table: {"columns", "groups", "rows"}}。"""
+    return get().export_changes()
+
+
+def mark_exported(delta: dict):
+    """書き出した差分を適用済みとして記録し、change_log から外す。"""
+    get().mark_exported(delta)
+
+
+def apply_delta(delta: dict) -> bool:
+    """差分を適用する。適用済みの差分（id が delta_applied にある）なら False。"""
+    return get().apply_delta(delta)
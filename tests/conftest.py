@@ -0,0 +1,28 @@
+"""テスト共通: 合成データの取得元と、テストごとの空の alerts.db・作業ディレクトリ。"""
+
+import os
+
+os.environ.setdefault("MARKET_DATA_PROVIDER", "synthetic")
+
+import pytest
+
+import provider
+import store
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """カレントディレクトリ（レポート・キャッシュの出力先）と alerts.db をテストごとに分ける。"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(store, "DB_PATH", str(tmp_path / "alerts.db"))
+    yield tmp_path
+    store.close()
+
+
+@pytest.fixture
+def synthetic():
+    """小さめの合成データ（取得の待ちなし）。"""
+    p = provider.SyntheticProvider(n_tickers=60, days=300, latency=0.0)
+    provider.set_provider(p)
+    yield p
+    provider.set_provider(None)
@@ -0,0 +1,43 @@
+import pandas as pd
+
+import backtest
+import lowcheck
+
+
+def naive_hits(data: pd.DataFrame, batch: list[str], day: pd.Timestamp, thr: float, near: float) -> set:
+    """1日分のヒットを銘柄ごとの系列から素直に求める。"""
+    hits = set()
+    for sym in batch:
+        if sym not in data.columns.get_level_values(0):
+            continue
+        df = data[sym][(data.index > day - backtest.YEAR) & (data.index <= day)]
+        close = df["Close"].dropna()
+        if close.empty:
+            continue
+        price, annual = close.iloc[-1], df["Dividends"].sum()
+        if price > 0 and annual > 0 and annual / price >= thr:
+            hits.add(("dividend", sym))
+        pcts = [(price - close.iloc[-n:].min()) / close.iloc[-n:].min() * 100 for _, n in lowcheck.PERIODS]
+        if len(close) >= backtest.MIN_CLOSES and min(pcts) < near:
+            hits.add(("lowcheck", sym))
+    return hits
+
+
+def test_replay_matches_per_day_screens(synthetic):
+    synthetic.missing_rate = 0.1
+    batch = synthetic.universe().tickers[:30]
+    data = backtest._download(batch, "2000-01-01")
+    days = data.index[-60::20]
+    hits = list(backtest.replay(data, batch, days[0], days[-1], [0.03], [5.0]))
+    for day in days:
+        got = {(screen, sym) for d, screen, _, sym, _, _ in hits if d == day.strftime("%Y-%m-%d")}
+        assert got == naive_hits(data, batch, day, 0.03, 5.0), day
+
+
+def test_main_writes_csv(synthetic, workdir):
+    end = synthetic._series(synthetic.universe().tickers[0]).index[-1]
+    backtest.main(["--start", (end - pd.Timedelta(days=14)).date().isoformat(), "--end", end.date().isoformat(),
+                   "--threshold", "0.03", "--out", "bt.csv"])
+    out = pd.read_csv(workdir / "bt.csv")
+    assert list(out.columns) == ["day", "screen", "param", "code", "price", "value"]
+    assert len(out) and out["day"].max() <= end.date().isoformat()
@@ -0,0 +1,17 @@
+import numpy as np
+
+import compute
+
+
+def test_pack_right_aligns_valid_values():
+    m = np.array([[1.0, np.nan], [np.nan, 5.0], [3.0, np.nan], [4.0, 6.0]])
+    packed = compute.pack(m, ~np.isnan(m), 3, np.nan)
+    np.testing.assert_array_equal(packed, [[1.0, np.nan], [3.0, 5.0], [4.0, 6.0]])
+    # 行数より長く取ると上を fill で埋める
+    np.testing.assert_array_equal(compute.pack(m, ~np.isnan(m), 5, 0.0)[:, 1], [0, 0, 0, 5, 6])
+
+
+def test_trailing_min_skips_missing():
+    m = np.array([[1.0], [np.nan], [3.0], [2.0], [np.nan]])
+    assert compute.trailing_min(m, 2)[0] == 2.0
+    assert compute.trailing_min(m, 3)[0] == 1.0
@@ -0,0 +1,89 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+import daemon
+import trading_calendar
+
+
+def run_day(start: datetime, end: datetime) -> list[tuple]:
+    """時計を差し替えたスケジューラを start から end まで動かし、投入されたジョブを返す。"""
+    clock = [start]
+    scheduler = daemon.Scheduler(now=lambda: clock[0])
+
+    def sleep(seconds):
+        clock[0] += timedelta(seconds=seconds)
+        if clock[0] >= end:
+            scheduler.stop.set()
+
+    scheduler.sleep = sleep
+    scheduler.schedule()
+    jobs = []
+    while not scheduler.jobs.empty():
+        job = scheduler.jobs.get()
+        jobs.append((job["name"], job["arg"]))
+    return jobs
+
+
+def test_each_scheduled_job_submitted_once():
+    # 2026-10-19 は月曜の営業日（週の最初の営業日なので配当も動く）
+    jobs = run_day(datetime(2026, 10, 19, 9, 9, tzinfo=daemon.JST), datetime(2026, 10, 19, 16, 0, tzinfo=daemon.JST))
+    assert jobs == [
+        ("portfolio", "寄り付き"),
+        ("portfolio", "後場寄り"),
+        ("dividend", None),
+        ("lowcheck", None),
+        ("portfolio", "終値"),
+    ]
+
+
+def test_tuesday_skips_dividend():
+    jobs = run_day(datetime(2026, 10, 20, 9, 0, tzinfo=daemon.JST), datetime(2026, 10, 20, 16, 0, tzinfo=daemon.JST))
+    assert [name for name, _ in jobs] == ["portfolio", "portfolio", "lowcheck", "portfolio"]
+
+
+def test_overdue_job_is_skipped_after_long_sleep():
+    start = datetime(2026, 10, 19, 9, 9, tzinfo=daemon.JST)
+    clock = [start]
+    scheduler = daemon.Scheduler(now=lambda: clock[0])
+
+    def sleep(seconds):
+        # 最初の待ちで 2 時間止まっていた（PC のスリープなど）
+        clock[0] += timedelta(hours=2) if clock[0] == start else timedelta(seconds=seconds)
+        if clock[0] >= datetime(2026, 10, 19, 13, 0, tzinfo=daemon.JST):
+            scheduler.stop.set()
+
+    scheduler.sleep = sleep
+    scheduler.schedule()
+    jobs = [scheduler.jobs.get()["arg"] for _ in range(scheduler.jobs.qsize())]
+    assert jobs == ["後場寄り"]
+
+
+@pytest.mark.parametrize("day", [
+    "2026-01-02",  # 年末年始
+    "2026-01-12",  # 成人の日
+    "2026-03-20",  # 春分の日
+    "2026-05-06",  # 振替休日（5/3 が日曜）
+    "2026-09-22",  # 国民の休日（敬老の日と秋分の日の間）
+    "2026-12-31",
+])
+def test_closed_days(day):
+    assert not trading_calendar.is_trading_day(date.fromisoformat(day))
+
+
+def test_first_trading_day_of_week():
+    # 2026-09-21〜23 が連休なので、その週の最初の営業日は木曜
+    assert trading_calendar.next_trading_day(date(2026, 9, 19)) == date(2026, 9, 24)
+    assert trading_calendar.is_first_of_week(date(2026, 9, 24))
+    assert not trading_calendar.is_first_of_week(date(2026, 9, 25))
+
+
+def test_trading_days_between_matches_calendar():
+    start = [date(2026, 9, 18), date(2026, 12, 25), date(2026, 9, 24)]
+    end = [date(2026, 9, 25), date(2027, 1, 6), date(2026, 9, 20)]
+    counts = trading_calendar.trading_days_between(np.array(start, dtype="datetime64[D]"),
+                                                   np.array(end, dtype="datetime64[D]"))
+    # 9/21〜23 の連休・年末年始は数えず、逆順は 0
+    assert counts.tolist() == [1, 5, 0]
+    assert trading_calendar.trading_days_between(date(2026, 9, 18), date(2026, 9, 25)) == 1
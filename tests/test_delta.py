@@ -0,0 +1,39 @@
+import delta
+import store
+
+
+def hit(code: str, price: float) -> dict:
+    return {"code": code, "name": code, "price": price,
+            "low_26w": 99.5, "pct_26w": 0.5, "low_52w": 99.5, "pct_52w": 0.5}
+
+
+def rows(table: str) -> list[tuple]:
+    cols = ", ".join(c for c in store.get()._columns(table) if c != "ts")
+    return store.get().select(f"SELECT {cols} FROM {table} ORDER BY 1, 2")
+
+
+def test_export_and_merge_carry_only_changed_groups(workdir, monkeypatch):
+    base, job = str(workdir / "base.db"), str(workdir / "job.db")
+    monkeypatch.setattr(store, "DB_PATH", base)
+    store.save_lowcheck([hit("1301", 100.0)])
+
+    # ジョブは基準の DB の写しで動き、書き換えた単位だけを差分にする
+    store.close()
+    (workdir / "job.db").write_bytes((workdir / "base.db").read_bytes())
+    monkeypatch.setattr(store, "DB_PATH", job)
+    monkeypatch.setattr(store, "DELTA_CAPTURE", True)
+    store.save_lowcheck([hit("1302", 200.0)])
+    store.mark_period("lowcheck")
+    out = delta.export(str(workdir / "deltas" / "job.json.gz"), source="test")
+    assert set(out["tables"]) == {"lowcheck", "code_rollup"}
+    assert [g[1] for g in out["tables"]["lowcheck"]["groups"]] == ["1302"]
+    assert out["tables"]["code_rollup"]["groups"] == [["lowcheck", "1302"]]
+    expected = {t: rows(t) for t in ("lowcheck", "screen_periods", "code_rollup")}
+    assert delta.export(str(workdir / "deltas" / "again.json.gz")) is None
+
+    monkeypatch.setattr(store, "DELTA_CAPTURE", False)
+    monkeypatch.setattr(store, "DB_PATH", base)
+    merged = delta.merge([str(workdir / "deltas")])
+    assert len(merged) == 1
+    assert {t: rows(t) for t in expected} == expected
+    assert store.apply_delta(delta.read(merged[0])) is False
@@ -0,0 +1,79 @@
+from datetime import datetime
+
+import numpy as np
+
+import dividend_index
+
+
+def due(verified: str, *ex_dates: str, today: str) -> bool:
+    ex = np.full((1, dividend_index.MAX_EVENTS), dividend_index.NAT)
+    ex[0, dividend_index.MAX_EVENTS - len(ex_dates):] = ex_dates
+    return bool(dividend_index.due(np.array([verified], dtype="datetime64[D]"), ex, np.datetime64(today))[0])
+
+
+def test_due_near_next_ex_date():
+    assert not due("2026-09-01", "2025-09-29", today="2026-09-02")
+    assert due("2026-09-01", "2025-09-29", today="2026-09-10")  # 前年の権利落ちの1年後 - WINDOW_DAYS に入った
+    assert not due("2026-10-21", "2025-09-29", today="2026-10-22")
+
+
+def test_due_when_verification_is_old():
+    assert due("2026-08-01", today="2026-09-10")
+    assert not due("2026-09-01", today="2026-09-10")
+    assert due("NaT", today="2026-09-10")
+
+
+def test_second_run_refetches_only_due_tickers(synthetic, monkeypatch):
+    symbols = synthetic.universe().tickers[:20]
+    index = dividend_index.EventIndex(symbols)
+    first = dividend_index.update(symbols, index)
+    today = np.datetime64(datetime.now(dividend_index.JST).date(), "D")
+    # 日足が返らない銘柄と権利落ちが近い銘柄だけを取り直す
+    expected = [s for s, d in zip(symbols, dividend_index.due(index.verified, index.ex, today)) if d]
+    assert len(expected) < len(symbols)
+    refreshed = []
+    download = dividend_index.history.download
+
+    def spy(batch):
+        refreshed.extend(batch)
+        return download(batch)
+
+    monkeypatch.setattr(dividend_index.history, "download", spy)
+    second = dividend_index.update(symbols, index)
+    assert sorted(refreshed) == sorted(expected)
+    assert second["annual_dividend"].equals(first["annual_dividend"])
+
+
+def test_index_round_trip(synthetic, tmp_path):
+    symbols = synthetic.universe().tickers[:20]
+    index = dividend_index.EventIndex(symbols)
+    dividend_index.update(symbols, index)
+    path = str(tmp_path / "index.npz")
+    dividend_index.save_index(index, path)
+    loaded = dividend_index.load_index(symbols[::-1] + ["9999.T"], path)
+    np.testing.assert_array_equal(loaded.verified[:-1], index.verified[::-1])
+    np.testing.assert_array_equal(loaded.amount[:-1], index.amount[::-1])
+    assert np.isnat(loaded.verified[-1])
+
+
+def test_refresh_with_old_bars_is_not_verified(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.0
+    a, b = synthetic.universe().tickers[:2]
+    halted = synthetic._series(a).index[-10]
+    index = dividend_index.EventIndex([a, b])
+    index.verified[0] = np.datetime64("2026-01-05")
+    index.ex[0, -1] = np.datetime64("2025-09-29")
+
+    def download(batch):
+        # 取り直しても a には10営業日前までの足しか無い
+        data = synthetic.download(batch, period="1y")
+        return data[[c for c in data.columns if c[0] != a]].combine_first(
+            data[[c for c in data.columns if c[0] == a]][lambda d: d.index <= halted]
+        )
+
+    monkeypatch.setattr(dividend_index.history, "download", download)
+    table = dividend_index.update([a, b], index)
+    assert index.verified[0] == np.datetime64("2026-01-05")
+    assert index.ex[0, -1] == np.datetime64("2025-09-29")
+    assert table.loc[a, "n_close"] == 0
+    assert table.loc[b, "n_close"] > 0
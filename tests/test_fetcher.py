@@ -0,0 +1,51 @@
+import time
+
+import pandas as pd
+import pytest
+
+import fetcher
+
+
+def test_breaker_opens_after_consecutive_throttles():
+    breaker = fetcher.CircuitBreaker(threshold=3, cooldown=10, max_cooldown=25)
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.open_until == 0.0
+    breaker.record(True)
+    assert breaker.open_until > time.monotonic() + 9
+    assert breaker.cooldown == 20
+    for _ in range(3):
+        breaker.record(True)
+    assert breaker.cooldown == 25
+    breaker.record(False)
+    assert (breaker.failures, breaker.cooldown) == (0, 10)
+
+
+def test_controller_backs_off_and_recovers():
+    bucket = fetcher.TokenBucket(1.0, capacity=4)
+    ctl = fetcher.AdaptiveController(bucket, max_in_flight=4, batch_size=100)
+    for _ in range(5):
+        ctl.record(1.0, throttled=False, error=False)
+    assert (ctl.concurrency, ctl.batch_size) == (4, 150)
+    ctl.record(1.0, throttled=True, error=False)
+    assert (ctl.concurrency, ctl.batch_size, bucket.rate) == (2, 75, pytest.approx(0.75))
+    ctl.record(fetcher.TARGET_LATENCY + 1, throttled=False, error=False)
+    assert ctl.batch_size == 60
+
+
+def test_empty_batch_is_throttling():
+    data = pd.DataFrame()
+    data.attrs.update(requested=fetcher.THROTTLE_MIN_REQUESTED, missing=fetcher.THROTTLE_MIN_REQUESTED)
+    assert fetcher._is_throttled(data, None)
+    data.attrs["missing"] -= 1
+    assert not fetcher._is_throttled(data, None)
+    assert fetcher._is_throttled(None, RuntimeError("429 Too Many Requests"))
+
+
+def test_iter_batches_returns_every_symbol(synthetic):
+    symbols = synthetic.universe().tickers
+    seen = []
+    for batch, data in fetcher.iter_batches(symbols, fetch=lambda b: synthetic.download(b, period="5d")):
+        assert data is not None
+        seen.extend(batch)
+    assert sorted(seen) == sorted(symbols)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+import dividend_index
+import history
+
+
+def test_split_frames_keeps_dividend_without_close():
+    days = pd.bdate_range("2026-09-28", periods=4)
+    raw = pd.DataFrame({
+        "Close": [100.0, np.nan, np.nan, 103.0],
+        "Dividends": [0.0, 12.5, np.nan, 0.0],
+        "Stock Splits": [0.0, 0.0, np.nan, 0.0],
+    }, index=days)
+    df = history.split_frames(pd.concat({"1378.T": raw}, axis=1), ["1378.T"])["1378.T"]
+    # 終値も配当も無い日だけが落ちる
+    assert list(df.index) == [days[0], days[1], days[3]]
+    assert df.loc[days[1], "Dividends"] == 12.5
+
+
+def test_annual_dividend_counts_days_without_close(synthetic):
+    synthetic.missing_rate = 0.3
+    symbols = synthetic.universe().tickers[:20]
+    table = dividend_index.update(symbols, dividend_index.EventIndex(symbols))
+    cutoff = pd.Timestamp(synthetic.end) - pd.DateOffset(years=1)
+    for sym in symbols:
+        raw = synthetic.download([sym], period="1y")
+        if raw.empty:
+            continue
+        divs = raw[sym]["Dividends"]
+        expected = divs[divs.index > cutoff].sum()
+        assert np.isclose(table.loc[sym, "annual_dividend"], expected), sym
+
+
+def spy_downloads(synthetic, monkeypatch, edit=None):
+    """synthetic.download の呼び出し [(銘柄, 引数)] を記録する。edit(frame) で返す日足を書き換えられる。"""
+    calls = []
+    download = synthetic.download
+
+    def spy(symbols, **kwargs):
+        calls.append((list(symbols), kwargs))
+        data = download(symbols, **kwargs)
+        return edit(data) if edit else data
+
+    monkeypatch.setattr(synthetic, "download", spy)
+    return calls
+
+
+def test_second_download_fetches_only_new_bars(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.0
+    symbols = synthetic.universe().tickers[:5]
+    calls = spy_downloads(synthetic, monkeypatch)
+    first = history.download(symbols)
+    second = history.download(symbols)
+    index = history._read_index()
+    assert calls == [(symbols, {"period": "1y"}), (symbols, {"start": min(index[s] for s in symbols)})]
+    pd.testing.assert_frame_equal(first, second)
+    assert second.attrs == {"requested": 5, "missing": 0}
+
+
+def test_split_refetches_full_history(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.0
+    symbols = synthetic.universe().tickers[:3]
+    history.download(symbols)
+
+    def split(data):
+        if len(data) < synthetic.days:
+            data = data.copy()
+            data.loc[data.index[-1], (symbols[1], "Stock Splits")] = 2.0
+        return data
+
+    calls = spy_downloads(synthetic, monkeypatch, split)
+    history.download(symbols)
+    assert [c[0] for c in calls] == [symbols, [symbols[1]]]
+    assert calls[1][1] == {"period": "1y"}
+
+
+def test_stale_symbol_is_missing(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.0
+    a, b = synthetic.universe().tickers[:2]
+    history.download([a, b])
+    # a は10営業日前で足が止まった（売買停止・上場廃止）
+    halted = synthetic._series(a).index[-10]
+
+    def halt(data):
+        return data[[c for c in data.columns if c[0] != a]].combine_first(
+            data[[c for c in data.columns if c[0] == a]][lambda d: d.index <= halted]
+        )
+
+    index = history._read_index()
+    index[a] = halted.date().isoformat()
+    history._write_index(index)
+    calls = spy_downloads(synthetic, monkeypatch, halt)
+    data = history.download([a, b])
+
+    # a は差分取得から外れ、b の取得開始日を遡らせない
+    assert calls == [([b], {"start": index[b]}), ([a], {"period": "1y"})]
+    assert set(data.columns.get_level_values(0)) == {b}
+    assert data.attrs == {"requested": 2, "missing": 1}
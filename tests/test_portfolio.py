@@ -0,0 +1,95 @@
+import io
+import json
+import urllib.request
+from datetime import datetime, timedelta
+
+import portfolio
+import provider
+import store
+
+LOTS = [{"account": "", "code": "1301", "shares": 100, "cost": None}]
+
+
+class Quotes:
+    """最新の足の日付と前日終値を決めて返す取得元。"""
+
+    name = "fake"
+
+    def __init__(self):
+        self.calls = []
+        self.answer = {}
+
+    def quotes(self, symbols, prev=True):
+        self.calls.append(prev)
+        return {s: dict(self.answer, prev=self.answer["prev"] if prev else None) for s in symbols}
+
+
+def test_prev_close_before_todays_bar_is_not_cached():
+    today = datetime.now(portfolio.JST).date()
+    fake = Quotes()
+    provider.set_provider(fake)
+    try:
+        # 当日の足ができる前: prev は2日前の終値
+        fake.answer = {"price": 110.0, "prev": 90.0, "day": (today - timedelta(days=1)).isoformat()}
+        store.save_portfolio(portfolio.fetch_prices(LOTS), "寄り付き")
+        assert store.load_prev_closes() == {}
+
+        fake.answer = {"price": 120.0, "prev": 110.0, "day": today.isoformat()}
+        stocks = portfolio.fetch_prices(LOTS)
+        assert stocks[0]["prev_close"] == 110.0
+        store.save_portfolio(stocks, "後場寄り")
+        assert store.load_prev_closes() == {"1301": 110.0}
+
+        fake.answer = {"price": 121.0, "prev": 999.0, "day": today.isoformat()}
+        stocks = portfolio.fetch_prices(LOTS)
+        assert stocks[0]["prev_close"] == 110.0
+        assert fake.calls == [True, True, False]
+    finally:
+        provider.set_provider(None)
+
+
+def test_synthetic_quotes_report_bar_day(synthetic):
+    sym = next(s for s in synthetic.universe().tickers if not synthetic._dead(s))
+    q = synthetic.quotes([sym])[sym]
+    assert q["day"] == synthetic._series(sym).index[-1].date().isoformat()
+
+
+def test_quotes_skip_results_without_symbol(monkeypatch):
+    body = {"spark": {"result": [
+        {"response": [{"meta": {"regularMarketPrice": 1.0}}]},
+        {"symbol": "1301.T", "response": [{
+            "meta": {"regularMarketPrice": 120.0},
+            "timestamp": [1760000000, 1760086400],
+            "indicators": {"quote": [{"close": [110.0, 120.0]}]},
+        }]},
+    ]}}
+
+    class Response(io.BytesIO):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(urllib.request, "urlopen", lambda req, timeout: Response(json.dumps(body).encode()))
+    quotes = provider.YahooProvider().quotes(["1301.T", "1332.T"])
+    assert list(quotes) == ["1301.T"]
+    assert quotes["1301.T"]["prev"] == 110.0
+
+
+def test_malformed_batch_does_not_stop_others(monkeypatch):
+    class Malformed:
+        name = "fake"
+
+        def quotes(self, symbols, prev=True):
+            if "1301.T" in symbols:
+                raise KeyError("symbol")
+            return {s: {"price": 100.0, "prev": None, "day": None} for s in symbols}
+
+    provider.set_provider(Malformed())
+    monkeypatch.setattr(portfolio, "BATCH_SIZE", 1)
+    monkeypatch.setattr(portfolio, "RATE", 1000.0)
+    try:
+        assert list(portfolio.fetch_quotes(["1301.T", "1332.T"], prev=False)) == ["1332.T"]
+    finally:
+        provider.set_provider(None)
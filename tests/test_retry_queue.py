@@ -0,0 +1,42 @@
+import lowcheck
+import rolling_lows
+import store
+
+
+def dead(synthetic):
+    return [s for s in synthetic.universe().tickers if synthetic._dead(s)]
+
+
+def test_lowcheck_checkpoints_failures(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.2
+    # clear_checkpoint の前に落ちた実行の途中結果を残す
+    monkeypatch.setattr(store, "clear_checkpoint", lambda scan: None)
+    list(lowcheck.scan_stream(synthetic.universe()))
+    done, failed = store.load_checkpoint("lowcheck")
+    assert dead(synthetic)
+    assert sorted(failed) == sorted(dead(synthetic))
+    assert not set(done) & set(failed)
+
+
+def test_lowcheck_resume_queues_checkpointed_failures(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.2
+    tickers = synthetic.universe()
+    failed = dead(synthetic)
+    ok = [s for s in tickers.tickers if s not in failed]
+    store.save_checkpoint("lowcheck", 1, dict.fromkeys(ok[:10]), failed)
+
+    requested = []
+    update = rolling_lows.update
+
+    def spy(batch, state, periods):
+        requested.extend(batch)
+        return update(batch, state, periods)
+
+    monkeypatch.setattr(rolling_lows, "update", spy)
+    list(lowcheck.scan_stream(tickers))
+
+    assert sorted(requested) == sorted(ok[10:])
+    queue = store.load_retry_queue("lowcheck")
+    assert sorted(queue) == sorted(failed)
+    assert all(q["attempts"] == 1 for q in queue.values())
+    assert store.load_checkpoint("lowcheck") == ({}, [])
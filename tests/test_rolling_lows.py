@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import history
+import rolling_lows
+
+PERIODS = [("26w", 126), ("52w", 245)]
+ROWS = max(days for _, days in PERIODS)
+
+
+def warm_state(synthetic, upto: dict) -> rolling_lows.LowsState:
+    """銘柄ごとに upto 本目の足までを積んだ状態（前回の実行がそこで終わった想定）。"""
+    state = rolling_lows.LowsState(list(upto), ROWS)
+    for sym, n in upto.items():
+        df = synthetic._series(sym).iloc[:n]
+        close = df[["Close"]].to_numpy(dtype=float)
+        state.push(state.ids([sym]), df.index.values.astype("datetime64[D]"), close, ~np.isnan(close))
+    return state
+
+
+def live_tickers(synthetic, n):
+    return [s for s in synthetic.universe().tickers if not synthetic._dead(s)][:n]
+
+
+def test_lagging_ticker_does_not_rebuild_others(synthetic, monkeypatch):
+    a, b = live_tickers(synthetic, 2)
+    state = warm_state(synthetic, {a: -3, b: -1})
+    assert state.day[-1, 0] < state.day[-1, 1]
+
+    def no_rebuild(batch):
+        pytest.fail(f"再構築された: {batch}")
+
+    monkeypatch.setattr(history, "download", no_rebuild)
+    table = rolling_lows.update([a, b], state, PERIODS)
+
+    monkeypatch.undo()
+    fresh = rolling_lows.update([a, b], rolling_lows.LowsState([a, b], ROWS), PERIODS)
+    pd.testing.assert_frame_equal(table, fresh)
+    assert state.day[-1, 0] == state.day[-1, 1]
+
+
+def test_changed_close_rebuilds_only_that_ticker(synthetic, monkeypatch):
+    a, b = live_tickers(synthetic, 2)
+    state = warm_state(synthetic, {a: -3, b: -1})
+    state.close[-1, 0] *= 2
+    rebuilt = []
+
+    def download(batch):
+        rebuilt.extend(batch)
+        return synthetic.download(batch, period="1y")
+
+    monkeypatch.setattr(history, "download", download)
+    rolling_lows.update([a, b], state, PERIODS)
+    assert rebuilt == [a]
+
+
+def test_rebuild_with_old_bars_drops_ticker(synthetic, monkeypatch):
+    a, b = live_tickers(synthetic, 2)
+    # a は10営業日前で足が止まり、キャッシュにも古い足しか無い
+    halted = synthetic._series(a).index[-10]
+    state = warm_state(synthetic, {a: -10, b: -1})
+    state.day[:, 0] -= np.timedelta64(rolling_lows.MAX_GAP_DAYS, "D")  # 差分更新の対象外
+
+    def download(batch):
+        data = synthetic.download(batch, period="1y")
+        return data[data.index <= halted]
+
+    monkeypatch.setattr(history, "download", download)
+    table = rolling_lows.update([a, b], state, PERIODS)
+    assert list(table.index) == [b]
+    assert np.isnat(state.day[:, 0]).all()
+
+
+def test_lows_match_per_ticker_series(synthetic):
+    symbols = live_tickers(synthetic, 5)
+    table = rolling_lows.update(symbols, rolling_lows.LowsState(symbols, ROWS), PERIODS)
+    for sym in symbols:
+        close = synthetic._series(sym)["Close"].dropna()
+        close = close[close.index > pd.Timestamp.now() - pd.DateOffset(years=1)]
+        assert table.loc[sym, "price"] == close.iloc[-1]
+        for label, days in PERIODS:
+            assert table.loc[sym, f"low_{label}"] == close.iloc[-days:].min()
+
+
+def test_state_round_trip(synthetic, tmp_path):
+    a, b, c = live_tickers(synthetic, 3)
+    state = warm_state(synthetic, {a: -3, b: -1})
+    path = str(tmp_path / "state.npz")
+    rolling_lows.save_state(state, path)
+    # 保存後に銘柄リストが変わっても、同じ銘柄の列に戻る（本数を減らすと古い方から落ちる）
+    loaded = rolling_lows.load_state([c, b, a], ROWS - 5, path)
+    np.testing.assert_array_equal(loaded.close[:, [2, 1]], state.close[5:])
+    assert np.isnat(loaded.day[:, 0]).all()
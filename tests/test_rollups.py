@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+import analytics
+import lowcheck
+import store
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """store が使う現在時刻を差し替える。clock("2026-10-19") でその日の昼にする。"""
+    class Clock(datetime):
+        current = None
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.current
+
+    def set_day(day: str):
+        Clock.current = datetime.fromisoformat(f"{day}T12:00:00").replace(tzinfo=store.JST)
+
+    monkeypatch.setattr(store, "datetime", Clock)
+    return set_day
+
+
+def hit(code: str) -> dict:
+    return {"code": code, "name": code, "price": 100.0,
+            "low_26w": 99.5, "pct_26w": 0.5, "low_52w": 99.5, "pct_52w": 0.5}
+
+
+def run(day: str, codes: list[str], clock):
+    clock(day)
+    store.save_lowcheck([hit(c) for c in codes])
+    store.mark_period("lowcheck")
+
+
+def test_zero_hit_day_breaks_streak(clock):
+    run("2026-10-19", ["1301", "1302"], clock)
+    run("2026-10-20", ["1302"], clock)
+    run("2026-10-21", [], clock)
+    run("2026-10-22", ["1301", "1302"], clock)
+    rows = store.load_streaks("lowcheck", ["1301", "1302"])
+    assert rows["1301"]["streak"] == 1
+    assert rows["1302"]["streak"] == 1
+    assert rows["1302"]["periods"] == 3
+    assert analytics.seen("lowcheck", rows["1302"], "2026-10-22") == "back"
+
+
+def test_consecutive_days_extend_streak(clock):
+    for day in ("2026-10-19", "2026-10-20", "2026-10-21"):
+        run(day, ["1301"], clock)
+    row = store.load_streaks("lowcheck", ["1301"])["1301"]
+    assert (row["streak"], row["streak_start"], row["periods"]) == (3, "2026-10-19", 3)
+    assert analytics.seen("lowcheck", row, "2026-10-21") == "3d"
+
+
+def test_rebuild_keeps_zero_hit_periods(clock):
+    run("2026-10-19", ["1301"], clock)
+    run("2026-10-20", [], clock)
+    run("2026-10-21", ["1301"], clock)
+    store.get().rebuild_rollups({"lowcheck": {"2026-10-19": ["1301"], "2026-10-21": ["1301"]}}, [])
+    assert store.load_streaks("lowcheck", ["1301"])["1301"]["streak"] == 1
+
+
+def test_lowcheck_records_period_without_hits(synthetic, monkeypatch):
+    monkeypatch.setattr(lowcheck, "NEAR_LOW_PCT", -1.0)
+    lowcheck.main([])
+    today = datetime.now(store.JST).date().isoformat()
+    periods = store.get().select("SELECT period FROM screen_periods WHERE screen = 'lowcheck'")
+    assert periods == [(today,)]
+    assert store.get().select("SELECT COUNT(*) FROM lowcheck") == [(0,)]
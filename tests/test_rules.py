@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import rules
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load(tmp_path, text: str) -> list[dict]:
+    path = tmp_path / "screens.toml"
+    path.write_text(text, encoding="utf-8")
+    return rules.load(str(path))
+
+
+def test_repo_screens_load():
+    screens = rules.load(str(ROOT / "screens.toml"))
+    assert [s["output"] for s in screens][:2] == ["dividend", "lowcheck"]
+    assert ("pct_from_low", 365) in rules.required(screens)
+
+
+@pytest.mark.parametrize("text, message", [
+    ('[[screen]]\nall = [{ metric = "pe", op = "<", value = 10 }]', "未知の指標"),
+    ('[[screen]]\nall = [{ metric = "low", op = "<", value = 10 }]', "lookback"),
+    ('[[screen]]\nall = [{ metric = "price", lookback = 5, op = "<", value = 10 }]', "lookback を取りません"),
+    ('[[screen]]\nall = [{ metric = "price", op = "!=", value = 10 }]', "未知の比較"),
+    ('[[screen]]\nname = "a"', "条件が必要"),
+    ('[[screen]]\nall = [{ metric = "price", op = ">", value = 0 }]\noutput = "mail"', "未知の出力先"),
+    ('[[screen]]\nname = "a"\nall = [{ metric = "price", op = ">", value = 0 }]\n' * 2, "重複"),
+    ('[[screen]]\nname = "a"\nall = [{ metric = "price", op = ">", value = 0 }]\noutput = "dividend"\n'
+     '[[screen]]\nname = "b"\nall = [{ metric = "price", op = ">", value = 0 }]\noutput = "dividend"\n', "1つまで"),
+])
+def test_load_rejects_invalid_screens(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        load(tmp_path, text)
+
+
+def test_evaluate_all_and_any(tmp_path):
+    screens = load(tmp_path, """
+[[screen]]
+name = "cheap_or_high_yield"
+all = [{ metric = "price", op = ">", value = 0 }]
+any = [
+    { metric = "price", op = "<", value = 100 },
+    { metric = "dividend_yield", op = ">=", value = 0.05 },
+]
+sort = { metric = "dividend_yield", descending = true }
+
+[[screen]]
+name = "near_low"
+all = [{ metric = "pct_from_low", lookback = 20, op = "<=", value = 1.0 }]
+""")
+    table = pd.DataFrame({
+        "price": [50.0, 500.0, 500.0, np.nan],
+        "dividend_yield": [0.01, 0.06, np.nan, 0.08],
+        "pct_from_low_20": [0.5, 3.0, np.nan, 0.0],
+    }, index=["A", "B", "C", "D"])
+    hits = rules.evaluate(table, screens)
+    # 値が不明な指標の比較は偽
+    assert hits == {"cheap_or_high_yield": ["A", "B"], "near_low": ["A", "D"]}
+
+    rows = [{"ticker": t, **table.loc[t].to_dict()} for t in table.index]
+    order = [r["ticker"] for r in sorted(rows, key=rules.sort_key(screens[0]))]
+    assert order == ["D", "B", "A", "C"]  # 降順、不明は最後
+
+
+def test_metrics_match_per_symbol_series():
+    days = pd.bdate_range("2026-01-05", periods=30)
+    close = pd.DataFrame({"A": np.linspace(100, 71, 30), "B": np.linspace(50, 79, 30)}, index=days)
+    close.iloc[5, 0] = np.nan
+    divs = pd.DataFrame(0.0, index=days, columns=["A", "B"])
+    divs.iloc[10, 1] = 2.0
+    data = pd.concat({"Close": close, "Dividends": divs}, axis=1).swaplevel(axis=1)
+    need = {("price", None), ("n_close", None), ("dividend_yield", None),
+            ("low", 10), ("pct_from_low", 10), ("return_pct", 5)}
+    table = rules.metrics(data, ["A", "B", "Z"], need)
+
+    for sym in ("A", "B"):
+        s = close[sym].dropna()
+        assert table.loc[sym, "price"] == s.iloc[-1]
+        assert table.loc[sym, "n_close"] == len(s)
+        assert table.loc[sym, "low_10"] == s.iloc[-10:].min()
+        assert table.loc[sym, "return_pct_5"] == pytest.approx((s.iloc[-1] / s.iloc[-6] - 1) * 100)
+    assert table.loc["B", "dividend_yield"] == pytest.approx(2.0 / 79)
+    assert table.loc["A", "pct_from_low_10"] == 0.0
+    assert table.loc["Z", "n_close"] == 0
+    assert table.loc["Z", "pct_from_low_10"] == 999.0
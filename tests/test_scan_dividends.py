@@ -0,0 +1,118 @@
+import time
+from collections import Counter
+
+import pytest
+
+import dividend_index
+import scan_dividends
+import store
+
+
+@pytest.fixture
+def fast_fallback(monkeypatch):
+    monkeypatch.setattr(scan_dividends, "FALLBACK_RATE", 1000.0)
+    monkeypatch.setattr(scan_dividends, "FALLBACK_TIMEOUT", 0.2)
+    calls = Counter()
+
+    def install(behaviour):
+        def fetch(sym):
+            calls[sym] += 1
+            return behaviour(sym, calls[sym])
+        monkeypatch.setattr(scan_dividends, "_fetch_fallback", fetch)
+        return calls
+    return install
+
+
+def row(sym: str) -> dict:
+    return {"dividend_yield": 0.05, "annual_dividend": 50.0, "price": 1000.0 + int(sym[1:])}
+
+
+def test_fallback_keeps_input_order(fast_fallback):
+    failed = [f"S{i}" for i in range(12)]
+
+    def behaviour(sym, n):
+        time.sleep(0.01 * (12 - int(sym[1:])))  # 後の銘柄ほど先に終わる
+        return None if sym == "S3" else row(sym)
+
+    fast_fallback(behaviour)
+    results = scan_dividends.fallback(failed)
+    assert list(results) == [s for s in failed if s != "S3"]
+    assert results["S5"] == row("S5")
+
+
+def test_fallback_retry_budget(fast_fallback, monkeypatch):
+    monkeypatch.setattr(scan_dividends, "FALLBACK_RETRY_BUDGET", 3)
+
+    def behaviour(sym, n):
+        if sym == "S1" and n == 1:
+            raise ConnectionError("一時的な失敗")
+        if sym == "S2":
+            raise ValueError("常に失敗")
+        if sym == "S3":
+            time.sleep(1.5)  # FALLBACK_TIMEOUT を超える
+        return row(sym)
+
+    calls = fast_fallback(behaviour)
+    errors = {}
+    results = scan_dividends.fallback(["S0", "S1", "S2", "S3"], errors=errors)
+    assert list(results) == ["S0", "S1"]
+    # 再試行は全体で3回まで（S1 の1回と、S2・S3 で残りの2回）
+    assert sum(calls.values()) == 4 + 3
+    assert errors == {"S2": "ValueError", "S3": "timeout"}
+
+
+def test_phase1_resume_skips_checkpointed_tickers(synthetic, monkeypatch):
+    synthetic.dead_rate = 0.2
+    tickers = synthetic.universe()
+    dead = [s for s in tickers.tickers if synthetic._dead(s)]
+    ok = [s for s in tickers.tickers if s not in dead]
+    # 前の実行が ok[:10] と dead[:2] を終えたところで落ちた
+    store.save_checkpoint("dividend", 1, {ok[0]: row("S1"), **dict.fromkeys(ok[1:10])}, dead[:2])
+
+    requested, fallback = [], []
+    update = dividend_index.update
+
+    def spy(batch, index):
+        requested.extend(batch)
+        return update(batch, index)
+
+    monkeypatch.setattr(dividend_index, "update", spy)
+    monkeypatch.setattr(scan_dividends, "fallback", lambda failed, **kwargs: fallback.extend(failed) or {})
+    qualified = scan_dividends.scan_all(tickers)
+
+    assert sorted(requested) == sorted(s for s in tickers.tickers if s not in ok[:10] + dead[:2])
+    assert sorted(fallback) == sorted(dead)
+    assert ok[0] in [r["ticker"] for r in qualified]
+    assert store.load_checkpoint("dividend") == ({}, [])
+
+
+def test_phase2_resume_skips_checkpointed_tickers(fast_fallback):
+    store.save_checkpoint("dividend", 2, {"S0": row("S0"), "S1": None})
+    calls = fast_fallback(lambda sym, n: row(sym))
+    results = scan_dividends.run_fallback(["S0", "S1", "S2"])
+    assert calls == {"S2": 1}
+    assert results == {"S0": row("S0"), "S2": row("S2")}
+
+
+def test_stream_yields_checkpointed_rows_before_fetching(synthetic, monkeypatch):
+    tickers = synthetic.universe()
+    store.save_checkpoint("dividend", 1, {tickers.tickers[0]: {**row("S1"), "dividend_yield": 0.9}})
+    requested = []
+    update = dividend_index.update
+
+    def spy(batch, index):
+        requested.extend(batch)
+        return update(batch, index)
+
+    monkeypatch.setattr(dividend_index, "update", spy)
+    stream = scan_dividends.scan_stream(tickers)
+    first = next(stream)
+    # 途中結果の銘柄は取得を始める前に返る
+    assert [r["ticker"] for r in first] == [tickers.tickers[0]]
+    assert requested == []
+    rest = list(stream)
+    assert rest and all(len(rows) for rows in rest)
+    for rows in rest:
+        ys = [r["dividend_yield"] for r in rows]
+        assert ys == sorted(ys, reverse=True)
+    assert tickers.tickers[0] not in requested
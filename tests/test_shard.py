@@ -0,0 +1,39 @@
+import argparse
+
+import pytest
+
+import main
+import scan_dividends
+import shard
+
+
+def test_select_partitions_tickers(synthetic):
+    tickers = synthetic.universe()
+    parts = [shard.select(tickers, i, 3).tickers for i in (1, 2, 3)]
+    assert sorted(sum(parts, [])) == sorted(tickers.tickers)
+    # 同じ銘柄は銘柄リストの並び・増減によらず同じシャードに入る
+    fewer = tickers.take(list(range(0, len(tickers), 2)))
+    assert shard.select(fewer, 2, 3).tickers == [t for t in fewer.tickers if t in parts[1]]
+
+
+def test_parse_and_path():
+    assert shard.parse("2/4") == (2, 4)
+    with pytest.raises(argparse.ArgumentTypeError):
+        shard.parse("5/4")
+    assert shard.path("cache/lows/state.npz", 2, 4) == "cache/lows/state-2of4.npz"
+
+
+def test_merge_matches_single_process(synthetic):
+    for i in (1, 2):
+        main.main(["--shard", f"{i}/2"])
+    rows, info = shard.read_partials("dividend", 2)
+    assert info["total"] == len(synthetic.universe())
+
+    single = scan_dividends.scan_all(synthetic.universe(), main.THRESHOLD)
+    assert sorted(rows, key=scan_dividends.by_yield) == single.to_records()
+
+
+def test_merge_requires_every_shard(synthetic):
+    shard.write_partial("dividend", 1, 2, [], 10, 1.0)
+    with pytest.raises(RuntimeError, match=r"\[2\]"):
+        shard.read_partials("dividend", 2)
@@ -0,0 +1,18 @@
+import sqlite3
+
+import store
+
+
+def test_fresh_db_runs_every_migration(workdir):
+    store.get()
+    conn = sqlite3.connect(store.DB_PATH)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(store.MIGRATIONS)
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert set(store.DELTA_GROUPS) <= tables
+
+
+def test_reopening_does_not_rerun_migrations():
+    store.save_lowcheck([{"code": "1301", "name": "1301", "price": 100.0,
+                          "low_26w": 99.5, "pct_26w": 0.5, "low_52w": 99.5, "pct_52w": 0.5}])
+    store.close()
+    assert store.get().select("SELECT code FROM lowcheck") == [("1301",)]
@@ -1,11 +1,20 @@
 """全角幅考慮のテキストユーティリティ"""
 
 import unicodedata
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def char_width(c: str) -> int:
+    """全角2, 半角1"""
+    return 2 if unicodedata.east_asian_width(c) in ("F", "W") else 1
 
 
 def width(s: str) -> int:
     """全角2, 半角1で文字幅を計算"""
-    return sum(2 if unicodedata.east_asian_width(c) in ("F", "W") else 1 for c in s)
+    if s.isascii():
+        return len(s)
+    return sum(char_width(c) for c in s)
 
 
 def pad(s: str, w: int) -> str:
@@ -15,9 +24,11 @@ def pad(s: str, w: int) -> str:
 
 def trunc(s: str, w: int) -> str:
     """全角考慮で切り詰め"""
+    if s.isascii():
+        return s[:w]
     cur = 0
     for i, c in enumerate(s):
-        cw = 2 if unicodedata.east_asian_width(c) in ("F", "W") else 1
+        cw = char_width(c)
         if cur + cw > w:
             return s[:i]
         cur += cw
@@ -25,5 +36,13 @@ def trunc(s: str, w: int) -> str:
 
 
 def fit(s: str, w: int) -> str:
-    """切り詰め+パディングで固定幅に"""
-    return pad(trunc(s, w), w)
+    """切り詰め+パディングで固定幅に（1回の走査で幅も数える）"""
+    if s.isascii():
+        return f"{s[:w]:<{w}}"
+    cur = 0
+    for i, c in enumerate(s):
+        cw = char_width(c)
+        if cur + cw > w:
+            return s[:i] + " " * (w - cur)
+        cur += cw
+    return s + " " * (w - cur)
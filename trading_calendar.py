@@ -0,0 +1,109 @@
+"""東証の営業日カレンダー
+
+土日・国民の祝日（振替休日・国民の休日を含む）・年末年始（12/31〜1/3）を休場日とする。
+祝日は現行の祝日法（2020年・2021年の五輪特例を除く）で計算し、春分・秋分は
+国立天文台の近似式（1980〜2099年で有効）で求める。臨時の休場は環境変数
+MARKET_CLOSED_DAYS にカンマ区切りの日付（YYYY-MM-DD）で追加できる。
+"""
+
+import os
+from datetime import date, timedelta
+from functools import lru_cache
+
+EXTRA_CLOSED = {
+    date.fromisoformat(d.strip())
+    for d in os.environ.get("MARKET_CLOSED_DAYS", "").split(",") if d.strip()
+}
+
+
+def _nth_monday(year: int, month: int, n: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(7 - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def _equinox(year: int, base: float) -> int:
+    return int(base + 0.242194 * (year - 1980) - (year - 1980) // 4)
+
+
+@lru_cache(maxsize=None)
+def holidays(year: int) -> frozenset[date]:
+    """year の国民の祝日（振替休日・国民の休日を含む）。"""
+    days = {
+        date(year, 1, 1),  # 元日
+        _nth_monday(year, 1, 2),  # 成人の日
+        date(year, 2, 11),  # 建国記念の日
+        date(year, 2, 23),  # 天皇誕生日
+        date(year, 3, _equinox(year, 20.8431)),  # 春分の日
+        date(year, 4, 29),  # 昭和の日
+        date(year, 5, 3),  # 憲法記念日
+        date(year, 5, 4),  # みどりの日
+        date(year, 5, 5),  # こどもの日
+        _nth_monday(year, 7, 3),  # 海の日
+        date(year, 8, 11),  # 山の日
+        _nth_monday(year, 9, 3),  # 敬老の日
+        date(year, 9, _equinox(year, 23.2488)),  # 秋分の日
+        _nth_monday(year, 10, 2),  # スポーツの日
+        date(year, 11, 3),  # 文化の日
+        date(year, 11, 23),  # 勤労感謝の日
+    }
+    # 国民の休日: 前後を祝日に挟まれた平日
+    for d in sorted(days):
+        between = d + timedelta(days=1)
+        if between + timedelta(days=1) in days and between not in days and between.weekday() != 6:
+            days.add(between)
+    # 振替休日: 日曜の祝日の後の最初の祝日でない日
+    for d in sorted(days):
+        if d.weekday() == 6:
+            sub = d + timedelta(days=1)
+            while sub in days:
+                sub += timedelta(days=1)
+            days.add(sub)
+    return frozenset(days)
+
+
+def is_trading_day(d: date) -> bool:
+    """d が東証の営業日か。"""
+    if d.weekday() >= 5 or d in EXTRA_CLOSED:
+        return False
+    if (d.month, d.day) in ((12, 31), (1, 2), (1, 3)):
+        return False
+    return d not in holidays(d.year)
+
+
+def next_trading_day(d: date) -> date:
+    """d 以降（d を含む）の最初の営業日。"""
+    while not is_trading_day(d):
+        d += timedelta(days=1)
+    return d
+
+
+@lru_cache(maxsize=None)
+def _busdaycalendar(first: int, last: int):
+    import numpy as np
+
+    closed = set(EXTRA_CLOSED)
+    for year in range(first, last + 1):
+        closed |= holidays(year) | {date(year, 12, 31), date(year, 1, 2), date(year, 1, 3)}
+    return np.busdaycalendar(holidays=sorted(closed))
+
+
+def trading_days_between(start, end):
+    """start より後、end より前の営業日数（負にはならない）。
+
+    start / end は date か datetime64[D] の配列（NaT は不可）で、配列なら要素ごとに数える。
+    """
+    import numpy as np
+
+    start = np.asarray(start, dtype="datetime64[D]") + 1
+    end = np.asarray(end, dtype="datetime64[D]")
+    if start.size == 0 or end.size == 0:
+        return np.zeros(np.broadcast_shapes(start.shape, end.shape), dtype=np.int64)
+    years = [int(d.astype("datetime64[Y]").astype(int)) + 1970 for d in (min(start.min(), end.min()),
+                                                                          max(start.max(), end.max()))]
+    return np.maximum(np.busday_count(start, end, busdaycal=_busdaycalendar(*years)), 0)
+
+
+def is_first_of_week(d: date) -> bool:
+    """d がその週（月〜金）の最初の営業日か。"""
+    monday = d - timedelta(days=d.weekday())
+    return is_trading_day(d) and next_trading_day(monday) == d
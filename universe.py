@@ -0,0 +1,164 @@
+"""銘柄ユニバースと、銘柄 ID をキーにした列指向の結果
+
+Universe は銘柄リストを列ごとに持つ（ticker / name は並列のリスト、業種は重複を除いた表への番号）。
+銘柄の ID はリスト内の位置で、スキャン結果（Results）も同じ ID と列ごとの NumPy 配列で持つ。
+レポート・DB には Row（Results の1行を指すビュー）を渡すので、1銘柄ごとの dict は作らない。
+Row は dict と同じく row["name"] / row.get("sector") で読めるので、シャードの途中結果（JSON）
+から戻した dict の行と同じ関数で扱える。
+"""
+
+import sys
+from array import array
+
+import numpy as np
+
+
+class Universe:
+    """銘柄リスト。i 番目の銘柄は tickers[i] / names[i] / sectors[sector_ids[i]]。"""
+
+    __slots__ = ("tickers", "names", "sectors", "sector_ids", "_ids")
+
+    def __init__(self, tickers: list[str], names: list[str], sectors: list[str]):
+        """sectors は銘柄ごとの業種名（内部では重複を除いた表と番号にする）。"""
+        table: dict[str, int] = {}
+        self.tickers = tickers
+        self.names = names
+        self.sector_ids = array("H", (table.setdefault(sys.intern(s), len(table)) for s in sectors))
+        self.sectors = tuple(table)
+        self._ids: dict[str, int] | None = None
+
+    @classmethod
+    def from_columns(cls, d: dict) -> "Universe":
+        """to_columns() の形式、または旧形式（[{"ticker", "name", "sector"}]）から作る。"""
+        if isinstance(d, list):
+            return cls([t["ticker"] for t in d], [t["name"] for t in d], [t["sector"] for t in d])
+        u = cls.__new__(cls)
+        u.tickers, u.names = d["tickers"], d["names"]
+        u.sectors = tuple(sys.intern(s) for s in d["sectors"])
+        u.sector_ids = array("H", d["sector_ids"])
+        u._ids = None
+        return u
+
+    def to_columns(self) -> dict:
+        """JSON に保存する形式。"""
+        return {"tickers": self.tickers, "names": self.names, "sectors": list(self.sectors),
+                "sector_ids": self.sector_ids.tolist()}
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def id(self, sym: str) -> int | None:
+        """銘柄の ID（リストに無ければ None）。"""
+        if self._ids is None:
+            self._ids = {t: i for i, t in enumerate(self.tickers)}
+        return self._ids.get(sym)
+
+    def sector(self, i: int) -> str:
+        return self.sectors[self.sector_ids[i]]
+
+    def take(self, ids) -> "Universe":
+        """ids の銘柄だけの Universe（業種の表は共有する）。"""
+        u = Universe.__new__(Universe)
+        u.tickers = [self.tickers[i] for i in ids]
+        u.names = [self.names[i] for i in ids]
+        u.sectors = self.sectors
+        u.sector_ids = array("H", (self.sector_ids[i] for i in ids))
+        u._ids = None
+        return u
+
+
+class Row:
+    """Results の1行のビュー。ticker / code / name / sector と結果の列を row[key] で読む。"""
+
+    __slots__ = ("_r", "_i")
+
+    def __init__(self, results: "Results", i: int):
+        self._r = results
+        self._i = i
+
+    def __getitem__(self, key: str):
+        r, i = self._r, self._i
+        if key == "ticker":
+            return r.universe.tickers[r.ids[i]]
+        if key == "code":
+            return r.universe.tickers[r.ids[i]].replace(".T", "")
+        if key == "name":
+            return r.universe.names[r.ids[i]]
+        if key == "sector":
+            return r.universe.sector(r.ids[i])
+        v = r.columns[key][i]
+        return v.item() if hasattr(v, "item") else v
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> list[str]:
+        return ["ticker", "code", "name", "sector", *self._r.columns]
+
+    def __repr__(self) -> str:
+        return f"Row({dict(self)!r})"
+
+
+class Results:
+    """銘柄 ID ごとの結果。ids[k] の銘柄の値が columns[列][k]。"""
+
+    __slots__ = ("universe", "ids", "columns")
+
+    def __init__(self, universe: Universe, ids: np.ndarray, columns: dict[str, np.ndarray]):
+        self.universe = universe
+        self.ids = ids
+        self.columns = columns
+
+    @classmethod
+    def from_frame(cls, universe: Universe, df, columns: list[str]) -> "Results":
+        """index が ticker の DataFrame から作る（列は DataFrame の配列をそのまま使う）。"""
+        ids = [universe.id(sym) for sym in df.index]
+        keep = np.array([i is not None for i in ids], dtype=bool)
+        if not keep.all():
+            df, ids = df[keep], [i for i in ids if i is not None]
+        return cls(universe, np.array(ids, dtype=np.int32), {c: df[c].to_numpy() for c in columns})
+
+    @classmethod
+    def from_records(cls, universe: Universe, records: dict[str, dict | None], columns: list[str]) -> "Results":
+        """{ticker: {列: 値} or None}（途中結果・Phase 2 の結果）から作る。None とリストに無い銘柄は除く。"""
+        ids, rows = [], []
+        for sym, r in records.items():
+            i = universe.id(sym)
+            if r and i is not None:
+                ids.append(i)
+                rows.append(r)
+        return cls(universe, np.array(ids, dtype=np.int32),
+                   {c: np.array([r[c] for r in rows], dtype=np.float64) for c in columns})
+
+    @classmethod
+    def concat(cls, universe: Universe, parts: list["Results"], columns: list[str]) -> "Results":
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls(universe, np.empty(0, dtype=np.int32), {c: np.empty(0) for c in columns})
+        return cls(universe, np.concatenate([p.ids for p in parts]),
+                   {c: np.concatenate([p.columns[c] for p in parts]) for c in columns})
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, k: int) -> Row:
+        return Row(self, k)
+
+    def __iter__(self):
+        for k in range(len(self.ids)):
+            yield Row(self, k)
+
+    def select(self, index) -> "Results":
+        """真偽値の配列または位置の配列で選んだ行。"""
+        return Results(self.universe, self.ids[index], {c: v[index] for c, v in self.columns.items()})
+
+    def sorted(self, key) -> "Results":
+        """key(row) の順に並べ替えた行（dict の行と同じ並び替えキーを使う）。"""
+        return self.select(np.array(sorted(range(len(self)), key=lambda k: key(self[k])), dtype=np.intp))
+
+    def to_records(self) -> list[dict]:
+        """JSON に書き出す形式（シャードの途中結果・途中結果の記録）。"""
+        return [dict(row) for row in self]